@@ -3,12 +3,14 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.figure import figaspect
 
+from ext_traj import ext_histogram, load_frame_ext
+
 ######################################################################
 ## Script to plot Extension Probability Density Function (PDF)      ##
 ######################################################################
 
 ## Usage
-# 1. Copy script to working dir
+# 1. Copy script to working dir (along with ext_traj.py)
 # 2. INPUT: set EXTENSION_VS_FRAME file (ext over time)
 # 3. INPUT: set HISTOGRAM and ROLLING_AVG params
 # 4. run with "python ext_pdf.py"
@@ -26,6 +28,13 @@ frame_step_fs = 2 * 100  # time (in fs) between frames = time_step (fs) * dcd_fr
 frame_index_start = -1  # Inclusive [-1 for no start bound]
 frame_index_end = -1 # 32e6 / frame_step_fs  # Exclusive [-1 for no end bound]
 
+# Streaming (optional): read the file(s) in chunks, keeping only the histogram counts (memory independent of trajectory
+# length). Histograms of all files (ex. replicas) are merged. The Extension vs Frame plot is skipped
+streaming = False
+streaming_files = [frame_vs_ext_file]  # frame vs extension files to merge
+streaming_chunk_size = 1_000_000  # lines per chunk
+streaming_workers = 4  # Number of threads (one file per thread)
+
 # Histogram parameters
 ext_start: float = 0.0
 ext_end: float = 100.0
@@ -58,17 +67,27 @@ comment_output_header = False
 
 # ----------------------------------------------------------------------
 
-# Dataframe
-frame_ext_df: pd.DataFrame = pd.read_csv(frame_vs_ext_file, sep=r"\s+", comment=COMMENT_TOKEN, names=("FRAME", "EXT"))
-if frame_index_start >= 0:
-    frame_ext_df = frame_ext_df[frame_ext_df["FRAME"] >= frame_index_start]
-
-if frame_index_end >= 0:
-    frame_ext_df = frame_ext_df[frame_ext_df["FRAME"] < frame_index_end]
-
-# Histogram
-ext_hist, ext_bin_edges = np.histogram(a=frame_ext_df["EXT"], bins=ext_bin_count, range=(ext_start, ext_end),
-                                       density=True)
+frame_ext_df = None
+
+if streaming:
+    # Histogram (merged over files, normalized at the end)
+    _ext_histogram = ext_histogram(streaming_files, ext_start=ext_start, ext_end=ext_end, bin_count=ext_bin_count,
+                                   frame_start=frame_index_start, frame_end=frame_index_end,
+                                   chunk_size=streaming_chunk_size, workers=streaming_workers)
+    ext_hist, ext_bin_edges = _ext_histogram.density(), _ext_histogram.bin_edges
+    print(f"Streamed {_ext_histogram.frames} frames ({_ext_histogram.counts.sum()} in extension range) from {len(streaming_files)} file(s)")
+else:
+    # Dataframe
+    frame_ext_df: pd.DataFrame = load_frame_ext(frame_vs_ext_file)  # parsed once, then loaded from a .npy sidecar
+    if frame_index_start >= 0:
+        frame_ext_df = frame_ext_df[frame_ext_df["FRAME"] >= frame_index_start]
+
+    if frame_index_end >= 0:
+        frame_ext_df = frame_ext_df[frame_ext_df["FRAME"] < frame_index_end]
+
+    # Histogram
+    ext_hist, ext_bin_edges = np.histogram(a=frame_ext_df["EXT"], bins=ext_bin_count, range=(ext_start, ext_end),
+                                           density=True)
 ext_pdf_df = pd.DataFrame()
 
 ext_col_label = (COMMENT_TOKEN if comment_output_header else "") + "EXT"
@@ -76,7 +95,7 @@ ext_pdf_df[ext_col_label] = ext_bin_edges[0:-1]
 ext_pdf_df["PDF"] = ext_hist
 
 meta_info_str = (
-    f"{COMMENT_TOKEN} INPUT Frame vs Extension file: \"{frame_vs_ext_file}\"\n"
+    f"{COMMENT_TOKEN} INPUT Frame vs Extension file(s): {streaming_files if streaming else [frame_vs_ext_file]}\n"
     f"{COMMENT_TOKEN} INPUT Frame Range => frame_index_start: {frame_index_start}  |  frame_index_end: {frame_index_end}\n"
     f"{COMMENT_TOKEN} INPUT Extension Range => ext_start: {ext_start}  |  ext_end: {ext_end}\n"
     f"{COMMENT_TOKEN} INPUT Extension Bins => Count: {ext_bin_count}  | Bin Size: {_ext_bin_size}\n"
@@ -115,17 +134,24 @@ if _rolling_win_bins > 0:
 # plt.title("Extension Distribution")
 
 has_time = frame_step_fs > 0
-if has_time:
-    frame_ext_df["TIME_NS"] = frame_ext_df["FRAME"] * (frame_step_fs * 1e-6)
-
 w, h = figaspect(9 / 23)
-fig, axes = plt.subplots(1, 2, figsize=(w * 1.4, h * 1.4))
-fig.tight_layout(pad=5.0)
 
-axes[0].plot(frame_ext_df["TIME_NS" if has_time else "FRAME"], frame_ext_df["EXT"])
-axes[0].set_title("Extension vs " + ("Time" if has_time else "Frame"))
-axes[0].set_xlabel("Time (ns)" if has_time else "Frame")
-axes[0].set_ylabel("Extension (Å)")
+if frame_ext_df is not None:
+    if has_time:
+        frame_ext_df["TIME_NS"] = frame_ext_df["FRAME"] * (frame_step_fs * 1e-6)
+
+    fig, axes = plt.subplots(1, 2, figsize=(w * 1.4, h * 1.4))
+    fig.tight_layout(pad=5.0)
+
+    axes[0].plot(frame_ext_df["TIME_NS" if has_time else "FRAME"], frame_ext_df["EXT"])
+    axes[0].set_title("Extension vs " + ("Time" if has_time else "Frame"))
+    axes[0].set_xlabel("Time (ns)" if has_time else "Frame")
+    axes[0].set_ylabel("Extension (Å)")
+else:
+    # Streaming: the trajectory is not kept in memory
+    fig, _ax = plt.subplots(1, 1, figsize=(w * 0.8, h * 1.4))
+    fig.tight_layout(pad=5.0)
+    axes = [None, _ax]
 
 axes[1].stairs(ext_hist, ext_bin_edges, fill=True, label=f"PDF ({ext_bin_count} bins, {_ext_bin_size} Å/bin)")
 if ext_pdf_avg_df is not None:
@@ -0,0 +1,771 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.integrate import trapezoid
+from scipy.ndimage import convolve1d
+from scipy.sparse import csgraph
+from scipy.sparse.linalg import spsolve
+
+########################################################################
+## Shared helpers for Extension Trajectory analysis
+## (sp_traj.py, sp_traj_wins.py, fpt.py, ext_pdf.py)
+########################################################################
+
+## Usage
+# Copy this file to the working dir along with the script(s) that import it
+
+## UNITS: Distance (Å)
+
+
+COMMENT_TOKEN = "#"
+
+FRAME_EXT_CACHE_EXT = ".frame_ext.npy"  # binary cache (sidecar) of a frame vs extension file
+FRAME_EXT_CACHE_META_EXT = ".frame_ext.json"  # key of the cache: size, mtime and hash of the source file
+FRAME_EXT_HASH_BLOCK_SIZE = 1024 * 1024  # bytes hashed at the start and at the end of the source file
+
+
+## ---------------------------- Loading ----------------------------
+
+def _frame_ext_key(file_name: str) -> dict:
+    # cheap identity of the source file: size, mtime and hash of its first and last blocks
+    st = os.stat(file_name)
+    h = hashlib.sha1()
+    with open(file_name, "rb") as fd:
+        h.update(fd.read(FRAME_EXT_HASH_BLOCK_SIZE))
+        if st.st_size > FRAME_EXT_HASH_BLOCK_SIZE:
+            fd.seek(max(FRAME_EXT_HASH_BLOCK_SIZE, st.st_size - FRAME_EXT_HASH_BLOCK_SIZE))
+            h.update(fd.read())
+
+    return {"source": os.path.basename(file_name), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": h.hexdigest()}
+
+
+def parse_frame_ext(file_name: str) -> np.ndarray:
+    """
+    Parse a "frame extension" text file (ex. dist_vs_frame.dat written by distance.tcl), "#" for comments
+
+    @return structured array with fields "FRAME" (int32, or float64 if the frames are not integers) and "EXT" (float64)
+    """
+
+    df = pd.read_csv(file_name, sep=r"\s+", comment=COMMENT_TOKEN, names=("FRAME", "EXT"), usecols=(0, 1),
+                     header=None, dtype={"FRAME": np.float64, "EXT": np.float64})
+    frames = df["FRAME"].to_numpy()
+    int_frames = len(frames) == 0 or (np.all(frames == np.round(frames)) and np.all(np.abs(frames) < 2 ** 31))
+
+    arr = np.empty(len(df), dtype=[("FRAME", np.int32 if int_frames else np.float64), ("EXT", np.float64)])
+    arr["FRAME"] = frames
+    arr["EXT"] = df["EXT"].to_numpy()
+    return arr
+
+
+def load_frame_ext_array(file_name: str, cache: bool = True) -> np.ndarray:
+    """
+    Frame vs Extension of a text file as a compact structured array (see parse_frame_ext)
+
+    The text is parsed only once: the array is saved to a .npy sidecar "<file_name>.frame_ext.npy", along with the
+    size, mtime and hash of the source file ("<file_name>.frame_ext.json"), and memory-mapped (read-only) by later
+    calls as long as the source file is unchanged
+
+    @param cache: whether to use (and write) the sidecar
+    """
+
+    if not cache:
+        return parse_frame_ext(file_name)
+
+    cache_file = file_name + FRAME_EXT_CACHE_EXT
+    meta_file = file_name + FRAME_EXT_CACHE_META_EXT
+    key = _frame_ext_key(file_name)
+
+    if os.path.isfile(cache_file) and os.path.isfile(meta_file):
+        try:
+            with open(meta_file, "r") as fd:
+                meta = json.load(fd)
+            if all(meta.get(k) == v for k, v in key.items()):
+                arr = np.load(cache_file, mmap_mode="r")
+                if arr.dtype["EXT"] == np.float64:  # sidecars of older versions stored a float32 EXT
+                    return arr
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Invalid frame_ext cache of \"{file_name}\" ({e}). Parsing again...")
+
+    arr = parse_frame_ext(file_name)
+    try:
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as fd:
+            np.save(fd, arr)
+        os.replace(tmp_file, cache_file)
+
+        with open(meta_file + ".tmp", "w") as fd:
+            json.dump(dict(key, count=len(arr), dtype=str(arr.dtype)), fd, indent=4)
+        os.replace(meta_file + ".tmp", meta_file)
+    except OSError as e:
+        print(f"WARNING: Failed to write frame_ext cache of \"{file_name}\": {e}")
+
+    return arr
+
+
+def load_frame_ext(file_name: str, cache: bool = True) -> pd.DataFrame:
+    """
+    Frame vs Extension DataFrame with columns "FRAME" (int32) and "EXT" (float64), parsed only once per file
+    (see load_frame_ext_array). The columns are copied out of the memory-mapped sidecar, so the DataFrame owns
+    its data and columns can be added or modified
+    """
+
+    arr = load_frame_ext_array(file_name, cache=cache)
+    return pd.DataFrame({"FRAME": np.array(arr["FRAME"]), "EXT": np.array(arr["EXT"])})
+
+
+
+def iter_frame_ext_chunks(file_name: str, chunk_size: int = 1_000_000):
+    """
+    Stream a "frame extension" text file in chunks of chunk_size lines, without loading it whole
+
+    @return generator of (frames, ext_values) arrays of each chunk
+    """
+
+    with pd.read_csv(file_name, sep=r"\s+", comment=COMMENT_TOKEN, names=("FRAME", "EXT"), usecols=(0, 1), header=None,
+                     dtype={"FRAME": np.float64, "EXT": np.float64}, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield chunk["FRAME"].to_numpy(), chunk["EXT"].to_numpy()
+
+
+class ExtHistogram:
+    """
+    Streaming extension histogram on a fixed grid of bin_count bins in [ext_start, ext_end]. Only the integer bin
+    counts are kept (O(bins) memory), histograms of different chunks, files or workers merge by addition, and
+    normalization happens only at the end (see density). Bins are as in np.histogram (last bin closed), and values
+    out of range are dropped
+    """
+
+    def __init__(self, ext_start: float, ext_end: float, bin_count: int):
+        self.bin_edges = np.histogram_bin_edges([], bins=bin_count, range=(ext_start, ext_end))  # same edges as np.histogram
+        self.counts = np.zeros(bin_count, dtype=np.int64)
+        self.frames = 0  # frames seen, in range or not
+
+    def update(self, ext_values: np.ndarray):
+        ext_values = np.asarray(ext_values, dtype=np.float64)
+        bin_count = len(self.counts)
+        ext_bin = np.searchsorted(self.bin_edges, ext_values, side="right") - 1
+        ext_bin[ext_values == self.bin_edges[-1]] = bin_count - 1
+
+        self.counts += np.bincount(ext_bin[(ext_bin >= 0) & (ext_bin < bin_count)], minlength=bin_count)
+        self.frames += len(ext_values)
+        return self
+
+    def merge(self, other: "ExtHistogram"):
+        if not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError("Cannot merge extension histograms with different bins")
+
+        self.counts += other.counts
+        self.frames += other.frames
+        return self
+
+    def __add__(self, other: "ExtHistogram") -> "ExtHistogram":
+        res = ExtHistogram(self.bin_edges[0], self.bin_edges[-1], len(self.counts))
+        return res.merge(self).merge(other)
+
+    def density(self) -> np.ndarray:
+        """
+        Probability Density Function (as np.histogram(density=True)). NaN if no value in range
+        """
+
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(len(self.counts), np.nan)
+        return self.counts / np.diff(self.bin_edges) / total
+
+
+def stream_ext_histogram(file_name: str,
+                         ext_start: float,
+                         ext_end: float,
+                         bin_count: int,
+                         frame_start: float = -1,
+                         frame_end: float = -1,
+                         chunk_size: int = 1_000_000) -> ExtHistogram:
+    """
+    Extension histogram of one frame vs extension file, streamed in chunks (see iter_frame_ext_chunks)
+
+    @param frame_start: inclusive [-1 for no start bound]
+    @param frame_end: exclusive [-1 for no end bound]
+    """
+
+    hist = ExtHistogram(ext_start, ext_end, bin_count)
+    for frames, ext_values in iter_frame_ext_chunks(file_name, chunk_size=chunk_size):
+        mask = np.ones(len(frames), dtype=bool)
+        if frame_start >= 0:
+            mask &= frames >= frame_start
+        if frame_end >= 0:
+            mask &= frames < frame_end
+        hist.update(ext_values[mask])
+
+    return hist
+
+
+def ext_histogram(files: list,
+                  ext_start: float,
+                  ext_end: float,
+                  bin_count: int,
+                  frame_start: float = -1,
+                  frame_end: float = -1,
+                  chunk_size: int = 1_000_000,
+                  workers: int = 4) -> ExtHistogram:
+    """
+    Merged extension histogram of many frame vs extension files (ex. replicas), each streamed in chunks, in parallel
+    threads (parsing and counting are in C, and the calling scripts have no __main__ guard for worker processes)
+    """
+
+    files = list(files)
+    args = (ext_start, ext_end, bin_count, frame_start, frame_end, chunk_size)
+
+    if workers > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            hists = list(executor.map(lambda f: stream_ext_histogram(f, *args), files))
+    else:
+        hists = [stream_ext_histogram(f, *args) for f in files]
+
+    res = ExtHistogram(ext_start, ext_end, bin_count)
+    for h in hists:
+        res.merge(h)
+    return res
+
+
+## ---------------------------- Splitting Probability ----------------------------
+
+def next_hit_indices(bin_values: np.ndarray, target_bin: int) -> np.ndarray:
+    """
+    Index of the next hit of target_bin, for every position of a discrete trajectory, in one backward pass
+
+    @param bin_values: discrete trajectory i.e. extension bin at each (time) position, shape (N,)
+    @param target_bin: extension bin to hit
+
+    @return int64 array of shape (N,), where element p is the smallest q >= p with bin_values[q] == target_bin,
+            or N if target_bin is never hit from p onwards
+    """
+
+    n = len(bin_values)
+    idx = np.where(np.asarray(bin_values) == target_bin, np.arange(n, dtype=np.int64), n)
+    return np.minimum.accumulate(idx[::-1])[::-1]
+
+
+def hits_first(bin_values: np.ndarray, x_a_bin: int, x_b_bin: int,
+               next_a: np.ndarray = None, next_b: np.ndarray = None) -> np.ndarray:
+    """
+    Hitting function: whether the trajectory, starting from each position, hits x_a_bin before x_b_bin
+
+    @param next_a, next_b: precomputed next_hit_indices() of x_a_bin and x_b_bin (optional)
+
+    @return bool array of shape (N + 1,). The extra last element (start past the end of the trajectory) is False
+    """
+
+    if next_a is None:
+        next_a = next_hit_indices(bin_values, x_a_bin)
+    if next_b is None:
+        next_b = next_hit_indices(bin_values, x_b_bin)
+
+    n = len(bin_values)
+    res = np.zeros(n + 1, dtype=bool)
+    res[:n] = (next_a < n) & (next_a <= next_b)  # x_a is checked first, so a tie (x_a_bin == x_b_bin) counts as a hit
+    return res
+
+
+def splitting_probability(bin_values: np.ndarray,
+                          start_positions: np.ndarray,
+                          x_a_bin: int,
+                          x_b_bin: int,
+                          hit: np.ndarray = None) -> tuple:
+    """
+    Splitting Probability Sp(fold) of each extension bin in [x_a_bin, x_b_bin]: the fraction of visits to the bin
+    from which the trajectory reaches x_a_bin before x_b_bin. Linear time (see next_hit_indices)
+
+    @param bin_values: discrete trajectory i.e. extension bin at each position, shape (N,)
+    @param start_positions: position from which the trajectory is followed for each visit, shape (N,).
+                            Usually np.arange(N), positions >= N never hit
+    @param hit: precomputed hits_first() of the trajectory (optional)
+
+    @return (sp, counts) arrays over the bins x_a_bin ... x_b_bin. sp of a bin with no visits is 0
+    """
+
+    bin_values = np.asarray(bin_values)
+    if hit is None:
+        hit = hits_first(bin_values, x_a_bin, x_b_bin)
+
+    n = len(bin_values)
+    bins = x_b_bin - x_a_bin + 1
+    rel = bin_values - x_a_bin
+    in_range = (rel >= 0) & (rel < bins)  # also drops NaN (unbinned) values
+
+    rel = rel[in_range].astype(np.int64)
+    counts = np.bincount(rel, minlength=bins)
+    hits = np.bincount(rel, weights=hit[np.minimum(np.asarray(start_positions)[in_range], n)], minlength=bins)
+    sp = np.divide(hits, counts, out=np.zeros(bins, dtype=np.float64), where=counts > 0)
+    return sp, counts
+
+
+def ext_bin_index(val: float, ext_bins: np.ndarray) -> int:
+    """
+    Index of the extension bin [ext_bins[i], ext_bins[i + 1]) containing val, or -1 if out of bounds
+    (same as find_bin() of sp_traj.py)
+    """
+
+    if len(ext_bins) < 2 or val < ext_bins[0] or val >= ext_bins[-1]:
+        return -1
+    return int(np.searchsorted(ext_bins, val, side="right")) - 1
+
+
+def reconstruct_pmf(sp: np.ndarray, ext_bin_range: np.ndarray, kbt: float) -> np.ndarray:
+    """
+    Reconstructed PMF from Sp(fold): PMF = kT ln(-dSp/dx), with the gradient over extension bins as in sp_traj.py.
+    Bins with a non-negative gradient give NaN or inf
+    """
+
+    if len(sp) < 2:
+        return np.full(len(sp), np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log(-np.gradient(sp, ext_bin_range)) * kbt
+
+
+def sp_boundary_sweep(bin_values: np.ndarray,
+                      start_positions: np.ndarray,
+                      ext_bins: np.ndarray,
+                      boundary_pairs: list,
+                      kbt: float,
+                      workers: int = 4) -> pd.DataFrame:
+    """
+    Splitting Probability Sp(x) and Reconstructed PMF for many pairs of absorbing boundaries over ONE discrete trajectory
+
+    The "next hit" index arrays (see next_hit_indices) are computed once per distinct boundary bin and shared by all
+    the pairs, which are evaluated in parallel threads (NumPy releases the GIL in the bulk array operations)
+
+    @param bin_values: discrete trajectory i.e. extension bin at each position, shape (N,)
+    @param start_positions: position from which the trajectory is followed for each visit (see splitting_probability)
+    @param ext_bins: extension bin edges (Å)
+    @param boundary_pairs: list of (x_a, x_b) absorbing boundaries (Å). Pairs out of bounds are skipped with a warning
+    @param kbt: thermal energy kT (kcal/mol), for the Reconstructed PMF
+
+    @return tidy DataFrame with one row per (pair, extension bin), columns
+            X_A, X_B, EXT_BIN, EXT_BIN_START, EXT_BIN_END, EXT_BIN_MED, COUNT, SP, PMF_RE
+    """
+
+    bin_values = np.asarray(bin_values)
+    ext_bins = np.asarray(ext_bins)
+
+    pairs = []
+    for x_a, x_b in boundary_pairs:
+        a, b = ext_bin_index(x_a, ext_bins), ext_bin_index(x_b, ext_bins)
+        if a == -1 or b == -1 or a > b:
+            print(f"WARNING: Absorbing boundaries x_a: {x_a}, x_b: {x_b} are invalid or out of bounds"
+                  f" [{ext_bins[0]}, {ext_bins[-1]}). Skipping...")
+            continue
+        pairs.append((x_a, x_b, a, b))
+
+    next_hits = dict((_bin, next_hit_indices(bin_values, _bin)) for p in pairs for _bin in p[2:])
+
+    def _pair_df(pair) -> pd.DataFrame:
+        x_a, x_b, a, b = pair
+        hit = hits_first(bin_values, a, b, next_a=next_hits[a], next_b=next_hits[b])
+        sp, counts = splitting_probability(bin_values, start_positions, a, b, hit=hit)
+        ext_bin_range = np.arange(a, b + 1)
+
+        return pd.DataFrame({
+            "X_A": x_a,
+            "X_B": x_b,
+            "EXT_BIN": ext_bin_range,
+            "EXT_BIN_START": ext_bins[ext_bin_range],
+            "EXT_BIN_END": ext_bins[ext_bin_range + 1],
+            "EXT_BIN_MED": (ext_bins[ext_bin_range] + ext_bins[ext_bin_range + 1]) / 2,
+            "COUNT": counts,
+            "SP": sp.astype(np.float32),
+            "PMF_RE": reconstruct_pmf(sp.astype(np.float32), ext_bin_range, kbt)
+        })
+
+    if workers > 1 and len(pairs) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            dfs = list(executor.map(_pair_df, pairs))
+    else:
+        dfs = list(map(_pair_df, pairs))
+
+    if not dfs:
+        return pd.DataFrame(columns=["X_A", "X_B", "EXT_BIN", "EXT_BIN_START", "EXT_BIN_END", "EXT_BIN_MED",
+                                     "COUNT", "SP", "PMF_RE"])
+    return pd.concat(dfs, ignore_index=True)
+
+
+## ---------------------------- Markov State Model ----------------------------
+
+def transition_counts(bin_values: np.ndarray, n_bins: int, lag: int = 1,
+                      counts: sparse.csr_matrix = None) -> sparse.csr_matrix:
+    """
+    Sparse lag-τ transition count matrix C[i, j] = number of transitions bin i -> bin j after lag positions,
+    of a discrete trajectory, in one vectorized pass. Pairs with an unbinned (NaN) end are skipped
+
+    @param n_bins: number of extension bins (shape of C is (n_bins, n_bins))
+    @param lag: lag time τ (in positions of the discrete trajectory)
+    @param counts: count matrix of other trajectories (on the same bins) to add to, or None
+
+    @return count matrix (CSR). Counts of many trajectories just add up
+    """
+
+    bin_values = np.asarray(bin_values, dtype=np.float64)
+    lag = max(1, int(lag))
+    _from, _to = bin_values[:-lag], bin_values[lag:]
+    ok = np.isfinite(_from) & np.isfinite(_to)
+
+    c = sparse.coo_matrix((np.ones(np.count_nonzero(ok)), (_from[ok].astype(np.int64), _to[ok].astype(np.int64))),
+                          shape=(n_bins, n_bins)).tocsr()
+    return c if counts is None else counts + c
+
+
+def transition_matrix(counts: sparse.spmatrix, reversible: bool = True) -> sparse.csr_matrix:
+    """
+    Row-stochastic transition matrix T of a Markov State Model from its transition counts.
+    Rows of unvisited bins are all 0
+
+    @param counts: lag-τ transition count matrix (see transition_counts)
+    @param reversible: whether to symmetrize the counts (C + C^T) / 2, i.e. enforce detailed balance
+    """
+
+    c = sparse.csr_matrix(counts, dtype=np.float64)
+    if reversible:
+        c = (c + c.T) / 2
+
+    row_sums = np.asarray(c.sum(axis=1)).ravel()
+    return sparse.csr_matrix(sparse.diags(np.divide(1, row_sums, out=np.zeros(len(row_sums)), where=row_sums > 0)) @ c)
+
+
+def _reaching(t: sparse.csr_matrix, target_bins) -> np.ndarray:
+    # bins that can reach any of the target bins, i.e. reachable from them on the reversed transition graph
+    t_rev = t.T.tocsr()
+    reach = np.zeros(t.shape[0], dtype=bool)
+    for _bin in np.atleast_1d(target_bins):
+        reach[csgraph.breadth_first_order(t_rev, int(_bin), directed=True, return_predecessors=False)] = True
+    return reach
+
+
+def msm_committor(counts: sparse.spmatrix, x_a_bin: int, x_b_bin: int, reversible: bool = True) -> np.ndarray:
+    """
+    Committor (Splitting Probability Sp(fold)) of every bin from a Markov State Model: the probability of reaching
+    x_a_bin before x_b_bin. Solves the boundary value problem
+        q(x_a_bin) = 1,  q(x_b_bin) = 0,  q(i) = Σ_j T[i, j] q(j) for every other visited bin i
+    with a sparse linear solver, where T is the row-normalized transition count matrix
+
+    @param counts: lag-τ transition count matrix (see transition_counts)
+    @param reversible: whether to symmetrize the counts (C + C^T) / 2, i.e. enforce detailed balance
+
+    @return committor of shape (n_bins,). NaN for bins that are not visited or not connected to x_a_bin or x_b_bin
+    """
+
+    if x_a_bin == x_b_bin:
+        raise ValueError(f"x_a_bin and x_b_bin must be different, given: {x_a_bin}")
+
+    t = transition_matrix(counts, reversible=reversible)
+    visited = np.diff(t.indptr) > 0
+
+    q = np.full(t.shape[0], np.nan)
+    q[x_a_bin], q[x_b_bin] = 1.0, 0.0
+
+    # only bins that can reach a boundary (others would make the system singular)
+    interior = _reaching(t, (x_a_bin, x_b_bin)) & visited
+    interior[[x_a_bin, x_b_bin]] = False
+    idx = np.flatnonzero(interior)
+    if len(idx):
+        t_ii = t[idx][:, idx]
+        rhs = t[idx][:, [x_a_bin]].toarray().ravel()
+        q[idx] = spsolve((sparse.identity(len(idx), format="csr") - t_ii).tocsc(), rhs)
+
+    return q
+
+
+def msm_first_passage(counts: sparse.spmatrix,
+                      start_bins,
+                      absorbing_bins,
+                      n_steps: int,
+                      reversible: bool = True) -> tuple:
+    """
+    First Passage Time distribution into a set of absorbing bins, and Mean First Passage Times, from a
+    Markov State Model. With Q the transition matrix among the transient bins and r the one-step absorption
+    probabilities, starting from the distribution p0 (uniform over start_bins)
+        FPT(n) = p0 Q^(n-1) r      (repeated sparse vector-matrix products, n = 1 ... n_steps)
+        MFPT   = (I - Q)^-1 1      (sparse linear solve)
+    in units of the lag time τ. Cost depends on the number of bins, not on the trajectory length
+
+    @param counts: lag-τ transition count matrix (see transition_counts)
+    @param start_bins: bin(s) of the initial state
+    @param absorbing_bins: bins of the absorbing (final) state
+    @param n_steps: number of lag times of the FPT distribution
+
+    @return (fptd, mfpt): fptd of shape (n_steps,) (probability of first passage at step n = 1 ... n_steps),
+            mfpt of shape (n_bins,) (0 in absorbing bins, NaN in bins that are unvisited or never absorbed)
+    """
+
+    t = transition_matrix(counts, reversible=reversible)
+    n = t.shape[0]
+    absorbing = np.zeros(n, dtype=bool)
+    absorbing[np.atleast_1d(absorbing_bins)] = True
+
+    # transient bins that eventually get absorbed (others would make I - Q singular)
+    transient = _reaching(t, np.flatnonzero(absorbing)) & (np.diff(t.indptr) > 0) & ~absorbing
+    idx = np.flatnonzero(transient)
+
+    mfpt = np.full(n, np.nan)
+    mfpt[absorbing] = 0.0
+    fptd = np.zeros(n_steps)
+    if len(idx) == 0:
+        return fptd, mfpt
+
+    t_idx = t[idx]
+    q = t_idx[:, idx].tocsr()
+    r = np.asarray(t_idx[:, absorbing].sum(axis=1)).ravel()
+    mfpt[idx] = spsolve((sparse.identity(len(idx), format="csr") - q).tocsc(), np.ones(len(idx)))
+
+    p = np.zeros(len(idx))
+    start = np.atleast_1d(start_bins)
+    p[np.isin(idx, start)] = 1
+    if p.sum() == 0:
+        return fptd, mfpt
+
+    p /= len(start)  # starting mass in bins that never get absorbed is lost
+    q_t = q.T.tocsr()
+    for i in range(n_steps):
+        fptd[i] = p @ r
+        p = q_t @ p
+
+    return fptd, mfpt
+
+
+## ---------------------------- Windows ----------------------------
+
+_window_shared = {}  # trajectory shared by the window worker processes (see _init_window_worker)
+
+
+def _init_window_worker(bin_values: np.ndarray, start_positions: np.ndarray, next_hits: dict):
+    _window_shared["bin_values"] = bin_values
+    _window_shared["start_positions"] = start_positions
+    _window_shared["next_hits"] = next_hits
+
+
+def _window_sp(bounds: tuple) -> tuple:
+    a, b = bounds
+    bin_values, next_hits = _window_shared["bin_values"], _window_shared["next_hits"]
+    hit = hits_first(bin_values, a, b, next_a=next_hits[a], next_b=next_hits[b])
+    return splitting_probability(bin_values, _window_shared["start_positions"], a, b, hit=hit)
+
+
+def sp_windows(bin_values: np.ndarray,
+               start_positions: np.ndarray,
+               window_bounds: list,
+               workers: int = 4) -> list:
+    """
+    Splitting Probability Sp(x) in many windows of ONE discrete trajectory, in parallel worker processes
+
+    The trajectory and the "next hit" index arrays of all the window boundary bins are computed once, and handed to
+    each worker once (at start-up), so every window costs a single linear pass.
+    NOTE: the calling script must have a __name__ == "__main__" guard
+
+    @param bin_values: discrete trajectory i.e. extension bin at each position, shape (N,)
+    @param start_positions: position from which the trajectory is followed for each visit (see splitting_probability)
+    @param window_bounds: list of (x_a_bin, x_b_bin) absorbing boundary bins, one per window
+
+    @return list of (sp, counts), one per window (see splitting_probability)
+    """
+
+    bin_values = np.asarray(bin_values)
+    start_positions = np.asarray(start_positions)
+    window_bounds = [(int(a), int(b)) for a, b in window_bounds]
+    next_hits = dict((_bin, next_hit_indices(bin_values, _bin)) for w in window_bounds for _bin in w)
+    init_args = (bin_values, start_positions, next_hits)
+
+    if workers > 1 and len(window_bounds) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_window_worker, initargs=init_args) as executor:
+            return list(executor.map(_window_sp, window_bounds))
+
+    _init_window_worker(*init_args)
+    try:
+        return list(map(_window_sp, window_bounds))
+    finally:
+        _window_shared.clear()
+
+
+def stitch_window_pmfs(windows: list) -> tuple:
+    """
+    Stitch the PMFs of overlapping windows into one continuous PMF
+
+    Each PMF is only known up to an additive constant. The constants (offsets) are found by least squares, minimizing
+    the squared difference of every pair of windows over their common (finite) bins, with the offset of the
+    first window fixed at 0. Windows that do not overlap any other are left at offset 0.
+    The stitched PMF of a bin is the mean of the offset PMFs of all windows covering it
+
+    @param windows: list of (ext_bin_range, pmf) arrays, one per window
+
+    @return (offsets, ext_bin_range, pmf) of the stitched PMF over all the bins of all windows (NaN where no window
+            has a finite value)
+    """
+
+    n_win = len(windows)
+    if n_win == 0:
+        return np.empty(0), np.empty(0, dtype=np.int64), np.empty(0)
+
+    series = [pd.Series(np.asarray(pmf, dtype=np.float64), index=np.asarray(bins, dtype=np.int64))
+              for bins, pmf in windows]
+    series = [s[np.isfinite(s.to_numpy())] for s in series]
+
+    rows, rhs = [], []
+    for i in range(n_win):
+        for j in range(i + 1, n_win):
+            common = series[i].index.intersection(series[j].index)
+            if len(common) == 0:
+                continue
+
+            # (pmf_i + c_i) - (pmf_j + c_j) = 0  =>  c_i - c_j = pmf_j - pmf_i
+            row = np.zeros(n_win)
+            row[i], row[j] = 1, -1
+            rows.append(np.broadcast_to(row, (len(common), n_win)))
+            rhs.append(series[j][common].to_numpy() - series[i][common].to_numpy())
+
+    offsets = np.zeros(n_win)
+    if rows:
+        # drop the first window's column (c_0 = 0) and solve for the rest
+        a = np.concatenate(rows)[:, 1:]
+        offsets[1:] = np.linalg.lstsq(a, np.concatenate(rhs), rcond=None)[0]
+
+    all_bins = np.arange(min(int(np.min(b)) for b, _ in windows if len(b)),
+                         max(int(np.max(b)) for b, _ in windows if len(b)) + 1)
+    total = np.zeros(len(all_bins))
+    count = np.zeros(len(all_bins))
+    for s, c in zip(series, offsets):
+        idx = s.index.to_numpy() - all_bins[0]
+        total[idx] += s.to_numpy() + c
+        count[idx] += 1
+
+    pmf = np.divide(total, count, out=np.full(len(all_bins), np.nan), where=count > 0)
+    return offsets, all_bins, pmf
+
+
+## ---------------------------- First Passage Time ----------------------------
+
+def prefix_pdf_areas(frames: np.ndarray,
+                     ext_values: np.ndarray,
+                     sample_frames: np.ndarray,
+                     ext_bin_edges: np.ndarray,
+                     x_a: float,
+                     x_b: float,
+                     density: bool = True) -> np.ndarray:
+    """
+    Area under the extension PDF in [x_a, x_b], of the trajectory up to each sample frame (frames < sample frame)
+
+    Every frame is binned once on the fixed grid ext_bin_edges, and the histogram of every prefix is the
+    cumulative sum of the per-sample bin counts, so all the areas come from one vectorized pass.
+    Bins are [edge_i, edge_i+1) with the last one closed, as in np.histogram
+
+    @param sample_frames: increasing frame instants, shape (S,)
+    @param density: normalize each prefix histogram to a PDF (as np.histogram(density=True))
+
+    @return areas of shape (S,), trapezoidal over the bin centers from the bin of x_a to the bin of x_b.
+            NaN for a prefix without frames in the grid (with density)
+    """
+
+    ext_bin_edges = np.asarray(ext_bin_edges, dtype=np.float64)
+    sample_frames = np.asarray(sample_frames)
+    n_bins = len(ext_bin_edges) - 1
+    n_samples = len(sample_frames)
+
+    ext_values = np.asarray(ext_values, dtype=np.float64)
+    ext_bin = np.searchsorted(ext_bin_edges, ext_values, side="right") - 1
+    ext_bin[ext_values == ext_bin_edges[-1]] = n_bins - 1
+    sample = np.searchsorted(sample_frames, np.asarray(frames), side="right")  # first sample including the frame
+    ok = (ext_bin >= 0) & (ext_bin < n_bins) & (sample < n_samples)
+
+    counts = np.bincount(sample[ok] * n_bins + ext_bin[ok], minlength=n_samples * n_bins)
+    hist = np.cumsum(counts.reshape(n_samples, n_bins), axis=0, dtype=np.float64)
+
+    if density:
+        total = hist.sum(axis=1, keepdims=True)
+        hist = np.divide(hist, total * np.diff(ext_bin_edges), out=np.full_like(hist, np.nan), where=total > 0)
+
+    xa_bin = np.searchsorted(ext_bin_edges, x_a) - 1
+    xb_bin = np.searchsorted(ext_bin_edges, x_b) - 1
+    centers = (ext_bin_edges[:-1] + ext_bin_edges[1:]) / 2
+    return trapezoid(hist[:, xa_bin: xb_bin + 1], x=centers[xa_bin: xb_bin + 1], axis=1)
+
+
+def passage_events(frames: np.ndarray,
+                   ext_values: np.ndarray,
+                   x_a: float,
+                   x_b: float,
+                   start: str = "entry") -> dict:
+    """
+    First passage events between the states A (ext <= x_a) and B (ext >= x_b) of a trajectory, in one vectorized pass
+
+    An A -> B event ends at the first arrival in B after a visit to A, and starts at
+        "entry": the first arrival in A since the last visit to B (First Passage Time), or
+        "exit": the last frame in A before the arrival in B (Transition Path Time)
+    and the B -> A events likewise
+
+    @return dict {"AB": (start_frames, end_frames), "BA": (start_frames, end_frames)}
+    """
+
+    if start not in ("entry", "exit"):
+        raise ValueError(f"start must be one of [entry, exit], given: '{start}'")
+
+    frames = np.asarray(frames)
+    ext_values = np.asarray(ext_values, dtype=np.float64)
+    core = np.where(ext_values <= x_a, 1, np.where(ext_values >= x_b, 2, 0))
+
+    idx = np.flatnonzero(core)  # frames in A or B
+    state = core[idx]
+    change = np.flatnonzero(state[1:] != state[:-1]) + 1  # arrivals in the other state (positions in idx)
+
+    run_start = np.concatenate(([0], change))[:-1]  # first position of the run left by each arrival
+    depart = idx[run_start] if start == "entry" else idx[change - 1]
+    arrive = idx[change]
+    source = state[change - 1]
+
+    return dict((name, (frames[depart[source == s]], frames[arrive[source == s]])) for name, s in (("AB", 1), ("BA", 2)))
+
+
+def fpt_statistics(durations: np.ndarray, bin_count: int = 50, kde: bool = True) -> dict:
+    """
+    Distribution, survival function and mean of first passage times
+
+    @param durations: passage times of the events
+    @param bin_count: number of time bins in [0, max duration]
+    @param kde: also estimate the density by a binned Gaussian kernel density estimate (Silverman bandwidth,
+                reflected at t = 0)
+
+    @return dict with "count", "mean", "std", "sem", and arrays over the time bins: "bin_edges", "pdf",
+            "kde" (None if not asked or less than 2 events), "survival" (fraction of events longer than each bin end)
+    """
+
+    durations = np.sort(np.asarray(durations, dtype=np.float64))
+    n = len(durations)
+    t_max = durations[-1] if n and durations[-1] > 0 else 1.0
+    bin_edges = np.linspace(0, t_max, bin_count + 1)
+
+    counts = np.histogram(durations, bins=bin_edges)[0]
+    width = bin_edges[1] - bin_edges[0]
+    pdf = counts / (n * width) if n else np.zeros(bin_count)
+    survival = 1 - np.searchsorted(durations, bin_edges[1:], side="right") / max(n, 1)
+
+    density = None
+    std = float(durations.std(ddof=1)) if n > 1 else np.nan
+    if kde and n > 1:
+        h = 1.06 * std * n ** (-1 / 5) if std > 0 else width
+        half = int(np.ceil(4 * h / width))
+        kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * width / h) ** 2)
+        kernel /= kernel.sum()
+        # reflected at t = 0 (and at the last bin), for any kernel length
+        density = convolve1d(counts.astype(np.float64), kernel, mode="reflect") / (n * width)
+
+    return {
+        "count": n,
+        "mean": float(durations.mean()) if n else np.nan,
+        "std": std,
+        "sem": std / np.sqrt(n) if n > 1 else np.nan,
+        "bin_edges": bin_edges,
+        "pdf": pdf,
+        "kde": density,
+        "survival": survival
+    }
@@ -1,7 +1,9 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import scipy
+from concurrent.futures import ThreadPoolExecutor
+
+from ext_traj import fpt_statistics, load_frame_ext, msm_first_passage, passage_events, prefix_pdf_areas, transition_counts
 
 """
 Script to calculate First Passage Time (FPT) distribution from Simulation Trajectory
@@ -16,12 +18,12 @@ From simulation data i.e frame_vs_extension:
     FPT(frame=f) = -ve gradient w.r.t to frame at frame=f { area under ( extension_pdf upto frame=f ) in range [x_a, x_b] }
     
 ## Usage
-# 1. Copy script to working dir
+# 1. Copy script to working dir (along with ext_traj.py)
 # 2. INPUT: set EXTENSION_VS_FRAME file (ext over time)
 # 3. INPUT: set x_a, x_b, frame_range etc parameters
 # 4. OUTPUT: set output data and plot file names
 # 4. run with "python fpt.py"
-# 5. Creates output file "fpt.csv", "fpt.pdf"
+# 5. Creates output file "fpt.csv", "fpt.pdf" (and "fpt_events.csv", "fpt_events_dist.csv" if fpt_event_files are set, "fpt_msm.csv" if fpt_msm)
 UNITS: Distance (Å)
 """
 
@@ -43,6 +45,10 @@ x_b: float = 37.7  # TODO: right Boundary (Å)
 ext_bin_count: int = 100
 _ext_bin_size: float = (x_b - x_a) / ext_bin_count
 
+# Fixed extension grid of the histograms (Å). None for the min/max extension in the Frame Range
+ext_start: float = None
+ext_end: float = None
+
 normalize_pdf = True
 
 ## Output --------------------------------------------------------------
@@ -54,24 +60,32 @@ normalize_fpt = True
 output_fpt_data_file = "fpt_traj-2.csv"
 output_fpt_fig_file = "fpt_traj-2.pdf"
 
+## Event-based FPT (optional) ------------------------------------------
+# First passage events A (ext <= x_a) -> B (ext >= x_b) and B -> A, detected directly from the crossings of x_a and x_b
+fpt_event_files = []  # TODO: frame_vs_ext files (ex. [frame_vs_ext_file]), processed in parallel. Empty to skip
+fpt_event_start = "entry"  # "entry": from first arrival in the source state (FPT) | "exit": from last frame in it (transition path time)
+fpt_event_bin_count = 50  # time bins of the event FPT distribution
+fpt_event_kde = True  # also a binned Gaussian kernel density estimate
+fpt_event_workers = 4  # Number of threads
 
-## ----------------------------------------------------------------------------
-
-def agg_forward(arr: np.ndarray, agg_func, out_dtype=np.float32) -> np.ndarray:
-    samples = len(arr) - 1
-    res = np.zeros(samples, dtype=out_dtype)
+output_fpt_events_file = "fpt_events.csv"  # all events: FILE, DIRECTION, START_FRAME, END_FRAME, FPT
+output_fpt_events_dist_file = "fpt_events_dist.csv"  # distribution, KDE and survival function per direction
 
-    for i in range(samples):
-        res[i] = agg_func(arr[i], arr[i + 1])
-    return res
+## Spectral FPT (optional) ---------------------------------------------
+# FPT distribution from x_a into the absorbing state (ext >= x_b), and Mean First Passage Times, from the transition
+# matrix between the extension bins (grid: ext_start, ext_end, ext_bin_count). Extends far beyond the simulated time
+fpt_msm = False
+fpt_msm_lag: int = 1  # lag time τ (in frames) of the transitions
+fpt_msm_steps: int = 10000  # number of lag times in the FPT distribution
+fpt_msm_reversible = True  # Symmetrize transition counts (detailed balance)
 
+output_fpt_msm_file = "fpt_msm.csv"
 
-def agg_forward_mean(arr: np.ndarray) -> np.ndarray:
-    return agg_forward(arr, lambda a, b: (a + b) / 2)
 
+## ----------------------------------------------------------------------------
 
 # Dataframe
-frame_ext_df: pd.DataFrame = pd.read_csv(frame_vs_ext_file, sep=r"\s+", comment=COMMENT_TOKEN, names=("FRAME", "EXT"))
+frame_ext_df: pd.DataFrame = load_frame_ext(frame_vs_ext_file)  # parsed once, then loaded from a .npy sidecar
 if frame__start >= 0:
     frame_ext_df = frame_ext_df[frame_ext_df["FRAME"] >= frame__start]
 
@@ -88,26 +102,19 @@ print(f"FPT Sam[les: {fpt_sample_count}")
 
 _start = frame__start if frame__start > 0 else 0
 frame_instants_arr = _start + np.array([(i + 1) * fpt_frame_step for i in range(fpt_sample_count)])
-area_arr = np.zeros((fpt_sample_count,), dtype=np.float128)
-
-for i in range(fpt_sample_count):
-    _frame_instant = frame_instants_arr[i]
-    _ext = frame_ext_df[frame_ext_df["FRAME"] < _frame_instant]["EXT"].values
-
-    # Histogram
-    ext_hist, ext_bin_edges = np.histogram(a=_ext,
-                                           bins=ext_bin_count,
-                                           # range=(ext_start, ext_end),
-                                           density=normalize_pdf)
 
-    xa_bin = np.searchsorted(ext_bin_edges, x_a) - 1
-    xb_bin = np.searchsorted(ext_bin_edges, x_b) - 1
-    ext_vals = agg_forward_mean(ext_bin_edges)
+# Every frame is binned once on a fixed grid, and the histograms upto each instant are cumulative sums
+_ext_start = ext_start if ext_start is not None else frame_ext_df["EXT"].min()
+_ext_end = ext_end if ext_end is not None else frame_ext_df["EXT"].max()
+ext_bin_edges = np.linspace(_ext_start, _ext_end, ext_bin_count + 1)
 
-    # plt.stairs(ext_hist, ext_bin_edges, label=f"{frame_end * frame_step_fs * 1e-6:g} ns")
-
-    area = scipy.integrate.trapezoid(y=ext_hist[xa_bin: xb_bin + 1], x=ext_vals[xa_bin: xb_bin + 1])
-    area_arr[i] = area
+area_arr = prefix_pdf_areas(frames=frame_ext_df["FRAME"].to_numpy(),
+                            ext_values=frame_ext_df["EXT"].to_numpy(),
+                            sample_frames=frame_instants_arr,
+                            ext_bin_edges=ext_bin_edges,
+                            x_a=x_a,
+                            x_b=x_b,
+                            density=normalize_pdf)
 
 # plt.legend(loc="upper right")
 # plt.savefig("fpt-1-test.pdf")
@@ -144,6 +151,7 @@ if output_fpt_data_file:
         f"INPUT frame_vs_ext file: \"{frame_vs_ext_file}\"",
         f"INPUT Frame Range: [{frame__start}, {frame__end}] | Frame Count: {frame_count} | Time b/w Frames: {f'{frame_step_fs} fs' if frame_step_fs > 0 else '<Not-Set>'}",
         f"INPUT x_a: {x_a} | x_b: {x_b} | x_bins: {ext_bin_count} | x_bin_size: {_ext_bin_size} | Normalize PDF: {normalize_pdf}",
+        f"INPUT Extension Grid: [{_ext_start}, {_ext_end}] | {ext_bin_count} bins",
         "-----------------------------------------------",
         f"OUTPUT -> FPT Frame Step: {fpt_frame_step} | FPT samples: {fpt_sample_count} | Normalize FPT: {normalize_fpt}",
         "-----------------------------------------------"
@@ -155,6 +163,110 @@ if output_fpt_data_file:
 
         res_df.to_csv(f, sep="\t", mode="a", header=True, index=False, index_label=False)
 
+# Spectral FPT ----------------------------
+if fpt_msm:
+    _ext_arr = frame_ext_df["EXT"].to_numpy()
+    msm_ext_bins = np.searchsorted(ext_bin_edges, _ext_arr, side="right") - 1.0
+    msm_ext_bins[_ext_arr == ext_bin_edges[-1]] = ext_bin_count - 1
+    msm_ext_bins[(msm_ext_bins < 0) | (msm_ext_bins >= ext_bin_count)] = np.nan
+
+    msm_xa_bin = np.searchsorted(ext_bin_edges, x_a, side="right") - 1
+    msm_xb_bin = np.searchsorted(ext_bin_edges, x_b, side="right") - 1
+    if not (0 <= msm_xa_bin < msm_xb_bin < ext_bin_count):
+        print(f"ERR: x_a: {x_a} and x_b: {x_b} must be increasing and in the Extension Grid [{_ext_start}, {_ext_end}]")
+        exit(-1)
+
+    msm_fptd, msm_mfpt = msm_first_passage(transition_counts(msm_ext_bins, n_bins=ext_bin_count, lag=fpt_msm_lag),
+                                           start_bins=msm_xa_bin,
+                                           absorbing_bins=np.arange(msm_xb_bin, ext_bin_count),
+                                           n_steps=fpt_msm_steps,
+                                           reversible=fpt_msm_reversible)
+
+    msm_frames = np.arange(1, fpt_msm_steps + 1) * fpt_msm_lag
+    msm_df = pd.DataFrame()
+    msm_df["FRAME"] = msm_frames
+    if frame_step_fs > 0:
+        msm_df["TIME"] = msm_frames * frame_step_fs * 1e-15
+    msm_df["FPTD"] = msm_fptd
+    msm_df["SURVIVAL"] = 1 - np.cumsum(msm_fptd)
+
+    _mfpt_frames = msm_mfpt[msm_xa_bin] * fpt_msm_lag
+    print(f"Spectral FPT: absorbed within {fpt_msm_steps} lag times: {np.sum(msm_fptd):.4f} | MFPT: {_mfpt_frames:g} frames"
+          + (f" ({_mfpt_frames * frame_step_fs * 1e-15:g} s)" if frame_step_fs > 0 else ""))
+
+    if output_fpt_msm_file:
+        with open(output_fpt_msm_file, "w") as f:
+            for c in [
+                "-------------------- Spectral First Passage Time Distribution (Transition Matrix) -------------------",
+                f"INPUT frame_vs_ext file: \"{frame_vs_ext_file}\"",
+                f"INPUT Frame Range: [{frame__start}, {frame__end}] | Frame Count: {frame_count} | Time b/w Frames: {f'{frame_step_fs} fs' if frame_step_fs > 0 else '<Not-Set>'}",
+                f"INPUT Extension Grid: [{_ext_start}, {_ext_end}] | {ext_bin_count} bins | Start bin (x_a): {msm_xa_bin} | Absorbing bins (x_b): >= {msm_xb_bin}",
+                f"INPUT Lag: {fpt_msm_lag} frames | Steps: {fpt_msm_steps} | Reversible: {fpt_msm_reversible}",
+                f"OUTPUT -> MFPT from x_a: {_mfpt_frames:g} frames",
+                "-----------------------------------------------"
+            ]:
+                f.write(f"{COMMENT_TOKEN} {c}\n")
+
+            msm_df.to_csv(f, sep="\t", mode="a", header=True, index=False, index_label=False)
+
+# Event-based FPT ----------------------------
+def load_passage_events(file_name: str) -> dict:
+    _df = load_frame_ext(file_name)
+    if frame__start >= 0:
+        _df = _df[_df["FRAME"] >= frame__start]
+
+    if frame__end >= 0:
+        _df = _df[_df["FRAME"] < frame__end]
+
+    return passage_events(_df["FRAME"].to_numpy(), _df["EXT"].to_numpy(), x_a, x_b, start=fpt_event_start)
+
+
+if fpt_event_files:
+    # I/O and NumPy bound, so threads are enough (this script has no __main__ guard for worker processes)
+    with ThreadPoolExecutor(max_workers=max(1, fpt_event_workers)) as executor:
+        file_events = list(executor.map(load_passage_events, fpt_event_files))
+
+    _time_factor = frame_step_fs * 1e-15 if frame_step_fs > 0 else 1  # FPT in s, or in frames if time is not defined
+    events_df = pd.DataFrame([(_file, _dir, _s, _e, (_e - _s) * _time_factor)
+                              for _file, _events in zip(fpt_event_files, file_events)
+                              for _dir, (_starts, _ends) in _events.items()
+                              for _s, _e in zip(_starts.tolist(), _ends.tolist())],
+                             columns=["FILE", "DIRECTION", "START_FRAME", "END_FRAME", "FPT"])
+
+    dist_dfs = []
+    for _dir in ("AB", "BA"):
+        _stats = fpt_statistics(events_df.loc[events_df["DIRECTION"] == _dir, "FPT"].to_numpy(),
+                                bin_count=fpt_event_bin_count, kde=fpt_event_kde)
+        print(f"Event FPT {_dir[0]} -> {_dir[1]}: {_stats['count']} events | Mean FPT: {_stats['mean']:g} ± {_stats['sem']:g} {'s' if frame_step_fs > 0 else 'frames'}")
+
+        _edges = _stats["bin_edges"]
+        dist_dfs.append(pd.DataFrame({
+            "DIRECTION": _dir,
+            "T_START": _edges[:-1],
+            "T_END": _edges[1:],
+            "T_MED": (_edges[:-1] + _edges[1:]) / 2,
+            "PDF": _stats["pdf"],
+            "PDF_KDE": _stats["kde"] if _stats["kde"] is not None else np.nan,
+            "SURVIVAL": _stats["survival"],
+            "MEAN_FPT": _stats["mean"]
+        }))
+
+    event_comments = [
+        "-------------------- Event-based First Passage Times from Simulation Trajectories -------------------",
+        f"INPUT frame_vs_ext files: {fpt_event_files}",
+        f"INPUT Frame Range: [{frame__start}, {frame__end}] | Time b/w Frames: {f'{frame_step_fs} fs' if frame_step_fs > 0 else '<Not-Set>'}",
+        f"INPUT A: ext <= {x_a} | B: ext >= {x_b} | Event start: {fpt_event_start} | FPT unit: {'s' if frame_step_fs > 0 else 'frames'}",
+        "-----------------------------------------------"
+    ]
+
+    for _out_file, _out_df in ((output_fpt_events_file, events_df), (output_fpt_events_dist_file, pd.concat(dist_dfs, ignore_index=True))):
+        if _out_file:
+            with open(_out_file, "w") as f:
+                for c in event_comments:
+                    f.write(f"{COMMENT_TOKEN} {c}\n")
+
+                _out_df.to_csv(f, sep="\t", mode="a", header=True, index=False, index_label=False)
+
 # Plot ------------------------------------
 plot_x = time_arr if time_arr is not None else frame_instants_arr
 plot_x_label = "$t$ (s)" if time_arr is not None else "Frame"
@@ -1,13 +1,30 @@
+import bz2
 import datetime
+import gzip
+import io
+import json
+import lzma
+import os
+import pickle
+import queue
+import re
+import threading
+import time
+import warnings
 from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib import recfunctions as rfn
 
 """
-Script to extract ENERGIES and calculate ENERGY AVERAGES from NAMD .log file(s)
+Script to extract ENERGIES and calculate ENERGY AVERAGES (and statistics) from NAMD .log file(s)
 
 Energies output by NAMD:
 TS, BOND, ANGLE, DIHED, IMPRP, ELECT, VDW, BOUNDARY, MISC, KINETIC, TOTAL, TEMP, POTENTIAL, TOTAL3, TEMPAVG
 
 NOTE: "TS" stands for Time Step
+NOTE: .log files may be compressed (gzip, bz2 or xz), and are decompressed on the fly (see open_log)
 
 USAGE:
 1. copy this script to working dir
@@ -16,25 +33,646 @@ USAGE:
 """
 
 
+TIMESTEP_TITLE = "TS"
+
+CAL_TO_JOULE = 4.184  # 1 cal = 4.184 J
+K_b = 8.314 / (CAL_TO_JOULE * 1000)  # ideal gas constant in kcal/(mol K)
+
+READ_CHUNK_SIZE = 32 * 1024 * 1024  # bytes read from a .log file at once
+PARALLEL_SPLIT_SIZE = 256 * 1024 * 1024  # bytes of a .log file parsed by a single worker process
+
+# Every line of a block is preceded by a newline (see _iter_line_blocks), so record lines are matched by their
+# "\n<TOKEN>" prefix. A literal prefix is much faster to scan for than a MULTILINE "^" anchor
+_ETITLE_LINE_REGEX = re.compile(rb"\nETITLE:([^\n]*)")
+_ENERGY_LINE_REGEX = re.compile(rb"\nENERGY:([^\n]*)")
+_ENERGY_TS_REGEX = re.compile(rb"\nENERGY:[ \t]*(\d+)")
+_SMD_TS_REGEX = re.compile(rb"\nSMD[ \t]+(\d+)")
+
+_SMD_LINE_REGEX = re.compile(rb"\nSMD[ \t]+([^\n]*)")
+_PRESSURE_LINE_REGEX = re.compile(rb"\nPRESSURE:([^\n]*)")
+_GPRESSURE_LINE_REGEX = re.compile(rb"\nGPRESSURE:([^\n]*)")
+_TIMING_LINE_REGEX = re.compile(rb"\nTIMING:[ \t]*(\d+)[ \t]+CPU:[ \t]*([^,\s]+),[ \t]*([^/\s]+)/step[ \t]+"
+                                rb"Wall:[ \t]*([^,\s]+),[ \t]*([^/\s]+)/step,[ \t]*(\S+) hours remaining,[ \t]*(\S+) MB")
+_INFO_LINE_REGEX = re.compile(rb"\nInfo:[ \t]*([^\n]*)")
+
+# Columns of the numeric records other than ENERGY (whose columns come from the ETITLE line)
+SMD_TITLES = ["TS", "X", "Y", "Z", "FX", "FY", "FZ"]  # COM position (A) and force (pN) of SMD atom(s)
+PRESSURE_TITLES = ["TS", "PXX", "PXY", "PXZ", "PYX", "PYY", "PYZ", "PZX", "PZY", "PZZ"]  # pressure tensor (bar)
+TIMING_TITLES = ["TS", "CPU", "CPU_PER_STEP", "WALL", "WALL_PER_STEP", "HOURS_REMAINING", "MEMORY_MB"]
+
+LOG_RECORD_TYPES = ("ENERGY", "SMD", "PRESSURE", "GPRESSURE", "TIMING", "INFO")
+
+TS_INDEX_SUFFIX = ".tsidx.npz"  # sidecar timestep index, saved next to the .log file
+
+SERIES_FILE_EXT = ".npy"  # binary time series: structured NumPy array, one field per column
+SERIES_META_EXT = ".json"  # metadata sidecar of a binary time series
+
+# Compressed .log files are detected by their leading magic bytes (not the file extension)
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+}
+
+_DECOMPRESSORS = {
+    "gzip": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+DECOMPRESS_BLOCK_SIZE = 8 * 1024 * 1024  # bytes decompressed at once by the background thread
+DECOMPRESS_QUEUE_SIZE = 4  # decompressed blocks buffered ahead of the reader
+
+
+def log_compression(log_file: str) -> [str, None]:
+    """
+    Detects the compression of a .log file from its magic bytes
+
+    @return "gzip", "bz2", "xz", or None if the file is not compressed
+    """
+
+    with open(log_file, "rb") as f:
+        head = f.read(max(len(m) for m in COMPRESSION_MAGIC))
+
+    for magic, name in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+class _ThreadedDecompressReader(io.RawIOBase):
+    """
+    Read-only, non-seekable raw stream of a compressed file, decompressed in large blocks by a background thread.
+
+    zlib, bz2 and lzma release the GIL while decompressing, so decompression of the next blocks overlaps
+    with parsing of the current one
+    """
+
+    def __init__(self, file_name: str, compression: str,
+                 block_size: int = DECOMPRESS_BLOCK_SIZE, queue_size: int = DECOMPRESS_QUEUE_SIZE):
+        super().__init__()
+        self._blocks = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._buf = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._decompress,
+                                        args=(file_name, compression, block_size),
+                                        daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, file_name: str, compression: str, block_size: int):
+        try:
+            with _DECOMPRESSORS[compression](file_name, "rb") as f:
+                while block := f.read(block_size):
+                    if not self._put(block):
+                        return  # reader closed
+        except Exception as e:
+            self._put(e)
+            return
+
+        self._put(b"")  # EOF
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf and not self._eof:
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                self._eof = True
+                raise block
+            if not block:
+                self._eof = True
+            self._buf = memoryview(block)
+
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def readall(self) -> bytes:
+        parts = [bytes(self._buf)]
+        self._buf = memoryview(b"")
+        while not self._eof:
+            block = self._blocks.get()
+            if isinstance(block, Exception):
+                self._eof = True
+                raise block
+            if not block:
+                self._eof = True
+            parts.append(block)
+        return b"".join(parts)
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def open_log(log_file: str, mode: str = "rb", block_size: int = DECOMPRESS_BLOCK_SIZE):
+    """
+    Opens a NAMD .log file for reading, which may be compressed (gzip, bz2 or xz, detected by magic bytes).
+    Compressed files are decompressed as a stream by a background thread, without writing anything to disk
+
+    NOTE: a compressed file is not seekable
+
+    @param log_file : .log file path
+    @param mode : "rb" for a binary or "r" for a text file object
+    @param block_size : bytes decompressed at once
+
+    @return file object
+    """
+
+    if mode not in ("r", "rb", "rt"):
+        raise ValueError(f"open_log only supports read modes 'r' and 'rb', given: '{mode}'")
+
+    compression = log_compression(log_file)
+    if compression is None:
+        return open(log_file, mode)
+
+    f = io.BufferedReader(_ThreadedDecompressReader(log_file, compression, block_size=block_size),
+                          buffer_size=block_size)
+    return f if mode == "rb" else io.TextIOWrapper(f)
+
+
+def energy_dtype(e_titles: list) -> np.dtype:
+    """
+    NumPy structured dtype for ENERGY records, with one field per ENERGY_TITLE.
+    Timestep (TS) is stored as int64, all energies as float64
+    """
+    return np.dtype([(t, np.int64 if t == TIMESTEP_TITLE else np.float64) for t in e_titles])
+
+
+def _iter_line_blocks(f, chunk_size: int = READ_CHUNK_SIZE, start: int = 0, end: int = -1):
+    """
+    Reads a binary file object in large chunks and yields blocks (bytes) of complete lines.
+
+    Every block starts with a newline character, so that each line in a block (including the first one)
+    is preceded by a "\n". The newline ending the last line of a chunk is carried over to the next block,
+    along with any partial line
+
+    @param f : binary file object
+    @param chunk_size : number of bytes to read at once
+    @param start : byte offset to start reading from. Must be the start of a line
+    @param end : byte offset (exclusive) to stop reading at, or -1 to read till EOF. Must be the start of a line
+
+    @return generator of (offset, block), where offset is the byte offset of block[0] in the file.
+            For the first block, block[0] is a virtual newline at offset (start - 1)
+    """
+
+    if start > 0:
+        f.seek(start)
+
+    pos = start
+    offset = start - 1
+    remainder = b"\n"
+    while end < 0 or pos < end:
+        chunk = f.read(chunk_size if end < 0 else min(chunk_size, end - pos))
+        if not chunk:
+            break
+
+        pos += len(chunk)
+        chunk = remainder + chunk
+        nl = chunk.rfind(b"\n")
+        if nl <= 0:
+            remainder = chunk
+            continue
+
+        remainder = chunk[nl:]
+        yield offset, chunk[:nl]
+        offset += nl
+
+    if len(remainder) > 1:
+        yield offset, remainder
+
+
+def _decode_energy_payloads(payloads: list, e_titles: list) -> np.ndarray:
+    """
+    Decodes the payloads of ENERGY lines (everything after the "ENERGY:" token) into a structured array
+
+    All payloads are parsed by a single bulk conversion. If the block contains a malformed record
+    (ex. a truncated last line of a running simulation), records are decoded line by line and
+    the ones that do not match ENERGY_TITLES are dropped
+    """
+
+    dtype = energy_dtype(e_titles)
+    col_count = len(e_titles)
+    if not payloads:
+        return np.empty((0,), dtype=dtype)
+
+    try:
+        with warnings.catch_warnings():
+            # older NumPy warns (instead of raising) on a malformed value, and returns the values parsed so far
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(b" ".join(payloads), dtype=np.float64, sep=" ")
+    except ValueError:
+        values = None
+
+    if values is None or values.size != len(payloads) * col_count:
+        rows = []
+        for p in payloads:
+            words = p.split()
+            if len(words) == col_count:
+                try:
+                    rows.append(np.array(words, dtype=np.float64))
+                except ValueError:
+                    pass  # malformed record
+
+        values = np.array(rows, dtype=np.float64) if rows else np.empty((0, col_count), dtype=np.float64)
+
+    return rfn.unstructured_to_structured(values.reshape(-1, col_count), dtype=dtype)
+
+
+def _filter_timesteps(records: np.ndarray, start_timestep: int = -1, end_timestep: int = -1) -> np.ndarray:
+    if start_timestep < 0 and end_timestep < 0:
+        return records
+
+    ts = records[TIMESTEP_TITLE]
+    mask = np.ones(ts.shape, dtype=bool)
+    if start_timestep >= 0:
+        mask &= ts >= start_timestep
+    if end_timestep >= 0:
+        mask &= ts <= end_timestep
+    return records[mask]
+
+
+def _index_record_timesteps(regex: re.Pattern, block: bytes, block_offset: int) -> tuple:
+    ts, offsets = [], []
+    for m in regex.finditer(block):
+        ts.append(int(m.group(1)))
+        offsets.append(block_offset + m.start() + 1)  # skip the newline preceding the record line
+    return ts, offsets
+
+
+def build_timestep_index(log_file: str, chunk_size: int = READ_CHUNK_SIZE) -> dict:
+    """
+    Scans a NAMD .log file once and maps the timestep of each ENERGY and SMD record to the byte offset of its line.
+    Only useful for uncompressed .log files, since compressed files cannot be seeked into
+
+    @return index dict with keys
+            "file_size", "file_mtime_ns" : stat of the indexed .log file, used to invalidate the index
+            "etitle", "etitle_offset" : first ETITLE line payload and its byte offset ("" and -1 if not present)
+            "energy_ts", "energy_offsets" : timesteps and byte offsets of ENERGY records (int64 arrays)
+            "smd_ts", "smd_offsets" : timesteps and byte offsets of SMD records (int64 arrays)
+    """
+
+    stat = os.stat(log_file)
+    etitle, etitle_offset = "", -1
+    energy_ts, energy_offsets, smd_ts, smd_offsets = [], [], [], []
+
+    with open(log_file, "rb") as f:
+        for block_offset, block in _iter_line_blocks(f, chunk_size=chunk_size):
+            if etitle_offset < 0 and (match := _ETITLE_LINE_REGEX.search(block)):
+                etitle = match.group(1).decode().strip()
+                etitle_offset = block_offset + match.start() + 1
+
+            ts, offsets = _index_record_timesteps(_ENERGY_TS_REGEX, block, block_offset)
+            energy_ts.extend(ts)
+            energy_offsets.extend(offsets)
+
+            ts, offsets = _index_record_timesteps(_SMD_TS_REGEX, block, block_offset)
+            smd_ts.extend(ts)
+            smd_offsets.extend(offsets)
+
+    return {
+        "file_size": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+        "etitle": etitle,
+        "etitle_offset": etitle_offset,
+        "energy_ts": np.array(energy_ts, dtype=np.int64),
+        "energy_offsets": np.array(energy_offsets, dtype=np.int64),
+        "smd_ts": np.array(smd_ts, dtype=np.int64),
+        "smd_offsets": np.array(smd_offsets, dtype=np.int64),
+    }
+
+
+def load_timestep_index(log_file: str, build: bool = True, save: bool = True) -> [dict, None]:
+    """
+    Loads the sidecar timestep index ("<log_file>.tsidx.npz") of a NAMD .log file
+
+    The index is valid only if the size and modification time of the .log file have not changed since it was built.
+    A missing or stale index is rebuilt (if build is True) and saved next to the .log file (if save is True).
+    A sidecar that cannot be written (ex. read-only directory) is silently skipped
+
+    @return index dict (see build_timestep_index), or None if there is no valid index and build is False
+    """
+
+    index_file = log_file + TS_INDEX_SUFFIX
+    stat = os.stat(log_file)
+
+    if os.path.isfile(index_file):
+        try:
+            with np.load(index_file) as data:
+                index = {k: data[k] for k in data.files}
+
+            index["etitle"] = str(index["etitle"])
+            for k in ("file_size", "file_mtime_ns", "etitle_offset"):
+                index[k] = int(index[k])
+
+            if index["file_size"] == stat.st_size and index["file_mtime_ns"] == stat.st_mtime_ns:
+                return index
+        except (OSError, ValueError, KeyError):
+            pass  # corrupt or incompatible index, rebuild
+
+    if not build:
+        return None
+
+    index = build_timestep_index(log_file)
+    if save:
+        try:
+            with open(index_file, "wb") as f:
+                np.savez(f, **index)
+        except OSError:
+            pass
+
+    return index
+
+
+def timestep_byte_range(index: dict,
+                        record: str = "ENERGY",
+                        start_timestep: int = -1,
+                        end_timestep: int = -1) -> tuple[int, int]:
+    """
+    Byte range of a .log file that contains all ENERGY (or SMD) records within [start_timestep, end_timestep]
+
+    @param index : timestep index of the .log file (see load_timestep_index)
+    @param record : "ENERGY" or "SMD"
+    @param start_timestep : first timestep (inclusive), -1 for no start bound
+    @param end_timestep : last timestep (inclusive), -1 for no end bound
+
+    @return (start, end) byte offsets, end being exclusive. The whole file (0, file_size) if the timesteps
+            are not in order, and an empty range if no record falls in the timestep range
+    """
+
+    ts = index[f"{record.lower()}_ts"]
+    offsets = index[f"{record.lower()}_offsets"]
+    file_size = index["file_size"]
+
+    if len(ts) == 0:
+        return file_size, file_size
+
+    if np.any(ts[1:] < ts[:-1]):
+        return 0, file_size  # timesteps not in order (ex. multiple runs with a timestep reset)
+
+    first = np.searchsorted(ts, start_timestep, side="left") if start_timestep >= 0 else 0
+    last = np.searchsorted(ts, end_timestep, side="right") if end_timestep >= 0 else len(ts)
+    if first >= last:
+        return file_size, file_size
+
+    return int(offsets[first]), (int(offsets[last]) if last < len(ts) else file_size)
+
+
+def _find_e_titles(log_file: str, chunk_size: int = 1024 * 1024) -> tuple:
+    """
+    Header pre-pass: finds the first ETITLE line of a .log file, reading only as far as needed
+
+    @return (e_titles, offset) where offset is the byte offset of the ETITLE line, or (None, -1) if not present
+    """
+
+    with open_log(log_file, 'rb') as f:
+        for block_offset, block in _iter_line_blocks(f, chunk_size=chunk_size):
+            if match := _ETITLE_LINE_REGEX.search(block):
+                return [t.decode() for t in match.group(1).split()], block_offset + match.start() + 1
+    return None, -1
+
+
+def _energy_byte_range(log_file: str,
+                       start_timestep: int = -1,
+                       end_timestep: int = -1,
+                       use_ts_index: bool = True,
+                       build_index: bool = True) -> tuple:
+    """
+    Byte range of a .log file to read ENERGY records in the timestep range from
+
+    @param build_index : whether to build a missing (or stale) timestep index. If False, the whole file is read
+
+    @return (e_titles, byte_start, byte_end)
+            -> with a timestep range and use_ts_index, e_titles and the byte range come from the timestep index.
+               byte_start is -1 if the .log file has no ENERGY_TITLES
+            -> otherwise (None, 0, -1) i.e. the whole file, and ENERGY_TITLES are yet to be read from the file.
+               Always the case for a compressed .log file
+    """
+
+    if not (use_ts_index and (start_timestep >= 0 or end_timestep >= 0)) or log_compression(log_file):
+        return None, 0, -1  # compressed files are not seekable, always read as a whole
+
+    index = load_timestep_index(log_file, build=build_index)
+    if index is None:
+        return None, 0, -1
+
+    if index["etitle_offset"] < 0:
+        return None, -1, -1
+
+    byte_start, byte_end = timestep_byte_range(index, record="ENERGY",
+                                               start_timestep=start_timestep,
+                                               end_timestep=end_timestep)
+    return index["etitle"].split(), max(byte_start, index["etitle_offset"]), byte_end
+
+
+def _split_line_ranges(log_file: str, byte_start: int, byte_end: int, split_size: int) -> list:
+    """
+    Splits the byte range [byte_start, byte_end) of a file into consecutive ranges of about split_size bytes,
+    each starting at the beginning of a line
+
+    @return list of (start, end) byte ranges, in file order
+    """
+
+    bounds = [byte_start]
+    with open(log_file, 'rb') as f:
+        pos = byte_start + split_size
+        while pos < byte_end:
+            f.seek(pos)
+            f.readline()  # move to the start of the next line
+            pos = f.tell()
+            if pos >= byte_end:
+                break
+
+            bounds.append(pos)
+            pos += split_size
+
+    bounds.append(byte_end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _load_energies_range(log_file: str,
+                         e_titles: list,
+                         byte_start: int,
+                         byte_end: int,
+                         start_timestep: int = -1,
+                         end_timestep: int = -1,
+                         chunk_size: int = READ_CHUNK_SIZE) -> np.ndarray:
+    """
+    Decodes the ENERGY records in the byte range [byte_start, byte_end) of a .log file, with known ENERGY_TITLES.
+    Unit of work of parallel parsing
+    """
+
+    blocks = [np.empty((0,), dtype=energy_dtype(e_titles))]
+    with open_log(log_file, 'rb') as f:
+        for _, block in _iter_line_blocks(f, chunk_size=chunk_size, start=byte_start, end=byte_end):
+            records = _decode_energy_payloads(_ENERGY_LINE_REGEX.findall(block), e_titles)
+            blocks.append(_filter_timesteps(records, start_timestep=start_timestep, end_timestep=end_timestep))
+
+    return np.concatenate(blocks)
+
+
+def _plan_parallel_tasks(log_file: str,
+                         start_timestep: int = -1,
+                         end_timestep: int = -1,
+                         use_ts_index: bool = True,
+                         split_size: int = -1) -> tuple:
+    """
+    Plans parallel parsing of a .log file: finds ENERGY_TITLES once (header pre-pass) and
+    splits the byte range holding the records into line-aligned ranges of about split_size bytes
+
+    Only an existing timestep index narrows the byte range. A missing one is not built here, as that would scan the
+    whole file serially before any worker starts: the whole file is split instead, and the workers filter timesteps
+
+    @return (e_titles, byte_ranges), or (None, []) if the .log file has no ENERGY_TITLES.
+            A compressed .log file is not split, and has a single byte range (0, -1) i.e. the whole file
+    """
+
+    e_titles, byte_start, byte_end = _energy_byte_range(log_file,
+                                                        start_timestep=start_timestep,
+                                                        end_timestep=end_timestep,
+                                                        use_ts_index=use_ts_index,
+                                                        build_index=False)
+    if byte_start < 0:
+        return None, []
+
+    if e_titles is None:
+        e_titles, byte_start = _find_e_titles(log_file)
+        if e_titles is None:
+            return None, []
+
+    if log_compression(log_file):
+        return e_titles, [(0, -1)]  # a compressed file is parsed as a whole, by streaming decompression
+
+    if byte_end < 0:
+        byte_end = os.path.getsize(log_file)
+
+    if byte_start >= byte_end:
+        return e_titles, []
+
+    if split_size <= 0:
+        return e_titles, [(byte_start, byte_end)]
+
+    return e_titles, _split_line_ranges(log_file, byte_start, byte_end, split_size)
+
+
+def _iter_log_energies(log_file: str,
+                       start_timestep: int = -1,
+                       end_timestep: int = -1,
+                       use_ts_index: bool = True,
+                       chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Reads a single NAMD .log file in large chunks, and decodes the ENERGY records of each chunk in bulk
+
+    @return generator of (e_titles, records) for each block of the file, starting from the block containing the
+            first ETITLE line. e_titles is the list of ENERGY_TITLES of this file, and records is a structured array
+            (dtype: energy_dtype(e_titles)) of the ENERGY records in the timestep range, which can be empty
+    """
+
+    e_titles, byte_start, byte_end = _energy_byte_range(log_file,
+                                                        start_timestep=start_timestep,
+                                                        end_timestep=end_timestep,
+                                                        use_ts_index=use_ts_index)
+    if byte_start < 0:
+        return  # no ENERGY_TITLES
+
+    if e_titles is not None and byte_start >= byte_end:
+        yield e_titles, np.empty((0,), dtype=energy_dtype(e_titles))
+        return
+
+    with open_log(log_file, 'rb') as f:
+        for _, block in _iter_line_blocks(f, chunk_size=chunk_size, start=byte_start, end=byte_end):
+            if e_titles is None:
+                match = _ETITLE_LINE_REGEX.search(block)
+                if match is None:
+                    continue
+
+                e_titles = [t.decode() for t in match.group(1).split()]  # First will be Timestep
+                block = block[match.end():]  # starts with the newline ending ETITLE line
+
+            # Now we have e_titles
+            records = _decode_energy_payloads(_ENERGY_LINE_REGEX.findall(block), e_titles)
+            yield e_titles, _filter_timesteps(records, start_timestep=start_timestep, end_timestep=end_timestep)
+
+
+def load_energies(log_file: str,
+                  start_timestep: int = -1,
+                  end_timestep: int = -1,
+                  use_ts_index: bool = True,
+                  chunk_size: int = READ_CHUNK_SIZE) -> tuple:
+    """
+    Loads all ENERGY records of a single NAMD .log file (within the timestep range) into one structured array.
+    Used as the unit of work of parallel parsing
+
+    @return (e_titles, records), or (None, None) if the .log file has no ENERGY_TITLES
+    """
+
+    e_titles, blocks = None, []
+    for e_titles, records in _iter_log_energies(log_file,
+                                                start_timestep=start_timestep,
+                                                end_timestep=end_timestep,
+                                                use_ts_index=use_ts_index,
+                                                chunk_size=chunk_size):
+        blocks.append(records)
+
+    if e_titles is None:
+        return None, None
+
+    return e_titles, np.concatenate(blocks)
+
+
+def _first_energy_timestep(log_file: str, chunk_size: int = 1024 * 1024) -> [int, None]:
+    """
+    Timestep of the first ENERGY record of a .log file, found by reading only the beginning of the file
+    """
+
+    with open_log(log_file, 'rb') as f:
+        for _, block in _iter_line_blocks(f, chunk_size=chunk_size):
+            if match := _ENERGY_TS_REGEX.search(block):
+                return int(match.group(1))
+    return None
+
+
 def _extract_energies_internal(namd_log_files: [str, Iterable],
                                e_titles_callback: callable,
                                energies_callback: callable,
                                start_timestep: int = -1,
-                               end_timestep: int = -1):
+                               end_timestep: int = -1,
+                               use_ts_index: bool = True,
+                               workers: int = 1,
+                               duplicate_ts: [str, None] = None,
+                               split_size: int = PARALLEL_SPLIT_SIZE,
+                               chunk_size: int = READ_CHUNK_SIZE):
     """
     Base method to Extract energies from NAMD .log files and recive Callbacks
 
+    The .log files are read in large binary chunks. ENERGY lines of each chunk are picked out by a single
+    regex scan and decoded in bulk into a NumPy structured array, with one field per ENERGY_TITLE
+
     @param namd_log_files : NAMD .log file or a list of log files
     @param e_titles_callback : a function that is called with ENERGY_TITLES (as list of strings) that are present in the first log file
                             Called only ONCE at the start:
                             > e_titles_callback(energy_titles: list[str])
 
-    @param energies_callback : a function that is called for each entry of all energies (in all log files)
+    @param energies_callback : a function that is called with blocks of energy records (in all log files)
                             It is guaranteed that "e_titles_callback(energy_titles)" will be called before
                             the first call to this function.
-                            Energies are passed as list of strings, where each energy corresponds to the ENERGY_TITLE
-                            of energy_titles list passed to e_titles_callback.
-                            > energies_callback(energies: list[str])
+                            Energies are passed as a NumPy structured array (dtype: energy_dtype(energy_titles)),
+                            with one field for each ENERGY_TITLE of energy_titles list passed to e_titles_callback.
+                            > energies_callback(energies: np.ndarray)
 
     @param start_timestep : timestep to start reading energy_values from .log file(s).
                             -1 to start from the begining (any timestep present first)
@@ -42,33 +680,115 @@ def _extract_energies_internal(namd_log_files: [str, Iterable],
     @param end_timestep : timestep to end reading energy_values from .log file(s).
                             -1 to read till the end of all .log files
 
+    @param use_ts_index : whether to use the sidecar timestep index of each .log file (see load_timestep_index)
+                            when a timestep range is given. Reading then seeks straight to the first record in range
+                            and stops after the last one, instead of scanning the whole file.
+                            With workers > 1, a missing index is not built (the whole file is split among workers)
+
+    @param workers : number of worker processes. If > 1, .log files are parsed in parallel. Each .log file is
+                            split into byte ranges aligned on lines (see split_size), every range is parsed in a
+                            separate process, and the partial arrays are stitched back in the order of
+                            namd_log_files and byte ranges i.e. in timestep order.
+                            ENERGY_TITLES of each file are found once by a header pre-pass
+
+    @param duplicate_ts : how to resolve overlapping timesteps at the boundaries of a restart chain of .log files
+                            None : keep all records
+                            "first" : keep records of the earlier file, i.e. drop the records of a file whose timesteps
+                                      are not beyond the last timestep of the preceding files
+                            "last" : keep records of the later file, i.e. drop the records of a file from the first
+                                     timestep of any following file onwards
+
+    @param split_size : [only used if workers > 1] approximate size (in bytes) of the byte ranges a single .log file
+                            is split into, so that a single large .log file is also parsed on multiple cores.
+                            -1 to parse each .log file as a whole in one process
+
+    @param chunk_size : number of bytes to read from a .log file at once
+
+    @raise ValueError : if ENERGY_TITLES of a .log file do not match the ones of the first .log file
+
     """
 
     if isinstance(namd_log_files, str):
         namd_log_files = [namd_log_files]
 
+    if duplicate_ts not in (None, "first", "last"):
+        raise ValueError(f"duplicate_ts must be one of None, 'first' or 'last', given: '{duplicate_ts}'")
+
+    namd_log_files = list(namd_log_files)
+
+    # "last": a file is cut at the first timestep of the files following it
+    upper_bounds = [None] * len(namd_log_files)
+    if duplicate_ts == "last":
+        next_first_ts = None
+        for i in range(len(namd_log_files) - 1, -1, -1):
+            upper_bounds[i] = next_first_ts
+            first_ts = _first_energy_timestep(namd_log_files[i])
+            if first_ts is not None and (next_first_ts is None or first_ts < next_first_ts):
+                next_first_ts = first_ts
+
+    task_kwargs = dict(start_timestep=start_timestep,
+                       end_timestep=end_timestep,
+                       use_ts_index=use_ts_index,
+                       chunk_size=chunk_size)
+
+    def _iter_parallel_segment(_titles: list, _futures: list):
+        if _titles is not None:
+            yield _titles, np.empty((0,), dtype=energy_dtype(_titles))
+            for _future in _futures:
+                yield _titles, _future.result()
+
+    def _iter_segments():
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                segments = []
+                for f in namd_log_files:
+                    _titles, _ranges = _plan_parallel_tasks(f,
+                                                            start_timestep=start_timestep,
+                                                            end_timestep=end_timestep,
+                                                            use_ts_index=use_ts_index,
+                                                            split_size=split_size)
+                    _futures = [executor.submit(_load_energies_range, f, _titles, _s, _e,
+                                                start_timestep=start_timestep,
+                                                end_timestep=end_timestep,
+                                                chunk_size=chunk_size) for _s, _e in _ranges]
+                    segments.append((_titles, _futures))
+
+                # results of all byte ranges are stitched back in file order
+                for i, (_titles, _futures) in enumerate(segments):
+                    yield i, _iter_parallel_segment(_titles, _futures)
+        else:
+            for i, f in enumerate(namd_log_files):
+                yield i, _iter_log_energies(f, **task_kwargs)
+
     e_titles = None
+    last_ts = None  # last timestep of preceding files, for "first"
 
-    for log_file_path in namd_log_files:
-        with open(log_file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if e_titles is None:
-                    if (line.startswith("ETITLE:") and (words := line.split())) and words[0] == "ETITLE:":
-                        e_titles = words[1:]  # First will be Timestep
-                        e_titles_callback(e_titles)
-                    continue
+    for file_index, segment in _iter_segments():
+        segment_last_ts = None
+        for titles, records in segment:
+            if e_titles is None:
+                e_titles = titles
+                e_titles_callback(e_titles)
+            elif titles != e_titles:
+                raise ValueError(f"ENERGY_TITLES of .log file '{namd_log_files[file_index]}' [{', '.join(titles)}]"
+                                 f" do not match ENERGY_TITLES of the first .log file [{', '.join(e_titles)}]")
 
-                # Now we have e_titles
-                if (line.startswith("ENERGY:") and (words := line.split())) and words[0] == "ENERGY:":
-                    energies = words[1:]  # First will be Timestep
+            if not len(records):
+                continue
 
-                    if start_timestep >= 0 or end_timestep >= 0:
-                        ts = int(energies[0])
-                        if (start_timestep >= 0 and ts < start_timestep) or (end_timestep >= 0 and ts > end_timestep):
-                            continue
+            ts = records[TIMESTEP_TITLE]
+            segment_last_ts = ts.max() if segment_last_ts is None else max(segment_last_ts, ts.max())
 
-                    energies_callback(energies)
+            if duplicate_ts == "first" and last_ts is not None:
+                records = records[ts > last_ts]
+            elif duplicate_ts == "last" and upper_bounds[file_index] is not None:
+                records = records[ts < upper_bounds[file_index]]
+
+            if len(records):
+                energies_callback(records)
+
+        if segment_last_ts is not None and (last_ts is None or segment_last_ts > last_ts):
+            last_ts = segment_last_ts
 
 
 def _parse_energy_cols(energy_cols: [str, Iterable, None]) -> [list, None]:
@@ -99,90 +819,823 @@ def _out_file_from_energy_cols(energy_cols: [list | None],
     return default_file_name  # Default
 
 
-def extract_energies(namd_log_files: [str, Iterable],
-                     start_timestep: int = -1,
-                     end_timestep: int = -1,
-                     energy_cols: [str, Iterable, None] = None,
-                     out_file_name: str = None,
-                     out_delimiter: str = " \t ",
-                     comment_token: str = "#",
-                     comment_e_titles: bool = False):
+def _format_energy_records(records: np.ndarray, titles: list, delimiter: str) -> str:
+    """
+    Formats ENERGY records as text rows (each prefixed with a newline), in the same format NAMD writes them:
+    Timestep as integer, and energies with 4 decimal places
     """
-    Extract specified (or all) ENERGY values from NAMD .log file(s)
-    within certain timestep range or for all time steps
 
-    Generally available ENERGY_COLUMNS:
-    BOND, ANGLE, DIHED, IMPRP, ELECT, VDW, BOUNDARY, MISC, KINETIC, TOTAL, TEMP, POTENTIAL, TOTAL3, TEMPAVG
+    row_fmt = delimiter.join(("%d" if t == TIMESTEP_TITLE else "%.4f") for t in titles)
+    return "".join(("\n" + row_fmt % row) for row in records[titles].tolist())
+
+
+def _select_e_titles(e_titles: list, energy_cols: [list, None], include_ts: bool = False) -> list:
+    """
+    Selects the required energy_cols (or all ENERGY_TITLES if energy_cols is None) in the order of e_titles
+    """
+
+    if not energy_cols:
+        return list(e_titles)
+
+    titles = [c for c in energy_cols if c in e_titles]
+    if include_ts and TIMESTEP_TITLE not in titles and TIMESTEP_TITLE in e_titles:
+        titles.append(TIMESTEP_TITLE)
+
+    titles.sort(key=e_titles.index)
+    return titles
+
+
+def _write_comment_header(out_fd, comment_token: str, description: str, meta: dict):
+    if comment_token:
+        out_fd.write(f"{comment_token} {description} NAMD .log file(s): [{', '.join(meta['namd_log_files'])}]\n")
+        out_fd.write(f"{comment_token} Start Timestep: {meta['start_timestep']} | End Timestep: {meta['end_timestep']}\n")
+        out_fd.write(f"{comment_token} File written on: {datetime.datetime.now()}\n")
+        out_fd.write(f"{comment_token}-----------------------------\n")
+
+
+## ==========================  BINARY SERIES  ==========================
+
+def series_meta_file(series_file: str) -> str:
+    """
+    JSON metadata sidecar of a binary time series file, ex. "energies_vs_ts.npy" -> "energies_vs_ts.json"
+    """
+    return os.path.splitext(series_file)[0] + SERIES_META_EXT
+
+
+class SeriesWriter:
+    """
+    Streams records of a time series to a binary .npy file (structured array, one field per column),
+    along with a JSON metadata sidecar (see series_meta_file) holding the column titles, source files and timestep range
+
+    Records are appended as raw bytes, and the .npy header (holding the record count) is rewritten on flush(),
+    so the series never has to be held in memory. The output can be memory-mapped for zero-copy loading (see load_series)
+
+    The first field is treated as the timestep
+    """
+
+    def __init__(self, out_file_name: str, dtype: np.dtype, meta: dict = None):
+        self.out_file_name = out_file_name
+        self.dtype = np.dtype(dtype)
+        self.meta = dict(meta) if meta else {}
+        self.count = 0
+        self.first_timestep = None
+        self.last_timestep = None
+
+        self._header_size = 0
+        self._out_fd = open(self.out_file_name, "wb")
+        self._write_header()
+
+    def __getstate__(self):
+        # output file is re-opened for appending after unpickling (ex. resuming follow mode from a checkpoint)
+        state = self.__dict__.copy()
+        state["_out_fd"] = None
+        return state
+
+    def _write_header(self):
+        header = np.lib.format.header_data_from_array_1_0(np.empty((0,), dtype=self.dtype))
+        header["shape"] = (self.count,)
+
+        self._out_fd.seek(0)
+        np.lib.format.write_array_header_1_0(self._out_fd, header)
+        size = self._out_fd.tell()
+        if self._header_size and size != self._header_size:
+            raise ValueError(f"Size of the .npy header of '{self.out_file_name}' changed from {self._header_size}"
+                             f" to {size} bytes, cannot update it in place")
+        self._header_size = size
+
+    def restore(self):
+        """
+        Rolls the output file back to the state of this writer, i.e. drops the records appended after it was pickled
+        (ex. by an interrupted poll in follow mode), and rewrites the header
+        """
+
+        self._out_fd = open(self.out_file_name, "r+b")
+        self._out_fd.truncate(self._header_size + self.count * self.dtype.itemsize)
+        self._write_header()
+        self._out_fd.flush()
+
+    def append(self, records: np.ndarray):
+        if not len(records):
+            return
+
+        if self._out_fd is None:
+            self._out_fd = open(self.out_file_name, "r+b")
+
+        records = records.astype(self.dtype, copy=False)
+        self._out_fd.seek(0, os.SEEK_END)
+        self._out_fd.write(records.tobytes())
+
+        ts = records[self.dtype.names[0]]
+        if self.first_timestep is None:
+            self.first_timestep = ts[0].item()
+        self.last_timestep = ts[-1].item()
+        self.count += len(records)
+
+    def flush(self):
+        if self._out_fd is None:
+            self._out_fd = open(self.out_file_name, "r+b")
+
+        self._write_header()
+        self._out_fd.flush()
+
+        meta = dict(self.meta)
+        meta.update({
+            "columns": list(self.dtype.names),
+            "dtype": np.lib.format.dtype_to_descr(self.dtype),
+            "count": self.count,
+            "first_timestep": self.first_timestep,
+            "last_timestep": self.last_timestep,
+            "written_on": str(datetime.datetime.now())
+        })
+
+        with open(series_meta_file(self.out_file_name), "w") as f:
+            json.dump(meta, f, indent=4)
+
+    def close(self):
+        self.flush()
+        self._out_fd.close()
+        self._out_fd = None
+
+
+def save_series(out_file_name: str, records: np.ndarray, meta: dict = None) -> str:
+    """
+    Saves a structured array of records as a binary time series (.npy) with a JSON metadata sidecar
+
+    @return out_file_name
+    """
+
+    writer = SeriesWriter(out_file_name, dtype=records.dtype, meta=meta)
+    writer.append(records)
+    writer.close()
+    return out_file_name
+
+
+def load_series(series_file: str, mmap: bool = True) -> tuple:
+    """
+    Loads a binary time series written by SeriesWriter (ex. extract_energies(..., out_format="npy"))
+
+    @param series_file : .npy file
+    @param mmap : whether to memory-map the file (read-only, zero-copy) instead of reading it into memory
+
+    @return (records, meta) where records is a structured array with one field per column
+            (ex. records["TS"], records["TOTAL"]), and meta is the dict of the JSON sidecar ({} if missing)
+    """
+
+    records = np.load(series_file, mmap_mode="r" if mmap else None)
+
+    meta = {}
+    meta_file = series_meta_file(series_file)
+    if os.path.isfile(meta_file):
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+
+    return records, meta
+
+
+## ==========================  LOG RECORDS  ==========================
+
+# record type -> (line regex, column titles) of the numeric records with fixed columns
+_FIXED_RECORD_PARSERS = {
+    "SMD": (_SMD_LINE_REGEX, SMD_TITLES),
+    "PRESSURE": (_PRESSURE_LINE_REGEX, PRESSURE_TITLES),
+    "GPRESSURE": (_GPRESSURE_LINE_REGEX, PRESSURE_TITLES),
+}
+
+
+def _parse_record_types(record_types: [str, Iterable, None]) -> list:
+    if record_types is None:
+        return list(LOG_RECORD_TYPES)
+    if isinstance(record_types, str):
+        record_types = [record_types]
+
+    record_types = [t.upper() for t in record_types]
+    for t in record_types:
+        if t not in LOG_RECORD_TYPES:
+            raise ValueError(f"Unknown record type '{t}', must be one of [{', '.join(LOG_RECORD_TYPES)}]")
+    return record_types
+
+
+def iter_log_records(namd_log_files: [str, Iterable],
+                     record_types: [str, Iterable, None] = None,
+                     chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Record-dispatch parser: reads NAMD .log file(s) ONCE, in large chunks, and picks out all the requested
+    record types from each chunk. Numeric records are decoded in bulk into structured arrays
+
+    Record types (see LOG_RECORD_TYPES):
+        "ENERGY"    : ENERGY lines, with columns of the first ETITLE line (TS as int64, energies as float64)
+        "SMD"       : SMD lines, columns SMD_TITLES
+        "PRESSURE"  : PRESSURE lines (pressure tensor), columns PRESSURE_TITLES
+        "GPRESSURE" : GPRESSURE lines (group pressure tensor), columns PRESSURE_TITLES
+        "TIMING"    : TIMING lines, columns TIMING_TITLES
+        "INFO"      : "Info:" lines (ex. simulation and SMD parameters), as a list of str (without the "Info:" token)
+
+    @param namd_log_files : NAMD .log file or a list of log files (may be compressed, see open_log)
+    @param record_types : record type or list of record types to extract. None for all
+
+    @return generator of (record_type, records) for each chunk of each file, in file order. Empty chunks are skipped
+
+    @raise ValueError : if ENERGY_TITLES of a .log file do not match the ones of the first .log file
+    """
+
+    if isinstance(namd_log_files, str):
+        namd_log_files = [namd_log_files]
+
+    record_types = _parse_record_types(record_types)
+    e_titles = None  # ENERGY_TITLES of the first .log file
+
+    for log_file in namd_log_files:
+        file_e_titles = None
+        with open_log(log_file, 'rb') as f:
+            for _, block in _iter_line_blocks(f, chunk_size=chunk_size):
+                for record_type in record_types:
+                    if record_type == "ENERGY":
+                        energy_block = block
+                        if file_e_titles is None:
+                            match = _ETITLE_LINE_REGEX.search(block)
+                            if match is None:
+                                continue
+
+                            file_e_titles = [t.decode() for t in match.group(1).split()]
+                            if e_titles is None:
+                                e_titles = file_e_titles
+                            elif file_e_titles != e_titles:
+                                raise ValueError(f"ENERGY_TITLES of .log file '{log_file}' [{', '.join(file_e_titles)}]"
+                                                 f" do not match ENERGY_TITLES of the first .log file [{', '.join(e_titles)}]")
+                            energy_block = block[match.end():]
+
+                        records = _decode_energy_payloads(_ENERGY_LINE_REGEX.findall(energy_block), e_titles)
+                    elif record_type == "TIMING":
+                        records = _decode_energy_payloads([b" ".join(m) for m in _TIMING_LINE_REGEX.findall(block)],
+                                                          TIMING_TITLES)
+                    elif record_type == "INFO":
+                        records = [p.decode(errors="replace").rstrip() for p in _INFO_LINE_REGEX.findall(block)]
+                    else:
+                        regex, titles = _FIXED_RECORD_PARSERS[record_type]
+                        records = _decode_energy_payloads(regex.findall(block), titles)
+
+                    if len(records):
+                        yield record_type, records
+
+
+def extract_log_records(namd_log_files: [str, Iterable],
+                        record_types: [str, Iterable, None] = None,
+                        writers: dict = None,
+                        chunk_size: int = READ_CHUNK_SIZE) -> dict:
+    """
+    Extracts ENERGY, SMD, PRESSURE, GPRESSURE, TIMING and "Info:" records from NAMD .log file(s) in a single pass
+    (see iter_log_records), each record type into its own columnar buffer or writer
 
     @param namd_log_files : NAMD .log file or a list of log files
+    @param record_types : record type or list of record types to extract. None for all (see LOG_RECORD_TYPES)
+    @param writers : optional dict {record_type: writer}. Records of these types are streamed to
+                        writer.append(records) (ex. SeriesWriter) instead of being buffered in memory
+
+    @return dict {record_type: records} of the buffered record types (the ones without a writer)
+            -> numeric records as structured arrays, with one field per column (ex. res["SMD"]["FX"])
+            -> "INFO" as a list of str
+            Record types not present in the .log file(s) are None
+    """
+
+    record_types = _parse_record_types(record_types)
+    writers = dict((t.upper(), w) for t, w in writers.items()) if writers else {}
+    buffers = dict((t, []) for t in record_types if t not in writers)
+
+    for record_type, records in iter_log_records(namd_log_files, record_types=record_types, chunk_size=chunk_size):
+        if record_type in writers:
+            writers[record_type].append(records)
+        else:
+            buffers[record_type].append(records)
+
+    res = {}
+    for record_type, blocks in buffers.items():
+        if not blocks:
+            res[record_type] = None
+        elif record_type == "INFO":
+            res[record_type] = [line for block in blocks for line in block]
+        else:
+            res[record_type] = np.concatenate(blocks)
+    return res
+
+
+def smd_params(info_lines: Iterable) -> dict:
+    """
+    SMD parameters from the "Info: SMD ..." lines of a .log file (see extract_log_records(..., record_types="INFO"))
+
+    @return dict with (whichever present) "velocity" (A/timestep), "direction" (unit vector tuple),
+            "k" and "k2" (kcal/mol/A^2), "output_freq" (timesteps) and "file"
+    """
+
+    params = {}
+    for line in info_lines:
+        words = line.split()
+        if len(words) < 3 or words[0] != "SMD":
+            continue
+
+        key = words[1]
+        if key == "VELOCITY":
+            params["velocity"] = float(words[2])
+        elif key == "DIRECTION" and len(words) >= 5:
+            params["direction"] = (float(words[2]), float(words[3]), float(words[4]))
+        elif key == "K":
+            params["k"] = float(words[2])
+        elif key == "K2":
+            params["k2"] = float(words[2])
+        elif key == "OUTPUT" and len(words) >= 4 and words[2] == "FREQUENCY":
+            params["output_freq"] = int(words[3])
+        elif key == "FILE":
+            params["file"] = words[2]
+    return params
+
+
+## ==========================  PIPELINE  ==========================
+
+class EnergyReducer:
+    """
+    Consumer of ENERGY records in the single-pass extraction pipeline (see run_energy_pipeline)
+
+    Every .log file is read only ONCE, and each block of decoded records is fanned out to all the reducers.
+    A reducer implements:
+        > start(e_titles: list[str], meta: dict)  called ONCE with the ENERGY_TITLES before any records.
+                                                  meta holds "namd_log_files", "start_timestep" and "end_timestep"
+        > update(records: np.ndarray)             called for each block of records (structured array)
+        > finish() -> result                      called ONCE at the end, returns the result of the reducer
+    and optionally
+        > flush()                                 persist the output written so far (ex. before a checkpoint
+                                                  in follow mode, see follow_energies). Reducers are pickled
+                                                  into the checkpoint, so they must not hold unpicklable state
+        > restore()                               called after the reducer is restored from a checkpoint, to roll
+                                                  its output back to the checkpointed state
+    """
+
+    def start(self, e_titles: list, meta: dict):
+        pass
+
+    def update(self, records: np.ndarray):
+        pass
+
+    def flush(self):
+        pass
+
+    def restore(self):
+        pass
+
+    def finish(self):
+        return None
+
+
+class EnergyTimeSeriesWriter(EnergyReducer):
+    """
+    Writes specified (or all) ENERGY values vs TS to a delimited text file, or to a binary .npy time series
+    (see SeriesWriter). Result is the output file name
+    """
+
+    def __init__(self,
+                 energy_cols: [str, Iterable, None] = None,
+                 out_file_name: str = None,
+                 out_delimiter: str = " \t ",
+                 comment_token: str = "#",
+                 comment_e_titles: bool = False,
+                 out_format: str = "text"):
+        if out_format not in ("text", "npy"):
+            raise ValueError(f"out_format must be one of 'text' or 'npy', given: '{out_format}'")
+
+        ext = ".csv" if out_format == "text" else SERIES_FILE_EXT
+        self.energy_cols = _parse_energy_cols(energy_cols)
+        self.out_file_name = out_file_name or _out_file_from_energy_cols(self.energy_cols,
+                                                                         suffix="_vs_ts" + ext,
+                                                                         default_file_name="energies_vs_ts" + ext)
+        self.out_delimiter = out_delimiter
+        self.comment_token = comment_token
+        self.comment_e_titles = comment_e_titles
+        self.out_format = out_format
+
+        self.titles = []  # selected energy titles: list[str]
+        self._started = False
+        self._out_fd = None
+        self._out_size = 0  # bytes of the text output written so far (committed on flush)
+        self._series = None  # SeriesWriter, for "npy" format
+
+    def __getstate__(self):
+        # output file is re-opened in append mode after unpickling (ex. resuming follow mode from a checkpoint)
+        state = self.__dict__.copy()
+        state["_out_fd"] = None
+        return state
+
+    def restore(self):
+        if self._series is not None:
+            self._series.restore()
+        elif self._started and os.path.isfile(self.out_file_name):
+            os.truncate(self.out_file_name, self._out_size)
+
+    def start(self, e_titles: list, meta: dict):
+        self.titles = _select_e_titles(e_titles, self.energy_cols, include_ts=True)
+        self._started = True
+
+        if self.out_format == "npy":
+            self._series = SeriesWriter(self.out_file_name,
+                                        dtype=energy_dtype(self.titles),
+                                        meta={
+                                            "source_files": list(meta["namd_log_files"]),
+                                            "start_timestep": meta["start_timestep"],
+                                            "end_timestep": meta["end_timestep"]
+                                        })
+            return
+
+        self._out_fd = open(self.out_file_name, "w")
+
+        if self.titles:
+            # Comments
+            _write_comment_header(self._out_fd, self.comment_token, "ENERGIES extracted from", meta)
+
+            # Header: Energy Titles
+            self._out_fd.write((self.comment_token if self.comment_token and self.comment_e_titles else "")
+                               + self.out_delimiter.join(self.titles))
+
+    def update(self, records: np.ndarray):
+        if not self.titles:
+            return
+
+        if self._series is not None:
+            self._series.append(records[self.titles])
+            return
+
+        if self._out_fd is None:
+            self._out_fd = open(self.out_file_name, "a")
+
+        # Energy Values
+        self._out_fd.write(_format_energy_records(records, titles=self.titles, delimiter=self.out_delimiter))
+
+    def flush(self):
+        if self._series is not None:
+            self._series.flush()
+        elif self._out_fd is not None:
+            self._out_fd.flush()
+            self._out_size = os.fstat(self._out_fd.fileno()).st_size
+
+    def finish(self):
+        if not self._started:
+            if self.out_format == "npy":
+                save_series(self.out_file_name, np.empty((0,), dtype=energy_dtype([])))  # no ENERGY_TITLES found
+            else:
+                open(self.out_file_name, "w").close()  # no ENERGY_TITLES found
+        elif self._series is not None:
+            self._series.close()
+        elif self._out_fd is not None:
+            self._out_fd.close()
+            self._out_fd = None
+
+        if self.out_format == "npy":
+            print(f"INFO: Energies vs TS written to binary file: '{self.out_file_name}'"
+                  f" | metadata: '{series_meta_file(self.out_file_name)}'")
+        else:
+            print(f"INFO: Energies vs TS written to file: '{self.out_file_name}' | delimiter: '{self.out_delimiter}'"
+                  f" | comment_token: '{self.comment_token}' | comment_energy_titles: {self.comment_e_titles}")
+        return self.out_file_name
+
+
+class EnergyStats(EnergyReducer):
+    """
+    Streaming statistics of specified (or all) ENERGY values, in a single pass with O(columns) memory:
+    count, mean, variance, min and max of each energy column
+
+    Blocks of records are combined by Welford/Chan pairwise updates, so that partial states from
+    different files, chunks or worker processes can be merged exactly (see merge())
+
+    Result is a dict {energy_title: {"count", "mean", "var", "std", "min", "max"}}
+    where var is the population variance <E^2> - <E>^2
+    """
+
+    def __init__(self, energy_cols: [str, Iterable, None] = None):
+        self.energy_cols = _parse_energy_cols(energy_cols)
+        self.titles = []  # energy titles: list[str]
+        self.count = 0
+        self.mean = None  # np.ndarray of shape (len(titles),)
+        self.m2 = None  # sum of squared deviations from the mean
+        self.min = None
+        self.max = None
+
+    def start(self, e_titles: list, meta: dict):
+        self.titles = _select_e_titles(e_titles, self.energy_cols)
+        self.count = 0
+        self.mean = np.zeros(len(self.titles), dtype=np.float64)
+        self.m2 = np.zeros(len(self.titles), dtype=np.float64)
+        self.min = np.full(len(self.titles), np.inf)
+        self.max = np.full(len(self.titles), -np.inf)
+
+    def _combine(self, count: int, mean: np.ndarray, m2: np.ndarray, _min: np.ndarray, _max: np.ndarray):
+        # Chan et al. pairwise update
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + (delta * delta) * (self.count * count / total)
+        self.count = total
+        np.minimum(self.min, _min, out=self.min)
+        np.maximum(self.max, _max, out=self.max)
+
+    def update(self, records: np.ndarray):
+        if self.titles and len(records):
+            values = rfn.structured_to_unstructured(records[self.titles], dtype=np.float64)
+            mean = values.mean(axis=0)
+            self._combine(len(values), mean, ((values - mean) ** 2).sum(axis=0), values.min(axis=0), values.max(axis=0))
+
+    def merge(self, other: "EnergyStats") -> "EnergyStats":
+        """
+        Merges the partial state of another EnergyStats (over the same ENERGY_TITLES) into this one
+        """
+
+        if other.titles != self.titles:
+            raise ValueError(f"Cannot merge statistics of different energy columns: [{', '.join(self.titles)}]"
+                             f" and [{', '.join(other.titles)}]")
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def finish(self):
+        var = self.m2 / self.count if self.count else np.full(len(self.titles), np.nan)
+        return dict((t, {
+            "count": self.count,
+            "mean": self.mean[i].item() if self.count else np.nan,
+            "var": var[i].item(),
+            "std": np.sqrt(var[i]).item(),
+            "min": self.min[i].item(),
+            "max": self.max[i].item()
+        }) for i, t in enumerate(self.titles))
+
+
+class EnergyAverages(EnergyStats):
+    """
+    Running average of specified (or all) ENERGY values. Result is a dict {energy_title: average}
+    """
+
+    def finish(self):
+        return dict((t, s["mean"]) for t, s in super().finish().items())
+
+
+class EnergyMinMax(EnergyReducer):
+    """
+    Minimum and Maximum of specified (or all) ENERGY values. Result is a dict {energy_title: (min, max)}
+    """
+
+    def __init__(self, energy_cols: [str, Iterable, None] = None):
+        self.energy_cols = _parse_energy_cols(energy_cols)
+        self.titles = []
+        self.mins = None
+        self.maxs = None
+
+    def start(self, e_titles: list, meta: dict):
+        self.titles = _select_e_titles(e_titles, self.energy_cols)
+        self.mins = np.full(len(self.titles), np.inf)
+        self.maxs = np.full(len(self.titles), -np.inf)
+
+    def update(self, records: np.ndarray):
+        if self.titles:
+            values = rfn.structured_to_unstructured(records[self.titles], dtype=np.float64)
+            np.minimum(self.mins, values.min(axis=0), out=self.mins)
+            np.maximum(self.maxs, values.max(axis=0), out=self.maxs)
+
+    def finish(self):
+        return dict((t, (self.mins[i].item(), self.maxs[i].item())) for i, t in enumerate(self.titles))
+
+
+class EnergyHistogram(EnergyReducer):
+    """
+    Histogram of an ENERGY column over a fixed range, accumulated block by block.
+    Result is a tuple (counts, bin_edges), or None if the column is not present in .log file(s)
+
+    @param energy_col : ENERGY_TITLE of the column, ex. "TEMP"
+    @param bins : number of bins
+    @param value_range : (min, max) of the histogram. Values out of this range are not counted
+    """
+
+    def __init__(self, energy_col: str, bins: int, value_range: tuple):
+        self.energy_col = energy_col.strip()
+        self.bin_edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self._present = False
+
+    def start(self, e_titles: list, meta: dict):
+        self._present = self.energy_col in e_titles
+
+    def update(self, records: np.ndarray):
+        if self._present:
+            self.counts += np.histogram(records[self.energy_col], bins=self.bin_edges)[0]
+
+    def finish(self):
+        return (self.counts, self.bin_edges) if self._present else None
+
+
+def run_energy_pipeline(namd_log_files: [str, Iterable],
+                        reducers: Iterable,
+                        start_timestep: int = -1,
+                        end_timestep: int = -1,
+                        use_ts_index: bool = True,
+                        workers: int = 1,
+                        duplicate_ts: [str, None] = None) -> list:
+    """
+    Reads NAMD .log file(s) ONCE, and fans the decoded ENERGY records out to any number of reducers
+
+    @param namd_log_files : NAMD .log file or a list of log files
+    @param reducers : EnergyReducer(s) consuming the records, ex. EnergyTimeSeriesWriter, EnergyAverages
     @param start_timestep : timestep to start reading energy_values from .log file(s).
                             -1 to start from the begining (any timestep present first)
     @param end_timestep : timestep to end reading energy_values from .log file(s).
                             -1 to read till the end of all .log files
-    @param energy_cols : Energy fields required.
-                        can be a single string, or list of strings, or None for all energy fields present in .log file(s)
-    @param out_file_name : name of the output file. None for default
-    @param out_delimiter : delimiter to use for output
-    @param comment_token : A token for comments. Empty string to disable comments
-    @param comment_e_titles : Whether to comment Energy Titles as well. Useful for programs
-                            such as Xmgrace which cannot parse headers
+    @param use_ts_index : whether to seek timestep ranges using the sidecar timestep index of each .log file
+    @param workers : number of worker processes to parse .log files in parallel (large files are split into byte ranges)
+    @param duplicate_ts : how to resolve overlapping timesteps of a restart chain of .log files:
+                        None to keep all, "first" or "last" to keep records of the earlier or later file
+
+    @return list of the results of reducers (in order), see EnergyReducer.finish()
     """
 
-    energy_cols = _parse_energy_cols(energy_cols)
-    if not out_file_name:
-        out_file_name = _out_file_from_energy_cols(energy_cols, suffix="_vs_ts.csv", default_file_name="energies_vs_ts.csv")
-
-    indices = []
-    with open(out_file_name, "w") as out_fd:
-        def e_titles_callback(e_titles: list):
-            if energy_cols:
-                if "TS" not in energy_cols and "TS" in e_titles:
-                    indices.append(e_titles.index("TS"))
-                indices.extend((e_titles.index(c) for c in energy_cols if c in e_titles))
-            else:
-                indices.clear()
-                indices.extend(range(0, len(e_titles)))
-
-            if indices:
-                indices.sort()
-
-                # Comments
-                if comment_token:
-                    out_fd.write(
-                        f"{comment_token} ENERGIES extracted from NAMD .log file(s): [{', '.join(namd_log_files)}]\n")
-                    out_fd.write(f"{comment_token} Start Timestep: {start_timestep} | End Timestep: {end_timestep}\n")
-                    out_fd.write(f"{comment_token} File written on: {datetime.datetime.now()}\n")
-                    out_fd.write(f"{comment_token}-----------------------------\n")
-
-                # Header: Energy Titles
-                out_fd.write((comment_token if comment_token and comment_e_titles else "")
-                             + out_delimiter.join((e_titles[i] for i in indices)))
-
-        def energies_callback(energies):
-            if indices:
-                # Energy Values
-                out_fd.write("\n" + out_delimiter.join((energies[i] for i in indices)))
-
-        _extract_energies_internal(namd_log_files=namd_log_files,
-                                   start_timestep=start_timestep,
-                                   end_timestep=end_timestep,
-                                   e_titles_callback=e_titles_callback,
-                                   energies_callback=energies_callback)
+    if isinstance(namd_log_files, str):
+        namd_log_files = [namd_log_files]
 
-        print(f"INFO: Energies vs TS written to file: '{out_file_name}' | delimiter: '{out_delimiter}'"
-              f" | comment_token: '{comment_token}' | comment_energy_titles: {comment_e_titles}")
+    reducers = list(reducers)
+    meta = {
+        "namd_log_files": list(namd_log_files),
+        "start_timestep": start_timestep,
+        "end_timestep": end_timestep
+    }
 
+    def e_titles_callback(e_titles: list):
+        for r in reducers:
+            r.start(e_titles, meta)
 
-def energies_average(namd_log_files: [str, Iterable],
+    def energies_callback(energies: np.ndarray):
+        for r in reducers:
+            r.update(energies)
+
+    _extract_energies_internal(namd_log_files=meta["namd_log_files"],
+                               start_timestep=start_timestep,
+                               end_timestep=end_timestep,
+                               use_ts_index=use_ts_index,
+                               workers=workers,
+                               duplicate_ts=duplicate_ts,
+                               e_titles_callback=e_titles_callback,
+                               energies_callback=energies_callback)
+
+    return [r.finish() for r in reducers]
+
+
+def follow_energies(log_file: str,
+                    reducers: Iterable,
+                    checkpoint_file: str = None,
+                    poll_interval: float = 30,
+                    max_polls: int = -1,
+                    start_timestep: int = -1,
+                    end_timestep: int = -1,
+                    poll_callback: callable = None,
+                    chunk_size: int = READ_CHUNK_SIZE) -> list:
+    """
+    Follow (tail) mode for a growing .log file of a running NAMD simulation
+
+    On each poll, only the bytes appended since the last poll are read, and the new ENERGY records are
+    fanned out to the reducers, which update their outputs incrementally. The progress (byte offset,
+    partial last line, ENERGY_TITLES and the reducers themselves) is saved to a checkpoint file after every poll.
+    If the checkpoint file exists at the start, following resumes from it, so the cost of each poll depends only
+    on the newly appended data, even across restarts of this process.
+    Outputs are rolled back to the last checkpoint when resuming, or when interrupted (Ctrl-C) in the middle of a poll,
+    so records consumed by a poll that did not complete are never written twice.
+
+    NOTE: On resume, the reducers are restored from the checkpoint, and the given reducers are ignored
+
+    @param log_file : NAMD .log file being written
+    @param reducers : EnergyReducer(s) consuming the records, ex. EnergyTimeSeriesWriter, EnergyStats
+    @param checkpoint_file : checkpoint file path. None for default "<log_file>.follow.ckpt"
+    @param poll_interval : seconds between polls
+    @param max_polls : number of polls before returning, -1 to follow until interrupted (Ctrl-C)
+    @param start_timestep : timestep to start reading energy_values from, -1 for no start bound
+    @param end_timestep : timestep to end reading energy_values at, -1 for no end bound
+    @param poll_callback : a function called after each poll that read new records
+                            > poll_callback(reducers: list[EnergyReducer], new_record_count: int)
+    @param chunk_size : max number of bytes to read at once
+
+    @return list of the results of reducers (in order), see EnergyReducer.finish()
+    """
+
+    if not checkpoint_file:
+        checkpoint_file = log_file + ".follow.ckpt"
+
+    state = {
+        "log_file": os.path.abspath(log_file),
+        "offset": 0,  # bytes of the .log file consumed, including the partial last line
+        "partial": b"",  # incomplete last line
+        "e_titles": None,
+        "reducers": list(reducers)
+    }
+
+    meta = {
+        "namd_log_files": [log_file],
+        "start_timestep": start_timestep,
+        "end_timestep": end_timestep
+    }
+
+    def _save_checkpoint():
+        # only called at consistent points: all reducers have consumed exactly the bytes up to state["offset"]
+        for r in state["reducers"]:
+            r.flush()
+
+        tmp_file = checkpoint_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(tmp_file, checkpoint_file)  # atomic, a crash never leaves a half-written checkpoint
+
+    def _load_checkpoint() -> dict:
+        with open(checkpoint_file, "rb") as f:
+            saved = pickle.load(f)
+
+        if saved["log_file"] != state["log_file"]:
+            raise ValueError(f"Checkpoint file '{checkpoint_file}' belongs to another .log file: '{saved['log_file']}'")
+
+        # drop the output written after the checkpoint (ex. by a poll that crashed or was interrupted)
+        for r in saved["reducers"]:
+            r.restore()
+        return saved
+
+    if os.path.isfile(checkpoint_file):
+        state = _load_checkpoint()
+        print(f"INFO: Resuming to follow '{log_file}' from checkpoint '{checkpoint_file}' at byte {state['offset']}")
+    else:
+        _save_checkpoint()
+
+    def _poll() -> int:
+        new_count = 0
+        with open(log_file, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < state["offset"]:
+                raise ValueError(f".log file '{log_file}' shrank below the checkpoint offset {state['offset']}."
+                                 f" Delete the checkpoint '{checkpoint_file}' to start over")
+
+            f.seek(state["offset"])
+            while chunk := f.read(chunk_size):
+                buf = state["partial"] + chunk
+                nl = buf.rfind(b"\n")
+                block = b"\n" + buf[:nl] if nl >= 0 else b""
+
+                if block and state["e_titles"] is None:
+                    match = _ETITLE_LINE_REGEX.search(block)
+                    if match is None:
+                        block = b""
+                    else:
+                        state["e_titles"] = [t.decode() for t in match.group(1).split()]
+                        for r in state["reducers"]:
+                            r.start(state["e_titles"], meta)
+                        block = block[match.end():]
+
+                if block:
+                    records = _decode_energy_payloads(_ENERGY_LINE_REGEX.findall(block), state["e_titles"])
+                    records = _filter_timesteps(records, start_timestep=start_timestep, end_timestep=end_timestep)
+                    if len(records):
+                        new_count += len(records)
+                        for r in state["reducers"]:
+                            r.update(records)
+
+                # progress is committed only after the chunk is fully processed
+                state["offset"] += len(chunk)
+                state["partial"] = buf[nl + 1:]
+        return new_count
+
+    polls = 0
+    try:
+        while True:
+            new_count = _poll()
+            _save_checkpoint()
+            if new_count and poll_callback:
+                poll_callback(state["reducers"], new_count)
+
+            polls += 1
+            if 0 <= max_polls <= polls:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        # the interrupted poll may have left the reducers half-updated, so roll back to the last checkpoint
+        # (after pushing out any buffered output of the discarded reducers, which the rollback then truncates)
+        for r in state["reducers"]:
+            r.flush()
+        state = _load_checkpoint()
+        print(f"INFO: Stopped following '{log_file}' at byte {state['offset']}. Checkpoint: '{checkpoint_file}'")
+
+    return [r.finish() for r in state["reducers"]]
+
+
+## ==========================  ANALYSIS  ==========================
+
+def extract_energies(namd_log_files: [str, Iterable],
                      start_timestep: int = -1,
                      end_timestep: int = -1,
                      energy_cols: [str, Iterable, None] = None,
                      out_file_name: str = None,
                      out_delimiter: str = " \t ",
                      comment_token: str = "#",
-                     comment_e_titles: bool = False):
+                     comment_e_titles: bool = False,
+                     use_ts_index: bool = True,
+                     workers: int = 1,
+                     duplicate_ts: [str, None] = None,
+                     out_format: str = "text"):
     """
-    Compute AVERAGE ENERGIES from NAMD .log file(s)
+    Extract specified (or all) ENERGY values from NAMD .log file(s)
     within certain timestep range or for all time steps
 
     Generally available ENERGY_COLUMNS:
@@ -195,51 +1648,139 @@ def energies_average(namd_log_files: [str, Iterable],
                             -1 to read till the end of all .log files
     @param energy_cols : Energy fields required.
                         can be a single string, or list of strings, or None for all energy fields present in .log file(s)
-    @param out_file_name : name of the output file, None for default
+    @param out_file_name : name of the output file. None for default
     @param out_delimiter : delimiter to use for output
     @param comment_token : A token for comments. Empty string to disable comments
     @param comment_e_titles : Whether to comment Energy Titles as well. Useful for programs
                             such as Xmgrace which cannot parse headers
+    @param use_ts_index : whether to seek timestep ranges using the sidecar timestep index of each .log file
+    @param workers : number of worker processes to parse .log files in parallel (large files are split into byte ranges)
+    @param duplicate_ts : how to resolve overlapping timesteps of a restart chain of .log files:
+                        None to keep all, "first" or "last" to keep records of the earlier or later file
+    @param out_format : "text" for a delimited text file, or "npy" for a binary time series (.npy with a .json
+                        metadata sidecar) that can be memory-mapped by load_series(). out_delimiter and comment
+                        options are ignored for "npy"
+
+    @return output file name
     """
 
-    energy_cols = _parse_energy_cols(energy_cols)
-    if not out_file_name:
-        out_file_name = _out_file_from_energy_cols(energy_cols, suffix="_avg.csv", default_file_name="energies_avg.csv")
+    writer = EnergyTimeSeriesWriter(energy_cols=energy_cols,
+                                    out_file_name=out_file_name,
+                                    out_delimiter=out_delimiter,
+                                    comment_token=comment_token,
+                                    comment_e_titles=comment_e_titles,
+                                    out_format=out_format)
 
-    indices = []  # indices of energy cols: list[int]
-    titles = []  # energy titles: list[str]
-    values = []  # energy values sum: list[float]
-    value_count = [0]  # hack to make value count mutable within callback
+    return run_energy_pipeline(namd_log_files=namd_log_files,
+                               reducers=[writer],
+                               start_timestep=start_timestep,
+                               end_timestep=end_timestep,
+                               use_ts_index=use_ts_index,
+                               workers=workers,
+                               duplicate_ts=duplicate_ts)[0]
 
-    def e_titles_callback(e_titles: list):
-        if energy_cols:
-            indices.extend((e_titles.index(c) for c in energy_cols if c in e_titles))
-        else:
-            indices.clear()
-            indices.extend(range(0, len(e_titles)))
 
-        if indices:
-            indices.sort()
-            titles.clear()
-            titles.extend((e_titles[idx] for idx in indices))
-            values.clear()
-            values.extend((0 for _ in range(0, len(indices))))  # initialize values with 0
+def specific_heat(energy_stats: dict, temp: float, molar_mass_grams: float = 0) -> dict:
+    """
+    Specific Heat (Cv) from the fluctuation of an energy, Cv = var(E) / (kb * T^2), where var(E) = <E^2> - <E>^2
+    Same as specific_heat.py, but straight from the statistics of EnergyStats reducer (no energies_vs_ts file needed)
+
+    @param energy_stats : statistics of an energy column i.e. EnergyStats result[energy_title]
+    @param temp : Temperature (K)
+    @param molar_mass_grams : Molar mass of the system [or its subset] (grams). 0 to skip Mass Specific Heat
 
-    def energies_callback(energies):
-        if indices:
-            for _i, idx in enumerate(indices):
-                values[_i] += float(energies[idx])
+    @return dict with "molar_cv" (kcal/(mol K)), "molar_cv_si" (J/(mol K)), and if molar mass is given
+            "mass_cv" (kcal/(Kg K)), "mass_cv_si" (J/(Kg K))
+    """
 
-            value_count[0] += 1
+    mol_spec_heat = energy_stats["var"] / (K_b * temp * temp)
+    res = {
+        "molar_cv": mol_spec_heat,
+        "molar_cv_si": mol_spec_heat * CAL_TO_JOULE * 1000
+    }
 
-    _extract_energies_internal(namd_log_files=namd_log_files,
-                               start_timestep=start_timestep,
-                               end_timestep=end_timestep,
-                               e_titles_callback=e_titles_callback,
-                               energies_callback=energies_callback)
+    if molar_mass_grams > 0:
+        mass_spec_heat = mol_spec_heat / (molar_mass_grams * 1000)
+        res["mass_cv"] = mass_spec_heat
+        res["mass_cv_si"] = mass_spec_heat * CAL_TO_JOULE * 1000
+
+    return res
+
+
+def write_energy_statistics(stats: dict,
+                            namd_log_files: [str, Iterable],
+                            start_timestep: int = -1,
+                            end_timestep: int = -1,
+                            out_file_name: str = "energies_stats.csv",
+                            out_delimiter: str = " \t ",
+                            comment_token: str = "#",
+                            comment_e_titles: bool = False):
+    """
+    Prints ENERGY statistics (result of EnergyStats reducer) to console, and writes them to a file,
+    one row per energy column: ENERGY, COUNT, MEAN, VAR, STD, MIN, MAX
+
+    @param stats : dict {energy_title: {"count", "mean", "var", "std", "min", "max"}}
+    @param out_file_name : name of the output file, None or empty str to skip file output
+    @see energies_average() for other parameters
+    """
+
+    if isinstance(namd_log_files, str):
+        namd_log_files = [namd_log_files]
+
+    keys = ("count", "mean", "var", "std", "min", "max")
+
+    # Console Output
+    print("----------------------")
+    print("ENERGY STATISTICS:")
+    print("\n".join(f"-> {t} : " + " | ".join(f"{k}: {s[k]}" for k in keys) for t, s in stats.items()))
+
+    # File Output
+    if out_file_name:
+        meta = {
+            "namd_log_files": namd_log_files,
+            "start_timestep": start_timestep,
+            "end_timestep": end_timestep
+        }
+
+        with open(out_file_name, "w") as out_fd:
+            _write_comment_header(out_fd, comment_token, "ENERGY STATISTICS calculated from", meta)
+            out_fd.write((comment_token if comment_token and comment_e_titles else "")
+                         + out_delimiter.join(["ENERGY"] + [k.upper() for k in keys]))
+
+            for t, s in stats.items():
+                out_fd.write("\n" + out_delimiter.join([t] + [str(s[k]) for k in keys]))
+
+        print("----------------------")
+        print(f"INFO: Energy Statistics written to file: '{out_file_name}' | delimiter: '{out_delimiter}'"
+              f" | comment_token: '{comment_token}' | comment_energy_titles: {comment_e_titles}")
+
+
+def write_energy_averages(averages: dict,
+                          namd_log_files: [str, Iterable],
+                          start_timestep: int = -1,
+                          end_timestep: int = -1,
+                          energy_cols: [str, Iterable, None] = None,
+                          out_file_name: str = None,
+                          out_delimiter: str = " \t ",
+                          comment_token: str = "#",
+                          comment_e_titles: bool = False):
+    """
+    Prints AVERAGE ENERGIES (result of EnergyAverages reducer) to console, and writes them to a file
+
+    @param averages : dict {energy_title: average}
+    @param out_file_name : name of the output file, None for default
+    @see energies_average() for other parameters
+    """
+
+    if isinstance(namd_log_files, str):
+        namd_log_files = [namd_log_files]
+
+    energy_cols = _parse_energy_cols(energy_cols)
+    if not out_file_name:
+        out_file_name = _out_file_from_energy_cols(energy_cols, suffix="_avg.csv", default_file_name="energies_avg.csv")
 
-    for i in range(0, len(values)):
-        values[i] /= value_count[0]
+    titles = list(averages.keys())
+    values = list(averages.values())
 
     # Console Output
     print("----------------------")
@@ -248,17 +1789,15 @@ def energies_average(namd_log_files: [str, Iterable],
 
     # File Output
     if out_file_name:
-        if isinstance(namd_log_files, str):
-            namd_log_files = [namd_log_files]
+        meta = {
+            "namd_log_files": namd_log_files,
+            "start_timestep": start_timestep,
+            "end_timestep": end_timestep
+        }
 
         with open(out_file_name, "w") as out_fd:
             # Comments
-            if comment_token:
-                out_fd.write(
-                    f"{comment_token} ENERGY AVERAGES calculated from NAMD .log file(s): [{', '.join(namd_log_files)}]\n")
-                out_fd.write(f"{comment_token} Start Timestep: {start_timestep} | End Timestep: {end_timestep}\n")
-                out_fd.write(f"{comment_token} File written on: {datetime.datetime.now()}\n")
-                out_fd.write(f"{comment_token}-----------------------------\n")
+            _write_comment_header(out_fd, comment_token, "ENERGY AVERAGES calculated from", meta)
 
             # Header: Energy Titles
             out_fd.write((comment_token if comment_token and comment_e_titles else "")
@@ -271,7 +1810,62 @@ def energies_average(namd_log_files: [str, Iterable],
         print(f"INFO: Average Energies written to file: '{out_file_name}' | delimiter: '{out_delimiter}'"
               f" | comment_token: '{comment_token}' | comment_energy_titles: {comment_e_titles}")
 
-    return dict((titles[i], values[i]) for i in range(0, len(titles)))
+
+def energies_average(namd_log_files: [str, Iterable],
+                     start_timestep: int = -1,
+                     end_timestep: int = -1,
+                     energy_cols: [str, Iterable, None] = None,
+                     out_file_name: str = None,
+                     out_delimiter: str = " \t ",
+                     comment_token: str = "#",
+                     comment_e_titles: bool = False,
+                     use_ts_index: bool = True,
+                     workers: int = 1,
+                     duplicate_ts: [str, None] = None):
+    """
+    Compute AVERAGE ENERGIES from NAMD .log file(s)
+    within certain timestep range or for all time steps
+
+    Generally available ENERGY_COLUMNS:
+    BOND, ANGLE, DIHED, IMPRP, ELECT, VDW, BOUNDARY, MISC, KINETIC, TOTAL, TEMP, POTENTIAL, TOTAL3, TEMPAVG
+
+    @param namd_log_files : NAMD .log file or a list of log files
+    @param start_timestep : timestep to start reading energy_values from .log file(s).
+                            -1 to start from the begining (any timestep present first)
+    @param end_timestep : timestep to end reading energy_values from .log file(s).
+                            -1 to read till the end of all .log files
+    @param energy_cols : Energy fields required.
+                        can be a single string, or list of strings, or None for all energy fields present in .log file(s)
+    @param out_file_name : name of the output file, None for default
+    @param out_delimiter : delimiter to use for output
+    @param comment_token : A token for comments. Empty string to disable comments
+    @param comment_e_titles : Whether to comment Energy Titles as well. Useful for programs
+                            such as Xmgrace which cannot parse headers
+    @param use_ts_index : whether to seek timestep ranges using the sidecar timestep index of each .log file
+    @param workers : number of worker processes to parse .log files in parallel (large files are split into byte ranges)
+    @param duplicate_ts : how to resolve overlapping timesteps of a restart chain of .log files:
+                        None to keep all, "first" or "last" to keep records of the earlier or later file
+    """
+
+    averages, = run_energy_pipeline(namd_log_files=namd_log_files,
+                                    reducers=[EnergyAverages(energy_cols=energy_cols)],
+                                    start_timestep=start_timestep,
+                                    end_timestep=end_timestep,
+                                    use_ts_index=use_ts_index,
+                                    workers=workers,
+                                    duplicate_ts=duplicate_ts)
+
+    write_energy_averages(averages,
+                          namd_log_files=namd_log_files,
+                          start_timestep=start_timestep,
+                          end_timestep=end_timestep,
+                          energy_cols=energy_cols,
+                          out_file_name=out_file_name,
+                          out_delimiter=out_delimiter,
+                          comment_token=comment_token,
+                          comment_e_titles=comment_e_titles)
+
+    return averages
 
 
 if __name__ == '__main__':
@@ -286,30 +1880,88 @@ if __name__ == '__main__':
     start_timestep = -1     # TODO: START Timestep, or -1 to start form beginning
     end_timestep = -1       # TODO: END Timestep, or -1 to read till the end of all .log file(s)
 
+    workers = 1             # Number of processes to parse .log files in parallel (large files are split into byte ranges)
+    duplicate_ts = None     # Overlapping timesteps of a restart chain: None to keep all, "first" or "last" to keep earlier or later file
+
+    ## Follow mode: keep reading a growing .log file of a running simulation (first .log file only)
+    follow = False          # TODO: True to follow the .log file, stop with Ctrl-C (progress is checkpointed and resumed)
+    follow_poll_interval = 30       # seconds between polls
+
+    ## Specific Heat (Cv) from energy fluctuations (optional)
+    cv_energy_col = None    # TODO: Energy column to calculate Cv for, ex. "TOTAL". None to skip
+    cv_temp = 300           # Temperature (K)
+    cv_molar_mass_grams = 0     # Molar mass of the system (grams). 0 to skip Mass Specific Heat
+
     ## =====================  OUTPUT CONFIG  ==========================
     output_file = None          # None or empty str for default
+    output_format = "text"      # "text" for delimited text, or "npy" for binary .npy + .json metadata (see load_series)
+    stats_output_file = "energies_stats.csv"    # None or empty str to skip
     out_delimiter = " \t "
     comment_token = "#"         # Empty string to disable comments
     comment_e_titles = True    # whether to comment ENERGY TITLES in the Header, useful for Xmgrace
 
     ## ----------------------------------------------------------------
 
-    ## EXTRACT ENERGIES vs TS
-    extract_energies(namd_log_files=namd_log_files,
-                     energy_cols=energy_columns,
-                     start_timestep=start_timestep,
-                     end_timestep=end_timestep,
-                     out_file_name=output_file,
-                     out_delimiter=out_delimiter,
-                     comment_token=comment_token,
-                     comment_e_titles=comment_e_titles)
+    ## EXTRACT ENERGIES vs TS and ENERGY STATISTICS, in a single pass over the .log file(s)
+    if follow:
+        def _print_poll(_reducers, _new_count):
+            print(f"{datetime.datetime.now():%H:%M:%S} -> {_new_count} new records, "
+                  + ", ".join(f"{t}: {s['mean']:.4f} ± {s['std']:.4f}" for t, s in _reducers[1].finish().items()))
+
+        _, stats = follow_energies(log_file=namd_log_files if isinstance(namd_log_files, str) else namd_log_files[0],
+                                   reducers=[
+                                       EnergyTimeSeriesWriter(energy_cols=energy_columns,
+                                                              out_file_name=output_file,
+                                                              out_delimiter=out_delimiter,
+                                                              comment_token=comment_token,
+                                                              comment_e_titles=comment_e_titles,
+                                                              out_format=output_format),
+                                       EnergyStats(energy_cols=energy_columns)
+                                   ],
+                                   poll_interval=follow_poll_interval,
+                                   start_timestep=start_timestep,
+                                   end_timestep=end_timestep,
+                                   poll_callback=_print_poll)
+    else:
+        _, stats = run_energy_pipeline(namd_log_files=namd_log_files,
+                                       reducers=[
+                                           EnergyTimeSeriesWriter(energy_cols=energy_columns,
+                                                                  out_file_name=output_file,
+                                                                  out_delimiter=out_delimiter,
+                                                                  comment_token=comment_token,
+                                                                  comment_e_titles=comment_e_titles,
+                                                                  out_format=output_format),
+                                           EnergyStats(energy_cols=energy_columns)
+                                       ],
+                                       start_timestep=start_timestep,
+                                       end_timestep=end_timestep,
+                                       workers=workers,
+                                       duplicate_ts=duplicate_ts)
 
     ## AVERAGE ENERGIES
-    energies_average(namd_log_files=namd_log_files,
-                     energy_cols=energy_columns,
-                     start_timestep=start_timestep,
-                     end_timestep=end_timestep,
-                     out_file_name=output_file,
-                     out_delimiter=out_delimiter,
-                     comment_token=comment_token,
-                     comment_e_titles=comment_e_titles)
+    write_energy_averages(dict((t, s["mean"]) for t, s in stats.items()),
+                          namd_log_files=namd_log_files,
+                          start_timestep=start_timestep,
+                          end_timestep=end_timestep,
+                          energy_cols=energy_columns,
+                          out_file_name=output_file,
+                          out_delimiter=out_delimiter,
+                          comment_token=comment_token,
+                          comment_e_titles=comment_e_titles)
+
+    ## ENERGY STATISTICS: count, mean, variance, std, min, max
+    write_energy_statistics(stats,
+                            namd_log_files=namd_log_files,
+                            start_timestep=start_timestep,
+                            end_timestep=end_timestep,
+                            out_file_name=stats_output_file,
+                            out_delimiter=out_delimiter,
+                            comment_token=comment_token,
+                            comment_e_titles=comment_e_titles)
+
+    ## SPECIFIC HEAT
+    if cv_energy_col and cv_energy_col in stats:
+        cv = specific_heat(stats[cv_energy_col], temp=cv_temp, molar_mass_grams=cv_molar_mass_grams)
+        print("----------------------")
+        print(f"Specific Heat (Cv) for {cv_energy_col} energy at T = {cv_temp} K [Cv = var(E) / (kb * T^2)]:")
+        print("\n".join(f"-> {k} : {v}" for k, v in cv.items()))
@@ -0,0 +1,342 @@
+"""
+Step (change-point) and dwell-time detection for Constant-Force Pull (pcf) SMD trajectories
+
+Under a constant force, the end-to-end distance of a protein jumps between plateaus as it unfolds in discrete steps.
+Each distance vs time trace is segmented into plateaus of constant mean by PELT (Pruned Exact Linear Time,
+Killick et al. 2012) with a least squares (L2) cost, evaluated in O(1) per segment from cumulative sums.
+PELT finds the exact optimum of the penalized cost, and pruning keeps it close to linear in the trace length.
+For very long plateaus, the O(N log N) binary segmentation is a faster approximate alternative.
+By default the change point penalty is adapted to the (time correlated) noise of each trace, see auto_penalty.
+Traces that drift rather than step may need an explicit penalty.
+
+For each plateau, the output table reports
+    replica, segment, start_time, end_time, dwell_time, level (mean distance), step (level - previous level)
+
+Replicas are processed in parallel worker processes.
+
+INPUT: two column files "time distance" (ex. dist_vs_frame.dat written by distance.tcl), "#" for comments
+
+USAGE:
+1. Copy this script to your working dir
+2. go to __name__ == __main__ section and set input parameters
+3. run with "python pcf_steps.py"
+
+## UNITS: Distance (Å), time in the units of the input (scaled by time_scale)
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+COMMENT_TOKEN = "#"
+STEP_COLUMNS = ["replica", "segment", "start_time", "end_time", "dwell_time", "level", "step"]
+
+
+def noise_variance(values: np.ndarray, lag: int = 1) -> float:
+    """
+    Robust estimate of the noise variance of a piecewise constant signal, from the median absolute difference
+    between points lag apart (insensitive to the steps). A lag of about the minimum plateau length also captures
+    the slow, correlated fluctuations of MD traces
+    """
+
+    lag = max(1, lag)
+    if len(values) <= lag:
+        return 0.0
+    sigma = np.median(np.abs(values[lag:] - values[:-lag])) / (0.6745 * np.sqrt(2))
+    return float(sigma * sigma)
+
+
+def autocorr_time(values: np.ndarray, window_factor: float = 5.0) -> float:
+    """
+    Integrated autocorrelation time τ (in points) of a fluctuating signal, 1 for uncorrelated noise.
+    The autocorrelation (by FFT) is summed up to the smallest lag M >= window_factor * τ(M) (Sokal's window)
+    """
+
+    x = values - values.mean()
+    n = len(x)
+    if n < 2 or not np.any(x):
+        return 1.0
+
+    f = np.fft.rfft(x, 2 * n)
+    acf = np.fft.irfft(f * np.conj(f))[:n]
+    taus = 1 + 2 * np.cumsum(acf[1:] / acf[0])
+    window = np.flatnonzero(np.arange(1, n) >= window_factor * taus)
+    return float(max(1.0, taus[window[0]] if len(window) else taus[-1]))
+
+
+def _l2_cumsums(values: np.ndarray) -> tuple:
+    x = values - values.mean()  # centered, to limit cancellation in the cost
+    return np.concatenate(([0.0], np.cumsum(x))), np.concatenate(([0.0], np.cumsum(x * x)))
+
+
+def pelt_l2(values: np.ndarray, penalty: float, min_size: int = 2) -> np.ndarray:
+    """
+    Exact penalized segmentation of a signal into segments of constant mean (PELT with L2 cost)
+
+    @param values: signal of shape (N,)
+    @param penalty: cost of adding a change point (in units of squared signal)
+    @param min_size: minimum number of points in a segment
+
+    @return segment boundaries [0, c1, c2, ..., N], segment i spans values[bounds[i]:bounds[i + 1]]
+    """
+
+    n = len(values)
+    min_size = max(1, min_size)
+    if n < 2 * min_size:
+        return np.array([0, n], dtype=np.int64)
+
+    s1, s2 = _l2_cumsums(values)
+    f = np.full(n + 1, np.inf)
+    f[0] = -penalty
+    last = np.zeros(n + 1, dtype=np.int64)
+
+    candidates = np.zeros(n + 1, dtype=np.int64)  # buffer of the candidate last change points
+    k = 1
+    for t in range(min_size, n + 1):
+        s_new = t - min_size
+        if s_new >= min_size:
+            # s_new becomes admissible: prune the candidates it beats. Pruning is only valid from here on,
+            # as s_new cannot be the last change point of the segments ending before s_new + min_size
+            c = candidates[:k]
+            seg_sum = s1[s_new] - s1[c]
+            keep = f[c] + (s2[s_new] - s2[c]) - seg_sum * seg_sum / (s_new - c) <= f[s_new]
+            k = np.count_nonzero(keep)
+            candidates[:k] = c[keep]
+
+            candidates[k] = s_new
+            k += 1
+
+        c = candidates[:k]
+        seg_sum = s1[t] - s1[c]
+        cost = f[c] + (s2[t] - s2[c]) - seg_sum * seg_sum / (t - c)
+
+        i = np.argmin(cost)
+        f[t] = cost[i] + penalty
+        last[t] = c[i]
+
+    bounds = [n]
+    while bounds[-1] > 0:
+        bounds.append(last[bounds[-1]])
+    return np.array(bounds[::-1], dtype=np.int64)
+
+
+def binseg_l2(values: np.ndarray, penalty: float, min_size: int = 2) -> np.ndarray:
+    """
+    Approximate segmentation by binary segmentation with L2 cost, O(N log N): a segment is split at its best
+    change point as long as the split lowers the cost by more than the penalty. Much faster than PELT
+    on long traces with long plateaus, but not guaranteed to find the exact optimum
+
+    @return segment boundaries [0, c1, c2, ..., N] (see pelt_l2)
+    """
+
+    n = len(values)
+    min_size = max(1, min_size)
+    s1, s2 = _l2_cumsums(values)
+
+    def _cost(a, b):
+        return (s2[b] - s2[a]) - (s1[b] - s1[a]) ** 2 / (b - a)
+
+    bounds = [0, n]
+    stack = [(0, n)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2 * min_size:
+            continue
+
+        split = np.arange(a + min_size, b - min_size + 1)
+        gain = _cost(a, b) - _cost(a, split) - _cost(split, b)
+        i = np.argmax(gain)
+        if gain[i] > penalty:
+            bounds.append(int(split[i]))
+            stack.extend(((a, int(split[i])), (int(split[i]), b)))
+
+    return np.array(sorted(bounds), dtype=np.int64)
+
+
+_SEGMENTATION_METHODS = {
+    "pelt": pelt_l2,
+    "binseg": binseg_l2
+}
+
+
+def _step_residuals(values: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    level = (csum[bounds[1:]] - csum[bounds[:-1]]) / np.diff(bounds)
+    return values - np.repeat(level, np.diff(bounds))
+
+
+def auto_penalty(values: np.ndarray,
+                 penalty_factor: float = 2.0,
+                 min_size: int = 10,
+                 method: str = "pelt",
+                 max_iter: int = 20) -> tuple:
+    """
+    Change point penalty adapted to correlated (MD) noise: penalty_factor * σ² * τ * ln(N), with the variance σ²
+    and the integrated autocorrelation time τ (see autocorr_time) of the residuals of the segmentation.
+    Starting from the noise variance at lag min_size (see noise_variance), the penalty and the segmentation are
+    iterated until the segmentation no longer changes. A slowly drifting trace may have no such stable segmentation,
+    then the penalty of the last iteration is returned and the penalty should be set by hand
+
+    @return (penalty, bounds, converged), bounds being the segmentation at that penalty (see pelt_l2)
+    """
+
+    n = max(len(values), 2)
+    segment = _SEGMENTATION_METHODS[method]
+
+    penalty = penalty_factor * noise_variance(values, lag=min_size) * np.log(n)
+    bounds = segment(values, penalty=penalty, min_size=min_size)
+    for _ in range(max_iter):
+        res = _step_residuals(values, bounds)
+        penalty = penalty_factor * float(np.var(res)) * autocorr_time(res) * np.log(n)
+
+        new_bounds = segment(values, penalty=penalty, min_size=min_size)
+        if np.array_equal(new_bounds, bounds):
+            return penalty, bounds, True
+
+        collapsed = len(new_bounds) == 2 < len(bounds)
+        bounds = new_bounds
+        if collapsed:
+            break  # a single plateau is always self-consistent: no segmentation is stable
+
+    return penalty, bounds, False
+
+
+def detect_steps(time: np.ndarray,
+                 dist: np.ndarray,
+                 penalty: float = None,
+                 penalty_factor: float = 2.0,
+                 min_size: int = 10,
+                 method: str = "pelt") -> dict:
+    """
+    Plateaus, step sizes and dwell times of a distance vs time trace
+
+    @param penalty: change point penalty (Å^2), or None for penalty_factor * σ² * τ * ln(N), adapted to the
+                    correlated noise of the trace (see auto_penalty). A warning is printed if that fails,
+                    then the penalty must be set (ex. from the expected step size: a step δ between plateaus
+                    of n points lowers the cost by about δ² * n / 2)
+    @param min_size: minimum number of points in a plateau
+    @param method: "pelt" for the exact segmentation (see pelt_l2), or "binseg" for the faster approximate one
+                    (see binseg_l2)
+
+    @return dict of arrays over the plateaus: "start_time", "end_time", "dwell_time", "level" and "step"
+            (step of the first plateau is 0)
+    """
+
+    if method not in _SEGMENTATION_METHODS:
+        raise ValueError(f"method must be one of [{', '.join(_SEGMENTATION_METHODS)}], given: '{method}'")
+
+    if penalty is None:
+        penalty, bounds, converged = auto_penalty(dist, penalty_factor=penalty_factor, min_size=min_size, method=method)
+        if not converged:
+            print(f"WARNING: No stable segmentation of the trace for an automatic penalty (last: {penalty:.4g} Å^2,"
+                  f" {len(bounds) - 1} plateaus). Set the penalty explicitly")
+    else:
+        bounds = _SEGMENTATION_METHODS[method](dist, penalty=penalty, min_size=min_size)
+    starts, ends = bounds[:-1], bounds[1:]
+    csum = np.concatenate(([0.0], np.cumsum(dist)))
+    level = (csum[ends] - csum[starts]) / (ends - starts)
+
+    start_time = time[starts]
+    end_time = time[np.minimum(ends, len(time) - 1)]
+    return {
+        "start_time": start_time,
+        "end_time": end_time,
+        "dwell_time": end_time - start_time,
+        "level": level,
+        "step": np.diff(level, prepend=level[0])
+    }
+
+
+def replica_steps(dist_file: str,
+                  time_scale: float = 1.0,
+                  penalty: float = None,
+                  penalty_factor: float = 2.0,
+                  min_size: int = 10,
+                  method: str = "pelt") -> dict:
+    """
+    Steps of a single replica from its "time distance" file. Unit of work of the parallel batch (see pcf_steps)
+    """
+
+    data = np.loadtxt(dist_file, comments=COMMENT_TOKEN, usecols=(0, 1), ndmin=2)
+    return detect_steps(data[:, 0] * time_scale, data[:, 1],
+                        penalty=penalty, penalty_factor=penalty_factor, min_size=min_size, method=method)
+
+
+def pcf_steps(dist_files: list,
+              time_scale: float = 1.0,
+              penalty: float = None,
+              penalty_factor: float = 2.0,
+              min_size: int = 10,
+              method: str = "pelt",
+              workers: int = 1,
+              out_file: str = "pcf_steps.csv",
+              out_file_delimiter: str = " \t ") -> list:
+    """
+    Steps and dwell times of many constant force replicas, in parallel
+
+    @param dist_files: "time distance" files, one per replica
+    @param time_scale: factor to convert the time column, ex. frame -> ns
+    @param penalty: change point penalty (Å^2), or None to adapt it to the noise of each trace (see auto_penalty)
+    @param min_size: minimum number of points in a plateau
+    @param method: "pelt" (exact) or "binseg" (approximate, faster), see detect_steps
+    @param workers: number of worker processes, one replica per task
+    @param out_file: output table of all plateaus of all replicas (columns STEP_COLUMNS). None to skip
+
+    @return list of rows, each a tuple of STEP_COLUMNS
+    """
+
+    dist_files = list(dist_files)
+    n = len(dist_files)
+    args = ([time_scale] * n, [penalty] * n, [penalty_factor] * n, [min_size] * n, [method] * n)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(replica_steps, dist_files, *args))
+    else:
+        results = list(map(replica_steps, dist_files, *args))
+
+    rows = []
+    for f, res in zip(dist_files, results):
+        replica = os.path.basename(f)
+        rows.extend((replica, i) + seg for i, seg in enumerate(zip(*(res[c].tolist() for c in STEP_COLUMNS[2:]))))
+
+    # dwell times of the plateaus before a step (the last plateau of a trace is censored)
+    dwell = np.concatenate([res["dwell_time"][:-1] for res in results]) if results else np.empty(0)
+    steps = np.concatenate([res["step"][1:] for res in results]) if results else np.empty(0)
+    print(f"INFO: {len(steps)} steps in {n} replicas"
+          + (f" | mean step: {steps.mean():.3f} Å | mean dwell time: {dwell.mean():.3f}" if len(steps) else ""))
+
+    if out_file:
+        with open(out_file, "w") as out_fd:
+            out_fd.write(f"{COMMENT_TOKEN} Constant force steps of {n} replicas | method: {method} | min_size: {min_size}"
+                         f" | penalty: {penalty if penalty is not None else f'{penalty_factor} * σ² * τ * ln(N)'}\n")
+            out_fd.write(out_file_delimiter.join(STEP_COLUMNS))
+            out_fd.write("".join("\n" + out_file_delimiter.join(map(str, row)) for row in rows))
+
+    return rows
+
+
+if __name__ == "__main__":
+    # TODO: set input parameters
+    dist_files = sorted(glob.glob("dist_vs_frame*.dat"))     # "time distance" files, one per replica
+    time_scale = 1.0        # time column factor, ex. (dcd frequency * timestep) to convert frames to fs
+    penalty = None          # change point penalty (Å^2), None for penalty_factor * σ² * τ * ln(N) (see auto_penalty)
+    penalty_factor = 2.0
+    min_size = 10           # minimum points in a plateau
+    method = "pelt"         # "pelt" for exact segmentation, "binseg" for faster approximate segmentation
+    workers = 4             # number of worker processes
+
+    out_file = "pcf_steps.csv"
+    out_file_delimiter = " \t "
+
+    pcf_steps(dist_files=dist_files,
+              time_scale=time_scale,
+              penalty=penalty,
+              penalty_factor=penalty_factor,
+              min_size=min_size,
+              method=method,
+              workers=workers,
+              out_file=out_file,
+              out_file_delimiter=out_file_delimiter)
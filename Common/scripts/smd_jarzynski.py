@@ -0,0 +1,316 @@
+"""
+Jarzynski free energy (PMF) along the pull coordinate from many Constant-Velocity Pull (pcv) SMD replicas
+
+For each replica (NAMD .log file, or a restart chain of .log files) the work done by the SMD spring
+    W(λ) = ∫ F dλ
+is integrated (trapezoidal rule) along the pull coordinate λ = v * (timestep - first_timestep), i.e. the distance
+travelled by the dummy atom, where F is the SMD force along the pull direction. Replicas are processed in parallel
+worker processes, and their work profiles are interpolated onto a common extension grid.
+
+PMF estimates on the grid:
+1. Jarzynski exponential average: ΔF(λ) = -kT ln <exp(-W(λ) / kT)>, computed as a log-sum-exp for numerical stability
+2. 2nd order cumulant expansion: ΔF(λ) = <W(λ)> - var(W(λ)) / (2 kT)
+
+Optionally, bootstrap error bars (std and confidence interval) of both estimates, by resampling the replicas
+
+Pull velocity and direction are read from the "Info: SMD VELOCITY" and "Info: SMD DIRECTION" lines of each .log file,
+unless given explicitly
+
+USAGE:
+1. Copy this script (along with namd_energy.py and smd_pcv_analysis.py) to your working dir
+2. go to __name__ == __main__ section and set input parameters
+3. run with "python smd_jarzynski.py"
+
+## UNITS: Energy (kcal/mol), Distance (Å), Force (pN), T (K)
+"""
+
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib import recfunctions as rfn
+from scipy.integrate import cumulative_trapezoid
+from scipy.special import logsumexp
+
+from namd_energy import K_b, extract_log_records, save_series, smd_params
+from smd_pcv_analysis import calculate_smd_array, is_vec_nonzero, vec_normalize
+
+PN_A_TO_KCAL_MOL = 6.02214076e23 * 1e-22 / 4184  # 1 pN.Å = 1e-22 J (per molecule) ~ 0.014393 kcal/mol
+
+BOOTSTRAP_CHUNK_BYTES = 64 * 1024 * 1024  # max size of the resampled work array of a bootstrap chunk
+
+
+def replica_work(namd_log_files: [str, list],
+                 pull_dir_vec: tuple = None,
+                 velocity: float = None) -> tuple:
+    """
+    Work profile of a single SMD replica. Unit of work of the parallel batch (see jarzynski_pmf)
+
+    @param namd_log_files: NAMD .log file of the replica, or a list of .log files of a restart chain
+    @param pull_dir_vec: pull direction, or None to read it from "Info: SMD DIRECTION"
+    @param velocity: pull velocity (Å/timestep), or None to read it from "Info: SMD VELOCITY"
+
+    @return (pull_coord, work) arrays of shape (N,), in Å and kcal/mol
+    """
+
+    res = extract_log_records(namd_log_files, record_types=["SMD", "INFO"])
+    if res["SMD"] is None:
+        raise ValueError(f"No SMD records in .log file(s): {namd_log_files}")
+
+    params = smd_params(res["INFO"] or [])
+    if not is_vec_nonzero(pull_dir_vec):
+        pull_dir_vec = params.get("direction")
+    if velocity is None:
+        velocity = params.get("velocity")
+
+    if not is_vec_nonzero(pull_dir_vec):
+        raise ValueError(f"SMD pull direction not found in .log file(s): {namd_log_files}")
+    if not velocity:
+        raise ValueError(f"SMD pull velocity not found in .log file(s): {namd_log_files}")
+
+    smd = rfn.structured_to_unstructured(res["SMD"], dtype=np.float64)
+    force = calculate_smd_array(smd, pull_dir_unit_vec=vec_normalize(pull_dir_vec))["smd_com_force"]
+
+    pull_coord = velocity * (smd[:, 0] - smd[0, 0])
+    work = cumulative_trapezoid(force, pull_coord, initial=0) * PN_A_TO_KCAL_MOL
+    return pull_coord, work
+
+
+def work_matrix(replicas: list,
+                grid: np.ndarray = None,
+                grid_points: int = 500,
+                pull_dir_vec: tuple = None,
+                velocity: float = None,
+                workers: int = 1) -> tuple:
+    """
+    Work profiles of all SMD replicas on a common extension grid
+
+    @param replicas: list of replicas, each a NAMD .log file or a list of .log files of a restart chain
+    @param grid: extension grid (Å), or None for grid_points equally spaced points from 0 to the
+                 shortest pull among the replicas
+    @param workers: number of worker processes, one replica per task
+
+    @return (grid, work) where work is an array of shape (replicas, grid points) in kcal/mol
+    """
+
+    replicas = list(replicas)
+    args = ([pull_dir_vec] * len(replicas), [velocity] * len(replicas))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            profiles = list(executor.map(replica_work, replicas, *args))
+    else:
+        profiles = list(map(replica_work, replicas, *args))
+
+    if grid is None:
+        grid = np.linspace(0, min(coord[-1] for coord, _ in profiles), grid_points)
+    else:
+        grid = np.asarray(grid, dtype=np.float64)
+
+    work = np.empty((len(profiles), len(grid)), dtype=np.float64)
+    for i, (coord, w) in enumerate(profiles):
+        work[i] = np.interp(grid, coord, w)
+    return grid, work
+
+
+def jarzynski_estimates(work: np.ndarray, temp: float) -> dict:
+    """
+    PMF estimates from a work matrix of shape (replicas, grid points), in kcal/mol
+
+    @return dict of arrays over the grid: "work_mean", "work_std", "pmf_jarzynski" (exponential average)
+            and "pmf_cumulant" (2nd order cumulant expansion)
+    """
+
+    kt = K_b * temp
+    n = work.shape[0]
+    work_mean = work.mean(axis=0)
+    work_var = work.var(axis=0)
+
+    return {
+        "work_mean": work_mean,
+        "work_std": np.sqrt(work_var),
+        "pmf_jarzynski": -kt * (logsumexp(-work / kt, axis=0) - np.log(n)),
+        "pmf_cumulant": work_mean - work_var / (2 * kt)
+    }
+
+
+def load_work_matrix(work_file: str) -> tuple:
+    """
+    Loads a work matrix saved by jarzynski_pmf(..., work_out_file=...)
+
+    @return (grid, work) where work is an array of shape (replicas, grid points) in kcal/mol
+    """
+
+    with np.load(work_file) as data:
+        return data["grid"], data["work"]
+
+
+def _bootstrap_chunk(work: np.ndarray, temp: float, n_samples: int, seed_seq: np.random.SeedSequence) -> tuple:
+    """
+    PMF estimates of n_samples bootstrap resamples of the replicas, drawn as one (n_samples, replicas) index array.
+    Unit of work of bootstrap_pmf
+
+    @return (pmf_jarzynski, pmf_cumulant) arrays of shape (n_samples, grid points)
+    """
+
+    kt = K_b * temp
+    n = work.shape[0]
+    idx = np.random.default_rng(seed_seq).integers(0, n, size=(n_samples, n))
+    samples = work[idx]  # (n_samples, replicas, grid points)
+
+    mean = samples.mean(axis=1)
+    pmf_cumulant = mean - np.square(samples - mean[:, None, :]).mean(axis=1) / (2 * kt)
+
+    # log-sum-exp of -W/kT over the replicas, in place on the resampled array
+    samples *= -1 / kt
+    m = samples.max(axis=1)
+    samples -= m[:, None, :]
+    np.exp(samples, out=samples)
+    pmf_jarzynski = -kt * (np.log(samples.sum(axis=1)) + m - np.log(n))
+    return pmf_jarzynski, pmf_cumulant
+
+
+def bootstrap_pmf(work: np.ndarray,
+                  temp: float = 300,
+                  n_bootstrap: int = 1000,
+                  ci: float = 0.95,
+                  seed: int = None,
+                  workers: int = 1,
+                  chunk_bytes: int = BOOTSTRAP_CHUNK_BYTES) -> dict:
+    """
+    Bootstrap error bars of the PMF estimates (see jarzynski_estimates), by resampling the replicas with replacement
+
+    Resamples are processed in chunks sized so that the resampled work array of a chunk stays within chunk_bytes.
+    Every chunk draws from its own random stream, spawned from a single SeedSequence, so the result for a given seed
+    does not depend on the number of workers
+
+    @param work: work matrix of shape (replicas, grid points) in kcal/mol (see work_matrix, load_work_matrix)
+    @param temp: Temperature (K)
+    @param n_bootstrap: number of bootstrap resamples
+    @param ci: confidence level of the interval, ex. 0.95
+    @param seed: seed of the random streams, None for a random seed
+    @param workers: number of worker processes, one chunk per task
+
+    @return dict of arrays over the grid: "<estimate>_std", "<estimate>_lo" and "<estimate>_hi"
+            for estimate in "pmf_jarzynski" and "pmf_cumulant"
+    """
+
+    work = np.asarray(work, dtype=np.float64)
+    chunk_samples = max(1, chunk_bytes // max(1, work.size * work.itemsize))
+    sizes = [min(chunk_samples, n_bootstrap - i) for i in range(0, n_bootstrap, chunk_samples)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = ([work] * len(sizes), [temp] * len(sizes), sizes, seeds)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_bootstrap_chunk, *args))
+    else:
+        chunks = list(map(_bootstrap_chunk, *args))
+
+    res = {}
+    q = 100 * (1 - ci) / 2
+    for i, name in enumerate(("pmf_jarzynski", "pmf_cumulant")):
+        samples = np.concatenate([c[i] for c in chunks])
+        res[f"{name}_std"] = samples.std(axis=0)
+        res[f"{name}_lo"], res[f"{name}_hi"] = np.percentile(samples, [q, 100 - q], axis=0)
+    return res
+
+
+def jarzynski_pmf(replicas: list,
+                  temp: float = 300,
+                  grid: np.ndarray = None,
+                  grid_points: int = 500,
+                  pull_dir_vec: tuple = None,
+                  velocity: float = None,
+                  workers: int = 1,
+                  out_file: str = "smd_jarzynski_pmf.csv",
+                  out_file_delimiter: str = " \t ",
+                  out_format: str = "text",
+                  work_out_file: str = None,
+                  n_bootstrap: int = 0,
+                  bootstrap_ci: float = 0.95,
+                  bootstrap_seed: int = None) -> dict:
+    """
+    Batched Jarzynski analysis of SMD replicas: work integration (in parallel), alignment on a common grid
+    and PMF estimates (see work_matrix and jarzynski_estimates)
+
+    @param replicas: list of replicas, each a NAMD .log file or a list of .log files of a restart chain
+    @param temp: Temperature (K)
+    @param out_file: output file, with columns extension, work_mean, work_std, pmf_jarzynski, pmf_cumulant
+    @param out_format: "text" for a delimited text file, or "npy" for a binary time series (see namd_energy.load_series)
+    @param work_out_file: if given, the work matrix is saved to this .npz file (arrays "grid", "work" and "replicas"),
+                          ex. for bootstrap error estimates
+    @param n_bootstrap: number of bootstrap resamples for error bars of the PMF estimates (see bootstrap_pmf), 0 to skip
+    @param bootstrap_ci: confidence level of the bootstrap interval
+    @param bootstrap_seed: seed of the bootstrap random streams, None for a random seed
+
+    @return dict of arrays over the grid, "extension" along with the ones of jarzynski_estimates
+    """
+
+    if out_format not in ("text", "npy"):
+        raise ValueError(f"out_format must be one of 'text' or 'npy', given: '{out_format}'")
+
+    replicas = list(replicas)
+    grid, work = work_matrix(replicas, grid=grid, grid_points=grid_points,
+                             pull_dir_vec=pull_dir_vec, velocity=velocity, workers=workers)
+
+    res = {"extension": grid}
+    res.update(jarzynski_estimates(work, temp=temp))
+    if n_bootstrap > 0:
+        res.update(bootstrap_pmf(work, temp=temp, n_bootstrap=n_bootstrap, ci=bootstrap_ci,
+                                 seed=bootstrap_seed, workers=workers))
+    columns = list(res.keys())
+
+    if work_out_file:
+        np.savez(work_out_file, grid=grid, work=work, replicas=np.array([str(r) for r in replicas]))
+
+    if out_format == "npy":
+        records = np.empty(len(grid), dtype=[(c, np.float64) for c in columns])
+        for c in columns:
+            records[c] = res[c]
+
+        save_series(out_file, records, meta={
+            "source_files": [str(r) for r in replicas],
+            "temp": temp
+        })
+    else:
+        with open(out_file, "w") as out_fd:
+            out_fd.write(f"# Jarzynski PMF from {len(replicas)} SMD replicas at T = {temp} K\n")
+            out_fd.write(out_file_delimiter.join(columns))
+            out_fd.write("".join("\n" + out_file_delimiter.join(map(str, row))
+                                 for row in zip(*(res[c].tolist() for c in columns))))
+
+    print(f"INFO: Jarzynski PMF of {len(replicas)} replicas written to file: '{out_file}'")
+    return res
+
+
+if __name__ == "__main__":
+    # TODO: set input parameters
+    replicas = sorted(glob.glob("ubq_ww_pcv*.log"))     # one .log file per replica (or a list of .log files of a restart chain)
+    temp = 300              # Temperature (K)
+    grid_points = 500       # points of the common extension grid
+    pull_dir_vec = None     # None to read from "Info: SMD DIRECTION" of the .log files
+    velocity = None         # Å/timestep, None to read from "Info: SMD VELOCITY" of the .log files
+    workers = 4             # number of worker processes
+
+    out_file = "smd_jarzynski_pmf.csv"
+    out_file_delimiter = " \t "
+    out_format = "text"     # "text" for delimited text, or "npy" for binary .npy + .json metadata
+    work_out_file = "smd_work.npz"      # work matrix of all replicas on the grid, or None
+
+    n_bootstrap = 1000      # bootstrap resamples for PMF error bars, 0 to skip
+    bootstrap_ci = 0.95     # confidence level of the bootstrap interval
+    bootstrap_seed = None   # int for reproducible error bars
+
+    jarzynski_pmf(replicas=replicas,
+                  temp=temp,
+                  grid_points=grid_points,
+                  pull_dir_vec=pull_dir_vec,
+                  velocity=velocity,
+                  workers=workers,
+                  out_file=out_file,
+                  out_file_delimiter=out_file_delimiter,
+                  out_format=out_format,
+                  work_out_file=work_out_file,
+                  n_bootstrap=n_bootstrap,
+                  bootstrap_ci=bootstrap_ci,
+                  bootstrap_seed=bootstrap_seed)
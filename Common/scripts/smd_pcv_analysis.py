@@ -21,6 +21,8 @@ USAGE:
 2. go to __name__ == __main__ section and set input parameters
 3. run with "python smd_pcv_analysis.py"
 
+NOTE: .log files may be compressed (gzip, bz2 or xz), and are decompressed on the fly
+
 @see analyze_smd_pcv(namd_log_files: [str, list],
                     pull_dir_vec: tuple = None,
                     fixed_atoms_com_pos: tuple = None,
@@ -28,6 +30,12 @@ USAGE:
                     out_file_delimiter="\t")
 """
 import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib import recfunctions as rfn
+
+from namd_energy import SMD_TITLES, extract_log_records, iter_log_records, save_series
 
 
 def vec_add(v1, v2):
@@ -86,11 +94,221 @@ def calculate_smd(timestep: int,
     return timestep, force_mag, smd_com_displacement, smd_fix_dist
 
 
+def load_smd_records(namd_log_files: [str, list]) -> np.ndarray:
+    """
+    Loads all SMD records of NAMD .log file(s) in a single pass (see namd_energy.extract_log_records)
+
+    @return float64 array of shape (N, 7), columns: timestep, COM position (x, y, z) and force (fx, fy, fz)
+    """
+
+    smd = extract_log_records(namd_log_files, record_types="SMD")["SMD"]
+    if smd is None:
+        return np.empty((0, len(SMD_TITLES)), dtype=np.float64)
+    return rfn.structured_to_unstructured(smd, dtype=np.float64)
+
+
+def calculate_smd_array(smd: np.ndarray,
+                        pull_dir_unit_vec: tuple = None,
+                        fixed_atoms_com_pos: tuple = None,
+                        smd_pos_ref: tuple = None) -> dict:
+    """
+    Vectorized calculate_smd() over all SMD records at once
+
+    @param smd: SMD records, array of shape (N, 7) (see load_smd_records)
+    @param pull_dir_unit_vec: unit vector along the pull, or None for absolute quantities
+    @param fixed_atoms_com_pos: position of COM of fixed atom(s), or None
+    @param smd_pos_ref: reference position of COM of SMD atom(s) for the displacement, or None for the first record
+
+    @return dict of columns {"timestep", "smd_com_force", "smd_com_displacement", ["smd_fixed_dist"]}, each of shape (N,)
+    """
+
+    pos = smd[:, 1:4]
+    force = smd[:, 4:7]
+    if smd_pos_ref is not None:
+        disp = pos - np.array(smd_pos_ref, dtype=np.float64)
+    else:
+        disp = pos - pos[0] if len(pos) else pos  # displacement from the first position
+
+    # components are summed in the same order as vec_dot and vec_mag, so results match calculate_smd exactly
+    if pull_dir_unit_vec:
+        ux, uy, uz = pull_dir_unit_vec
+        force_mag = force[:, 0] * ux + force[:, 1] * uy + force[:, 2] * uz
+        smd_com_displacement = disp[:, 0] * ux + disp[:, 1] * uy + disp[:, 2] * uz
+    else:
+        force_mag = np.sqrt(force[:, 0] * force[:, 0] + force[:, 1] * force[:, 1] + force[:, 2] * force[:, 2])
+        smd_com_displacement = np.sqrt(disp[:, 0] * disp[:, 0] + disp[:, 1] * disp[:, 1] + disp[:, 2] * disp[:, 2])
+
+    res = {
+        "timestep": smd[:, 0].astype(np.int64),
+        "smd_com_force": force_mag,
+        "smd_com_displacement": smd_com_displacement
+    }
+
+    if fixed_atoms_com_pos:
+        d = pos - np.array(fixed_atoms_com_pos, dtype=np.float64)
+        res["smd_fixed_dist"] = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1] + d[:, 2] * d[:, 2])
+
+    return res
+
+
+class ForceExtensionBins:
+    """
+    Streaming binned average of SMD force vs extension, with O(bins) memory
+
+    Keeps count, mean and sum of squared deviations (M2) of force in each extension bin. Blocks of records are
+    combined per bin by Chan's pairwise update, so partial states from different replicas or worker processes
+    can be merged exactly (see merge()). Records outside the bin range are ignored
+    """
+
+    def __init__(self, x_min: float, x_max: float, bin_width: float):
+        self.edges = np.arange(x_min, x_max + bin_width * 0.5, bin_width, dtype=np.float64)
+        if len(self.edges) < 2:
+            raise ValueError(f"Extension range [{x_min}, {x_max}] must span at least one bin of width {bin_width}")
+
+        bins = len(self.edges) - 1
+        self.count = np.zeros(bins, dtype=np.int64)
+        self.mean = np.zeros(bins, dtype=np.float64)
+        self.m2 = np.zeros(bins, dtype=np.float64)
+
+    def _combine(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+        # Chan et al. pairwise update, per bin
+        total = self.count + count
+        nz = total > 0
+        delta = mean - self.mean
+        frac = np.divide(count, total, out=np.zeros_like(self.mean), where=nz)
+        self.mean = self.mean + delta * frac
+        self.m2 = self.m2 + m2 + (delta * delta) * self.count * frac
+        self.count = total
+
+    def update(self, extension: np.ndarray, force: np.ndarray):
+        bins = len(self.count)
+        idx = np.searchsorted(self.edges, extension, side="right") - 1
+        idx[extension == self.edges[-1]] = bins - 1  # last bin is closed
+        valid = (idx >= 0) & (idx < bins)
+        idx, force = idx[valid], force[valid]
+        if not len(idx):
+            return
+
+        count = np.bincount(idx, minlength=bins)
+        mean = np.divide(np.bincount(idx, weights=force, minlength=bins), count,
+                         out=np.zeros(bins, dtype=np.float64), where=count > 0)
+        m2 = np.bincount(idx, weights=np.square(force - mean[idx]), minlength=bins)
+        self._combine(count, mean, m2)
+
+    def merge(self, other: "ForceExtensionBins") -> "ForceExtensionBins":
+        """
+        Merges the partial state of another ForceExtensionBins (over the same bins) into this one
+        """
+
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("Cannot merge force-extension bins with different bin edges")
+        self._combine(other.count, other.mean, other.m2)
+        return self
+
+    def finish(self) -> dict:
+        """
+        @return dict of arrays over the bins: "extension" (bin center), "count", "force_mean", "force_std" and
+                "force_sem" (standard error of the mean). Statistics of empty bins are NaN
+        """
+
+        nz = self.count > 0
+        var = np.divide(self.m2, self.count, out=np.full(len(self.count), np.nan), where=nz)
+        return {
+            "extension": (self.edges[:-1] + self.edges[1:]) / 2,
+            "count": self.count,
+            "force_mean": np.where(nz, self.mean, np.nan),
+            "force_std": np.sqrt(var),
+            "force_sem": np.sqrt(np.divide(var, self.count, out=np.full(len(self.count), np.nan), where=nz))
+        }
+
+
+def _replica_force_extension_bins(namd_log_files: [str, list],
+                                  bins: ForceExtensionBins,
+                                  extension_col: str,
+                                  pull_dir_vec: tuple = None,
+                                  fixed_atoms_com_pos: tuple = None) -> ForceExtensionBins:
+    """
+    Accumulates the SMD records of a replica into bins, chunk by chunk. Unit of work of binned_force_extension
+    """
+
+    first_pos_vec = None
+    for _, smd in iter_log_records(namd_log_files, record_types="SMD"):
+        smd = rfn.structured_to_unstructured(smd, dtype=np.float64)
+        if first_pos_vec is None:
+            first_pos_vec = tuple(smd[0, 1:4])
+
+        out = calculate_smd_array(smd,
+                                  pull_dir_unit_vec=pull_dir_vec,
+                                  fixed_atoms_com_pos=fixed_atoms_com_pos,
+                                  smd_pos_ref=first_pos_vec)
+        bins.update(out[extension_col], out["smd_com_force"])
+    return bins
+
+
+def binned_force_extension(replicas: list,
+                           x_min: float,
+                           x_max: float,
+                           bin_width: float,
+                           extension_col: str = "smd_com_displacement",
+                           pull_dir_vec: tuple = None,
+                           fixed_atoms_com_pos: tuple = None,
+                           workers: int = 1,
+                           out_file: str = "smd_pcv_force_vs_extension.csv",
+                           out_file_delimiter: str = " \t ") -> dict:
+    """
+    Binned average of SMD force (smd_com_force) vs extension over any number of replicas (see ForceExtensionBins).
+    Each replica is streamed in chunks and accumulated into its own bins in a worker process, and the partial bins
+    are merged at the end
+
+    @param replicas: list of replicas, each a NAMD .log file or a list of .log files of a restart chain
+    @param x_min, x_max, bin_width: extension bins (in A)
+    @param extension_col: "smd_com_displacement" or "smd_fixed_dist" (needs fixed_atoms_com_pos)
+    @param pull_dir_vec: the direction of applied pull or None, see analyze_smd_pcv
+    @param fixed_atoms_com_pos: the position of COM of fixed atom(s), see analyze_smd_pcv
+    @param workers: number of worker processes, one replica per task
+    @param out_file: output file, with columns extension, count, force_mean, force_std, force_sem. None to skip
+
+    @return dict of arrays over the bins, see ForceExtensionBins.finish()
+    """
+
+    if extension_col not in ("smd_com_displacement", "smd_fixed_dist"):
+        raise ValueError(f"extension_col must be one of 'smd_com_displacement' or 'smd_fixed_dist', given: '{extension_col}'")
+    if extension_col == "smd_fixed_dist" and not fixed_atoms_com_pos:
+        raise ValueError("fixed_atoms_com_pos is required for extension_col 'smd_fixed_dist'")
+
+    pull_dir_vec = vec_normalize(pull_dir_vec) if is_vec_nonzero(pull_dir_vec) else None
+    replicas = list(replicas)
+    args = ([ForceExtensionBins(x_min, x_max, bin_width) for _ in replicas], [extension_col] * len(replicas),
+            [pull_dir_vec] * len(replicas), [fixed_atoms_com_pos] * len(replicas))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partial_bins = list(executor.map(_replica_force_extension_bins, replicas, *args))
+    else:
+        partial_bins = list(map(_replica_force_extension_bins, replicas, *args))
+
+    bins = ForceExtensionBins(x_min, x_max, bin_width)
+    for b in partial_bins:
+        bins.merge(b)
+    res = bins.finish()
+
+    if out_file:
+        columns = list(res.keys())
+        with open(out_file, "w") as out_fd:
+            out_fd.write(f"# SMD force ({extension_col} bins) averaged over {len(replicas)} replicas\n")
+            out_fd.write(out_file_delimiter.join(columns))
+            out_fd.write("".join("\n" + out_file_delimiter.join(map(str, row))
+                                 for row in zip(*(res[c].tolist() for c in columns))))
+
+    return res
+
+
 def analyze_smd_pcv(namd_log_files: [str, list],
                     pull_dir_vec: tuple = None,
                     fixed_atoms_com_pos: tuple = None,
                     out_file: str = "smd_pcv_force_displacement.csv",
-                    out_file_delimiter: str = " \t "):
+                    out_file_delimiter: str = " \t ",
+                    out_format: str = "text"):
     """
     Extracts and analyzes Constant-Velocity Pull (pcv) SMD information from NAMD .log file
 
@@ -112,6 +330,8 @@ def analyze_smd_pcv(namd_log_files: [str, list],
                                      a reference for calculating the distance of COM of SMD atom(s) at each frame
     @:parameter out_file: name of the output file
     @:parameter out_file_delimiter: delimiter for the output
+    @:parameter out_format: "text" for a delimited text file, or "npy" for a binary time series (.npy with a .json
+                            metadata sidecar) that can be memory-mapped with namd_energy.load_series()
     """
 
     # Handling arguments --------------------------------------
@@ -123,41 +343,38 @@ def analyze_smd_pcv(namd_log_files: [str, list],
     else:
         pull_dir_vec = None
 
+    if out_format not in ("text", "npy"):
+        raise ValueError(f"out_format must be one of 'text' or 'npy', given: '{out_format}'")
+
     columns = ["timestep", "smd_com_force", "smd_com_displacement"]
     if fixed_atoms_com_pos:
         columns.append("smd_fixed_dist")
     # ---------------------------------------------------------
 
-    with open(out_file, "w+") as out_fd:
-
-        first_pos_vec = None
-        for log_file in namd_log_files:
-            with open(log_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if (line.startswith("SMD") and (words := line.split())) and words[0] == "SMD":
-                        if len(words) != 8:
-                            pass  # should not happen
-                        else:
-                            ts = int(words[1])
-                            pos_vec = (float(words[2]), float(words[3]), float(words[4]))
-                            force_vec = (float(words[5]), float(words[6]), float(words[7]))
+    out = calculate_smd_array(load_smd_records(namd_log_files),
+                              pull_dir_unit_vec=pull_dir_vec,
+                              fixed_atoms_com_pos=fixed_atoms_com_pos)
 
-                            # reference for calculating displacement of the COM of SMD atom(s)
-                            if first_pos_vec is None:
-                                first_pos_vec = pos_vec
+    if out_format == "npy":
+        dtype = np.dtype([(c, np.int64 if c == "timestep" else np.float64) for c in columns])
+        records = np.empty(len(out["timestep"]), dtype=dtype)
+        for c in columns:
+            records[c] = out[c]
 
-                                # write csv header before writing any record
-                                out_fd.write(out_file_delimiter.join(columns))
+        save_series(out_file, records,
+                    meta={
+                        "source_files": list(namd_log_files),
+                        "pull_dir_vec": list(pull_dir_vec) if pull_dir_vec else None,
+                        "fixed_atoms_com_pos": list(fixed_atoms_com_pos) if fixed_atoms_com_pos else None
+                    })
+        return
 
-                            out = calculate_smd(timestep=ts,
-                                                force_vec=force_vec,
-                                                smd_pos=pos_vec,
-                                                smd_pos_ref=first_pos_vec,
-                                                pull_dir_unit_vec=pull_dir_vec,
-                                                fixed_atoms_com_pos=fixed_atoms_com_pos)
-
-                            out_fd.write("\n" + out_file_delimiter.join(map(str, out)))
+    with open(out_file, "w+") as out_fd:
+        if len(out["timestep"]):
+            # csv header, followed by all records in a single write
+            out_fd.write(out_file_delimiter.join(columns)
+                         + "".join("\n" + out_file_delimiter.join(map(str, row))
+                                   for row in zip(*(out[c].tolist() for c in columns))))
 
 
 if __name__ == "__main__":
@@ -168,9 +385,30 @@ if __name__ == "__main__":
 
     out_file = "smd_pcv_force_displacement.csv"
     out_file_delimiter = " \t "
+    out_format = "text"     # "text" for delimited text, or "npy" for binary .npy + .json metadata
 
     analyze_smd_pcv(namd_log_files=namd_log_files,
                     pull_dir_vec=pull_dir_vec,
                     fixed_atoms_com_pos=fixed_atoms_com_pos,
                     out_file=out_file,
-                    out_file_delimiter=out_file_delimiter)
+                    out_file_delimiter=out_file_delimiter,
+                    out_format=out_format)
+
+    ## Binned force vs extension averaged over replicas (optional)
+    bin_replicas = None     # TODO: list of replica .log files (or restart chains) to average, None to skip
+    bin_extension_col = "smd_com_displacement"      # or "smd_fixed_dist"
+    bin_x_min, bin_x_max, bin_width = 0, 30, 0.25   # extension bins (in A)
+    bin_workers = 4         # number of worker processes
+    bin_out_file = "smd_pcv_force_vs_extension.csv"
+
+    if bin_replicas:
+        binned_force_extension(replicas=bin_replicas,
+                               x_min=bin_x_min,
+                               x_max=bin_x_max,
+                               bin_width=bin_width,
+                               extension_col=bin_extension_col,
+                               pull_dir_vec=pull_dir_vec,
+                               fixed_atoms_com_pos=fixed_atoms_com_pos,
+                               workers=bin_workers,
+                               out_file=bin_out_file,
+                               out_file_delimiter=out_file_delimiter)
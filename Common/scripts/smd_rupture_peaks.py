@@ -0,0 +1,179 @@
+"""
+Rupture (unfolding) force peaks of Constant-Velocity Pull (pcv) SMD replicas
+
+For each replica (NAMD .log file) the SMD force along the pull direction is smoothed with a moving average, and
+rupture peaks are found by their prominence (scipy.signal.find_peaks), along with the extension and timestep at
+each peak. Replicas are processed in parallel worker processes, and grouped by pull velocity
+(read from "Info: SMD VELOCITY" of each .log file) into one summary table per velocity.
+
+Summary table columns:
+    replica, peak, timestep, pull_coord, smd_com_displacement, force, prominence, is_max
+where pull_coord = v * (timestep - first_timestep) is the distance travelled by the dummy atom, force is the smoothed
+force at the peak, and is_max marks the highest peak (the rupture force) of each replica.
+
+USAGE:
+1. Copy this script (along with namd_energy.py and smd_pcv_analysis.py) to your working dir
+2. go to __name__ == __main__ section and set input parameters
+3. run with "python smd_rupture_peaks.py"
+4. Creates one output file per pull velocity, ex. "rupture_peaks_v0.001.csv"
+
+## UNITS: Distance (Å), Force (pN), Velocity (Å/timestep)
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib import recfunctions as rfn
+from scipy.signal import find_peaks
+
+from namd_energy import extract_log_records, smd_params
+from smd_pcv_analysis import calculate_smd_array, is_vec_nonzero, vec_normalize
+
+PEAK_COLUMNS = ["replica", "peak", "timestep", "pull_coord", "smd_com_displacement", "force", "prominence", "is_max"]
+
+
+def moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Centered moving average over window points (shrinking at the ends), by a cumulative sum
+    """
+
+    if window <= 1 or len(values) == 0:
+        return values
+
+    half = window // 2
+    csum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    i = np.arange(len(values))
+    lo = np.maximum(i - half, 0)
+    hi = np.minimum(i + half + 1, len(values))
+    return (csum[hi] - csum[lo]) / (hi - lo)
+
+
+def replica_peaks(log_file: str,
+                  pull_dir_vec: tuple = None,
+                  smooth_window: int = 50,
+                  prominence: float = 100,
+                  min_distance: int = 1) -> dict:
+    """
+    Rupture peaks of a single SMD replica. Unit of work of the parallel batch (see rupture_peaks)
+
+    @param log_file: NAMD .log file of the replica
+    @param pull_dir_vec: pull direction, or None to read it from "Info: SMD DIRECTION"
+    @param smooth_window: number of SMD records in the moving average window
+    @param prominence: minimum prominence of a peak (pN)
+    @param min_distance: minimum number of SMD records between peaks
+
+    @return dict with "replica", "velocity" (None if not in the .log file), "records" (number of SMD records)
+            and "peaks", a dict of arrays
+            "timestep", "pull_coord", "smd_com_displacement", "force" and "prominence"
+    """
+
+    res = extract_log_records(log_file, record_types=["SMD", "INFO"])
+    params = smd_params(res["INFO"] or [])
+    velocity = params.get("velocity")
+
+    if not is_vec_nonzero(pull_dir_vec):
+        pull_dir_vec = params.get("direction")
+
+    empty = np.empty((0,), dtype=np.float64)
+    peaks = dict((c, empty) for c in ("timestep", "pull_coord", "smd_com_displacement", "force", "prominence"))
+    if res["SMD"] is None:
+        return {"replica": log_file, "velocity": velocity, "records": 0, "peaks": peaks}
+
+    smd = rfn.structured_to_unstructured(res["SMD"], dtype=np.float64)
+    out = calculate_smd_array(smd, pull_dir_unit_vec=vec_normalize(pull_dir_vec) if is_vec_nonzero(pull_dir_vec) else None)
+    force = moving_average(out["smd_com_force"], smooth_window)
+
+    idx, props = find_peaks(force, prominence=prominence, distance=max(1, min_distance))
+    ts = smd[:, 0]
+    peaks = {
+        "timestep": ts[idx],
+        "pull_coord": (velocity or 0) * (ts[idx] - ts[0]),
+        "smd_com_displacement": out["smd_com_displacement"][idx],
+        "force": force[idx],
+        "prominence": props["prominences"]
+    }
+    return {"replica": log_file, "velocity": velocity, "records": len(smd), "peaks": peaks}
+
+
+def rupture_peaks(replicas: list,
+                  pull_dir_vec: tuple = None,
+                  smooth_window: int = 50,
+                  prominence: float = 100,
+                  min_distance: int = 1,
+                  workers: int = 1,
+                  out_file_prefix: str = "rupture_peaks",
+                  out_file_delimiter: str = " \t ") -> dict:
+    """
+    Rupture peaks of many SMD replicas (see replica_peaks), in parallel, summarized per pull velocity
+
+    @param replicas: list of NAMD .log files, one per replica
+    @param workers: number of worker processes, one replica per task
+    @param out_file_prefix: output files are named "<prefix>_v<velocity>.csv", one per velocity. None to skip
+
+    @return dict {velocity: list of rows}, each row a tuple of PEAK_COLUMNS
+    """
+
+    replicas = list(replicas)
+    n = len(replicas)
+    args = ([pull_dir_vec] * n, [smooth_window] * n, [prominence] * n, [min_distance] * n)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(replica_peaks, replicas, *args))
+    else:
+        results = list(map(replica_peaks, replicas, *args))
+
+    tables = {}
+    for r in results:
+        if not r["records"]:
+            print(f"WARNING: No SMD records in '{r['replica']}', skipped")
+            continue
+
+        rows = tables.setdefault(r["velocity"], [])
+        p = r["peaks"]
+        max_i = int(np.argmax(p["force"])) if len(p["force"]) else -1
+        for i in range(len(p["force"])):
+            rows.append((os.path.basename(r["replica"]), i, int(p["timestep"][i]), p["pull_coord"][i].item(),
+                         p["smd_com_displacement"][i].item(), p["force"][i].item(), p["prominence"][i].item(),
+                         int(i == max_i)))
+
+    for velocity, rows in tables.items():
+        rupture = np.array([row[5] for row in rows if row[7]])
+        print(f"INFO: Pull velocity {velocity} Å/timestep -> {len(rows)} peaks"
+              + (f", rupture force {rupture.mean():.2f} ± {rupture.std():.2f} pN over {len(rupture)} replicas"
+                 if len(rupture) else ""))
+
+        if out_file_prefix:
+            out_file = f"{out_file_prefix}_v{velocity}.csv"
+            with open(out_file, "w") as out_fd:
+                out_fd.write(f"# SMD rupture peaks at pull velocity {velocity} Å/timestep"
+                             f" | smooth_window: {smooth_window} | prominence: {prominence} pN\n")
+                out_fd.write(out_file_delimiter.join(PEAK_COLUMNS))
+                out_fd.write("".join("\n" + out_file_delimiter.join(map(str, row)) for row in rows))
+
+    return tables
+
+
+if __name__ == "__main__":
+    # TODO: set input parameters
+    replica_dir = "."               # directory of replica .log files
+    replica_pattern = "*.log"       # glob pattern of replica .log files in replica_dir
+    pull_dir_vec = None             # None to read from "Info: SMD DIRECTION" of each .log file
+    smooth_window = 50              # SMD records in the moving average window
+    prominence = 100                # minimum peak prominence (pN)
+    min_distance = 1                # minimum SMD records between peaks
+    workers = 4                     # number of worker processes
+
+    out_file_prefix = "rupture_peaks"
+    out_file_delimiter = " \t "
+
+    rupture_peaks(replicas=sorted(glob.glob(os.path.join(replica_dir, replica_pattern))),
+                  pull_dir_vec=pull_dir_vec,
+                  smooth_window=smooth_window,
+                  prominence=prominence,
+                  min_distance=min_distance,
+                  workers=workers,
+                  out_file_prefix=out_file_prefix,
+                  out_file_delimiter=out_file_delimiter)
@@ -6,12 +6,14 @@ import scipy
 import matplotlib.pyplot as plt
 from matplotlib.figure import figaspect
 
+from ext_traj import load_frame_ext, msm_committor, sp_boundary_sweep, splitting_probability, transition_counts
+
 ########################################################################
 ## Splitting Probability Sp(x) from Extension Trajectory
 ########################################################################
 
 ## Usage
-# 1. Copy script to working dir
+# 1. Copy script to working dir (along with ext_traj.py)
 # 2. INPUT: set extension vs frame file (ext over time)
 # 3. INPUT: set Temp, LEFT-RIGHT absorbing boundaries, and BINS
 # 4. run with "python sp_traj.py"
@@ -49,13 +51,26 @@ frame_bin_count = -1
 ext_bin_size = 1.0  # Angstrom(s) in 1 bin
 frame_bin_size = 10  # Number of frames in 1 bin = femto_secs_in_bin / frame_step_fs
 
+## Sp Estimator
+# "hitting": count the visits to each bin that reach x_a before x_b (needs many returns to every bin)
+# "msm": committor of a Markov State Model i.e. lag-τ transitions between the extension bins (statistically cheaper)
+sp_method = "hitting"
+msm_lag = 1  # lag time τ (in frame bins) of the "msm" transitions
+msm_reversible = True  # Symmetrize transition counts (detailed balance)
+
+## Boundary Sweep (optional): Sp(x) and Reconstructed PMF for many (x_a, x_b) pairs over the same discrete trajectory
+# ex. [(x_a, x_b) for x_a in (12, 13, 14, 15) for x_b in (27, 28, 29)]
+sweep_boundary_pairs = []  # TODO: list of (x_a, x_b) absorbing boundaries (in Å). Empty to skip
+sweep_workers = 4  # Number of threads
+
 ## OUTPUT ------------------------------------------------------------------
 output_data_file = "sp_traj1.csv"
 output_fig_file = "sp_traj1.pdf"  # (optional). Leave blank to not save figure
+sweep_output_file = "sp_traj_sweep.csv"  # tidy table of the boundary sweep: one row per (x_a, x_b, extension bin)
 
 ## ----------------------------------------------------------------------------
 # Frame vs Extension DataFrame
-frame_ext_df: pd.DataFrame = pd.read_csv(frame_vs_ext_file, sep=r"\s+", comment=COMMENT_TOKEN, names=("FRAME", "EXT"))
+frame_ext_df: pd.DataFrame = load_frame_ext(frame_vs_ext_file)  # parsed once, then loaded from a .npy sidecar
 
 if frame_index_start >= 0:
     frame_ext_df = frame_ext_df[frame_ext_df["FRAME"] >= frame_index_start]
@@ -102,6 +117,26 @@ ext_bin_series, ext_bins = pd.cut(discrete_df["EXT"], bins=ext_bin_count, labels
 
 discrete_df["EXT_BIN"] = ext_bin_series
 
+## Boundary Sweep
+if sweep_boundary_pairs:
+    sweep_df = sp_boundary_sweep(discrete_df["EXT_BIN"].to_numpy(),
+                                 start_positions=discrete_df.index.to_numpy(),
+                                 ext_bins=ext_bins,
+                                 boundary_pairs=sweep_boundary_pairs,
+                                 kbt=K_b * T,
+                                 workers=sweep_workers)
+
+    if sweep_output_file:
+        with open(sweep_output_file, "w") as out_p:
+            out_p.write(f"{COMMENT_TOKEN} -------------- Splitting Probability Boundary Sweep from Simulation Trajectory ----------------\n")
+            out_p.write(f"{COMMENT_TOKEN} INPUT Frame vs Extension file: \"{frame_vs_ext_file}\"\n")
+            out_p.write(f"{COMMENT_TOKEN} INPUT Frame Range => frame_index_start: {frame_index_start}  |  frame_index_end: {frame_index_end}\n")
+            out_p.write(f"{COMMENT_TOKEN} INPUT Bin Count => Frame Bins: {frame_bin_count}  |  Extension Bins: {ext_bin_count}\n")
+            out_p.write(f"{COMMENT_TOKEN} INPUT Thermal Energy (KbT): {K_b * T} kcal/mol/K\n")
+            out_p.write(f"{COMMENT_TOKEN} ---------------------------------------\n")
+
+            sweep_df.to_csv(out_p, mode="a", sep="\t", header=True, index=False, index_label=False)
+
 x_a_bin = find_bin(x_a, ext_bins)
 x_b_bin = find_bin(x_b, ext_bins)
 
@@ -120,29 +155,27 @@ _ext_bin_series = discrete_df["EXT_BIN"]
 _ext_bin_range = np.arange(x_a_bin, x_b_bin + 1)
 
 # Calculating SP (fold): traj reaches folded state before unfolded state
-for i, x_bin in enumerate(_ext_bin_range):
-    _df = _ext_bin_series.loc[_ext_bin_series == x_bin]
-    _count = len(_df.index)
-
-    if _count == 0:
-        # Should not happen
-        print(f"WARNING: EXT_BIN {x_bin} NOT FOUND. Skipping...")
-        continue
-
-    _v = 0
-    for frame_bin in _df.index.values:
-        _ahead = _ext_bin_series.iloc[frame_bin:]
-
-        # Hitting function
-        for __xbin in _ahead:
-            if __xbin == x_a_bin:  # TODO: change strict equality
-                _v += 1
-                break
+if sp_method == "msm":
+    # Committor of the lag-τ transition matrix between extension bins
+    _msm_counts = transition_counts(_ext_bin_series.to_numpy(), n_bins=len(ext_bins) - 1, lag=msm_lag)
+    _sp = np.nan_to_num(msm_committor(_msm_counts, x_a_bin, x_b_bin, reversible=msm_reversible)[_ext_bin_range])
+    _counts = np.asarray(_msm_counts.sum(axis=1)).ravel()[_ext_bin_range]
+elif sp_method == "hitting":
+    # The trajectory is followed from position FRAME_BIN of each visit, with the "next hit" of x_a and x_b
+    # precomputed for every position in one backward pass (linear time)
+    _sp, _counts = splitting_probability(_ext_bin_series.to_numpy(),
+                                         start_positions=_ext_bin_series.index.to_numpy(),
+                                         x_a_bin=x_a_bin,
+                                         x_b_bin=x_b_bin)
+else:
+    print(f"ERR: Invalid sp_method: \"{sp_method}\", must be one of [hitting, msm]")
+    exit(-1)
 
-            if __xbin == x_b_bin:  # TODO: change strict equality
-                break
+for x_bin in _ext_bin_range[_counts == 0]:
+    # Should not happen
+    print(f"WARNING: EXT_BIN {x_bin} NOT FOUND. Skipping...")
 
-    split_prob[i] = _v / _count
+split_prob[:] = _sp
 
 res_df = pd.DataFrame()
 
@@ -175,6 +208,7 @@ if output_data_file:
         out_p.write(f"{COMMENT_TOKEN} INPUT Frame vs Extension file: \"{frame_vs_ext_file}\"\n")
         out_p.write(f"{COMMENT_TOKEN} INPUT Frame Range => frame_index_start: {frame_index_start}  |  frame_index_end: {frame_index_end}\n")
         out_p.write(f"{COMMENT_TOKEN} INPUT Absorbing Boundaries => x_a (LEFT): {x_a}  |  x_b (RIGHT): {x_b}\n")
+        out_p.write(f"{COMMENT_TOKEN} INPUT Sp Method: {sp_method}" + (f"  |  lag: {msm_lag}  |  reversible: {msm_reversible}" if sp_method == "msm" else "") + "\n")
         out_p.write(f"{COMMENT_TOKEN} INPUT Bin Count => Frame Bins: {frame_bin_count}  |  Extension Bins: {ext_bin_count}\n")
         out_p.write(f"{COMMENT_TOKEN} INPUT Thermal Energy (KbT): {K_b * T} kcal/mol/K\n")
         out_p.write(f"{COMMENT_TOKEN} ---------------------------------------\n")
@@ -2,17 +2,19 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from ext_traj import load_frame_ext, reconstruct_pmf, sp_windows, stitch_window_pmfs
+
 
 ########################################################################
 ## TEST: Splitting Probability Sp(x) from Extension Trajectory in Small Windows
 ########################################################################
 
 ## Usage
-# 1. Copy script to working dir
+# 1. Copy script to working dir (along with ext_traj.py)
 # 2. INPUT: set extension vs frame file (ext over time)
 # 3. INPUT: set Temp, LEFT-RIGHT absorbing boundaries, and BINS
 # 4. run with "python sp_traj_wins.py"
-# 5. Creates output file(s) "sp_traj-win-{i}.csv"
+# 5. Creates output file(s) "sp_traj-win{i}.csv", and the stitched PMF "sp_traj-stitched.csv"
 
 ## UNITS: Energy (kcal/mol), Distance (Å), T (K)
 
@@ -46,6 +48,7 @@ x_a = 10  # LEFT Absorbing Boundary - Folded state extension (in Å)
 x_b = 70  # RIGHT Absorbing Boundary - Unfolded state extension (in Å)
 
 window_count = 5    # Number of windows in Extension Range
+workers = 4         # Number of worker processes (windows are computed in parallel)
 
 ## Number of Spacial and Temporal Bins
 # -1 to use bin sizes (specified below) instead
@@ -61,93 +64,89 @@ output_file_name_prefix = "sp_traj"
 output_file_name_suffix = ".csv"
 
 ## ----------------------------------
-# Frame vs Extension DataFrame
-frame_ext_df: pd.DataFrame = pd.read_csv(frame_vs_ext_file, sep=r"\s+", comment="#", names=("FRAME", "EXT"))
-
-# Making the dataset DISCRETE over SPACE (EXT) and TIME (FRAME)
-if ext_bin_count <= 0:
-    ext_bin_count = int((frame_ext_df["EXT"].max() - frame_ext_df["EXT"].min()) // ext_bin_size)
-
-if frame_bin_count <= 0:
-    frame_bin_count = int(len(frame_ext_df["FRAME"]) // frame_bin_size)
-
-frame_ext_df["FRAME_BIN"] = pd.cut(frame_ext_df["FRAME"], bins=frame_bin_count, labels=False, right=False)
-
-discrete_df: pd.DataFrame = frame_ext_df[["FRAME_BIN", "EXT"]].groupby(by=["FRAME_BIN"]).mean()     # TODO: mean of ext in each time-bin
-ext_bin_series, ext_bins = pd.cut(discrete_df["EXT"], bins=ext_bin_count, labels=False, right=False, retbins=True)
-discrete_df["EXT_BIN"] = ext_bin_series
-
-## ------------------------- MAIN Calculation -------------------------------
-
-# x_a_bin = find_bin(x_a, ext_bins)
-# x_b_bin = find_bin(x_b, ext_bins)
-
-win_size = abs(x_b - x_a) / window_count
-res_dfs = []
-
-for i in range(0, (window_count * 2) - 1):
-    ws = x_a + (i * win_size / 2)
-    we = ws + win_size
-
-    print(f"Window {i + 1} => start: {ws} | end: {we}")
-
-    _df = discrete_df.loc[discrete_df["EXT"] >= ws].loc[discrete_df["EXT"] <= we]
-    _xa_bin = _df["EXT_BIN"].min()
-    _xb_bin = _df["EXT_BIN"].max()
-
-    _sample_count = _xb_bin - _xa_bin + 1
-    _split_prob = np.zeros((_sample_count, ), dtype=np.float32)
-
-    _ext_bin_range = np.arange(_xa_bin, _xb_bin + 1)
-
-    for i, x_bin in enumerate(_ext_bin_range):
-        __df = ext_bin_series.loc[ext_bin_series == x_bin]
-        __count = len(__df.index)
-
-        __v = 0
-        for frame_bin in __df.index.values:
-            __ahead = ext_bin_series.iloc[frame_bin:]
-
-            # Hitting function
-            for __xbin in __ahead:
-                if __xbin == _xa_bin:       # TODO: change strict equality
-                    __v += 1
-                    break
-
-                if __xbin == _xb_bin:          # TODO: change strict equality
-                    break
-
-        _split_prob[i] = __v / __count
-
-    res_df = pd.DataFrame({ "EXT_BIN": _ext_bin_range, "SP": _split_prob })
-
-    # PMF Reconstruction
-    grad = np.gradient(res_df["SP"], res_df["EXT_BIN"])
-
-    # TODO: smoothen gradient with Savitzky - Golay filter
-    # smooth_grad = scipy.signal.savgol_filter(grad, 5, 4)
-
-    # TODO: constant c to match segments
-    pmf_re = np.log(-grad * 1) * K_b * T
-    res_df["PMF_RE"] = pmf_re
-
-    ## Subsidiary Stuff
-    res_df["EXT_BIN_START"] = res_df["EXT_BIN"].apply(lambda x: ext_bins[x])
-    res_df["EXT_BIN_END"] = res_df["EXT_BIN"].apply(lambda x: ext_bins[x + 1])
-    res_df["EXT_BIN_MED"] = res_df["EXT_BIN"].apply(lambda x: (ext_bins[x] + ext_bins[x + 1]) / 2)
-
-    res_dfs.append(res_df)
-
-
-for i, _df in enumerate(res_dfs):
-    _df[["EXT_BIN", "EXT_BIN_START", "EXT_BIN_END", "EXT_BIN_MED", "SP", "PMF_RE"]].to_csv(f"{output_file_name_prefix}-win{i + 1}{output_file_name_suffix}", sep="\t", header=True, index=False, index_label=False)
-    plt.plot(_df["EXT_BIN_MED"], _df["PMF_RE"])
-
-plt.title("Reconstructed PMF in Windows")
-plt.xlabel("Extension (Å)")
-plt.ylabel("PMF (kcal/mol)")
-plt.show()
-
+if __name__ == "__main__":
+    # Frame vs Extension DataFrame
+    frame_ext_df: pd.DataFrame = load_frame_ext(frame_vs_ext_file)  # parsed once, then loaded from a .npy sidecar
+
+    # Making the dataset DISCRETE over SPACE (EXT) and TIME (FRAME)
+    if ext_bin_count <= 0:
+        ext_bin_count = int((frame_ext_df["EXT"].max() - frame_ext_df["EXT"].min()) // ext_bin_size)
+
+    if frame_bin_count <= 0:
+        frame_bin_count = int(len(frame_ext_df["FRAME"]) // frame_bin_size)
+
+    frame_ext_df["FRAME_BIN"] = pd.cut(frame_ext_df["FRAME"], bins=frame_bin_count, labels=False, right=False)
+
+    discrete_df: pd.DataFrame = frame_ext_df[["FRAME_BIN", "EXT"]].groupby(by=["FRAME_BIN"]).mean()     # TODO: mean of ext in each time-bin
+    ext_bin_series, ext_bins = pd.cut(discrete_df["EXT"], bins=ext_bin_count, labels=False, right=False, retbins=True)
+    discrete_df["EXT_BIN"] = ext_bin_series
+
+    ## ------------------------- MAIN Calculation -------------------------------
+
+    # x_a_bin = find_bin(x_a, ext_bins)
+    # x_b_bin = find_bin(x_b, ext_bins)
+
+    win_size = abs(x_b - x_a) / window_count
+    ext_values = discrete_df["EXT"].to_numpy()
+    ext_bin_values = discrete_df["EXT_BIN"].to_numpy()
+
+    window_bounds = []
+    for i in range(0, (window_count * 2) - 1):
+        ws = x_a + (i * win_size / 2)
+        we = ws + win_size
+
+        _in_win = ext_bin_values[(ext_values >= ws) & (ext_values <= we)]
+        if len(_in_win) == 0:
+            print(f"Window {i + 1} => start: {ws} | end: {we} -> not visited. Skipping...")
+            continue
+
+        print(f"Window {i + 1} => start: {ws} | end: {we}")
+        window_bounds.append((int(_in_win.min()), int(_in_win.max())))
+
+    # Hitting function over the shared discrete trajectory, all windows in parallel
+    win_results = sp_windows(ext_bin_values, start_positions=discrete_df.index.to_numpy(),
+                             window_bounds=window_bounds, workers=workers)
+
+    res_dfs = []
+    for (_xa_bin, _xb_bin), (_sp, _counts) in zip(window_bounds, win_results):
+        _ext_bin_range = np.arange(_xa_bin, _xb_bin + 1)
+        res_df = pd.DataFrame({ "EXT_BIN": _ext_bin_range, "SP": _sp.astype(np.float32) })
+
+        # PMF Reconstruction
+        # TODO: smoothen gradient with Savitzky - Golay filter
+        res_df["PMF_RE"] = reconstruct_pmf(res_df["SP"].to_numpy(), _ext_bin_range, K_b * T)
+
+        ## Subsidiary Stuff
+        res_df["EXT_BIN_START"] = ext_bins[_ext_bin_range]
+        res_df["EXT_BIN_END"] = ext_bins[_ext_bin_range + 1]
+        res_df["EXT_BIN_MED"] = (ext_bins[_ext_bin_range] + ext_bins[_ext_bin_range + 1]) / 2
+
+        res_dfs.append(res_df)
+
+    # Constant c to match segments: least squares offsets over the window overlaps
+    win_offsets, stitched_bins, stitched_pmf = stitch_window_pmfs([(_df["EXT_BIN"].to_numpy(), _df["PMF_RE"].to_numpy()) for _df in res_dfs])
+    stitched_df = pd.DataFrame({
+        "EXT_BIN": stitched_bins,
+        "EXT_BIN_START": ext_bins[stitched_bins],
+        "EXT_BIN_END": ext_bins[stitched_bins + 1],
+        "EXT_BIN_MED": (ext_bins[stitched_bins] + ext_bins[stitched_bins + 1]) / 2,
+        "PMF_RE": stitched_pmf
+    })
+
+    for i, _df in enumerate(res_dfs):
+        _df["PMF_RE_STITCHED"] = _df["PMF_RE"] + win_offsets[i]
+        _df[["EXT_BIN", "EXT_BIN_START", "EXT_BIN_END", "EXT_BIN_MED", "SP", "PMF_RE", "PMF_RE_STITCHED"]].to_csv(f"{output_file_name_prefix}-win{i + 1}{output_file_name_suffix}", sep="\t", header=True, index=False, index_label=False)
+        plt.plot(_df["EXT_BIN_MED"], _df["PMF_RE_STITCHED"], alpha=0.5, label=f"Window {i + 1}")
+
+    print(f"Window offsets (kcal/mol): {np.round(win_offsets, 4).tolist()}")
+    stitched_df.to_csv(f"{output_file_name_prefix}-stitched{output_file_name_suffix}", sep="\t", header=True, index=False, index_label=False)
+    plt.plot(stitched_df["EXT_BIN_MED"], stitched_df["PMF_RE"], "k--", label="Stitched")
+
+    plt.title("Reconstructed PMF in Windows")
+    plt.xlabel("Extension (Å)")
+    plt.ylabel("PMF (kcal/mol)")
+    plt.legend()
+    plt.show()
 
 # sample_count = x_b_bin - x_a_bin + 1
 # split_prob = np.zeros((sample_count, ), dtype=np.float32)